@@ -1,28 +1,244 @@
 from __future__ import annotations
 
+import asyncio
 import io
 import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
 import uuid
+from contextlib import ExitStack, asynccontextmanager, contextmanager
 from dataclasses import dataclass
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import cv2
 from PIL import Image
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from skimage.metrics import structural_similarity as ssim
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 # RasterIO is the easiest way to read OSCD GeoTIFFs
 import rasterio
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import transform as window_transform
+
+from utils.anomaly import HALO, SSIM_WIN, AnomalyEngine, anomaly_score, grayscale, normalize_
+from utils.assets import Encoder, LazyStaticFiles
+from utils.cache import BlobStore, ResultCache, cache_key, link_or_copy, sha256_file, tree_size
+from utils.cog import write_cog
+from utils.jobs import TERMINAL, JobScheduler, QueueFull, append_event, events_path, read_status, write_status
+from utils.metrics import anomaly_stats
+from utils.normalize import STRETCH_CACHE, set_content_id
+from utils.profiling import Counter, Gauge, Histogram, Registry, StageProfiler
+from utils.preview import ProgressivePreview
+from utils.pyramid import TILE, build_tasks, max_zoom, tile_path
+from utils.raster import BandPlan, iter_tiles, open_scene, overview_factor, preview_shape, read_preview, tile_grid
+from utils.regions import label_regions, regions_geojson
+from utils.render import apply_lut, blend_lut, heatmap, overlay, palette_lut, quantize
+from utils.runindex import RunIndex
+from utils.scenecache import DecodedSceneCache, scene_cache_key
+from utils.series import SeriesState
+from utils.uploads import ReceivedFile, UploadRejected, receive_files, receive_form
+
+
+logger = logging.getLogger(__name__)
 
 STATIC_DIR = Path("static")
 RUNS_DIR = STATIC_DIR / "runs"
 RUNS_DIR.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI(title="Satellite Anomaly Studio (MVP)")
+# Private (not served) storage: upload blobs by sha256, cached detect results
+DATA_DIR = Path("data")
+BLOBS = BlobStore(DATA_DIR / "blobs")
+RESULT_CACHE = ResultCache(
+    DATA_DIR / "results", max_bytes=int(os.environ.get("RESULT_CACHE_MAX_BYTES", 2 * 1024**3))
+)
+# Decoded, normalized band stacks of uploaded scenes (memmapped, shared by all
+# workers), keyed by upload sha256 and read grid. 0 disables the cache.
+SCENES_MAX_BYTES = int(os.environ.get("SCENES_MAX_BYTES", 8 * 1024**3))
+SCENES = DecodedSceneCache(DATA_DIR / "scenes", max_bytes=SCENES_MAX_BYTES) if SCENES_MAX_BYTES > 0 else None
+# Scene stretch limits on disk too, so detect workers and inline ROI requests
+# normalize a scene identically and compute its percentiles once.
+STRETCH_CACHE.root = DATA_DIR / "stretch"
+
+# Per-file upload cap, enforced while the body streams in
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 2 * 1024**3))
+
+# Index of runs (lookups, listing, retention). The retention pass deletes the
+# least recently used runs beyond RUNS_MAX_BYTES, and runs idle for more than
+# RUNS_MAX_AGE_DAYS (0 = keep forever), every RETENTION_INTERVAL_S.
+RUN_INDEX = RunIndex(DATA_DIR / "runs.sqlite")
+RUNS_MAX_BYTES = int(os.environ.get("RUNS_MAX_BYTES", 20 * 1024**3))
+RUNS_MAX_AGE_DAYS = float(os.environ.get("RUNS_MAX_AGE_DAYS", 30))
+RETENTION_INTERVAL_S = float(os.environ.get("RETENTION_INTERVAL_S", 600))
+# Work on a run (queued or running jobs, inline ROIs and quicklooks) holds a
+# lease on it in RUN_INDEX, which retention respects. A lease outlives a
+# crashed worker by at most RUN_LEASE_S.
+RUN_LEASE_S = float(os.environ.get("RUN_LEASE_S", 6 * 3600))
+RUNS_PAGE_MAX = 200
+
+# Bump whenever detect output changes for the same inputs; part of the cache key.
+PIPELINE_VERSION = 3
+
+# Asset encoding. ASSET_FORMAT is png or webp; LAZY_ASSETS=1 defers the
+# secondary assets (LAZY_KEYS) until their first /static request.
+ENCODER = Encoder(
+    fmt=os.environ.get("ASSET_FORMAT", "png"),
+    png_level=int(os.environ.get("ASSET_PNG_LEVEL", 1)),
+    webp_quality=int(os.environ.get("ASSET_WEBP_QUALITY", 90)),
+)
+LAZY_ASSETS = os.environ.get("LAZY_ASSETS", "0") == "1"
+LAZY_KEYS = ("diff_rgb", "overlay")
+# With a lossy ENCODER, deferred renders (the lazy diff and overlays,
+# re-thresholded overlays) start from lossless copies of the t0/t1 assets
+# kept under <run>/sources/, not from the lossy assets themselves.
+SOURCES_DIR = "sources"
+
+ASSET_NAMES = {
+    "t0_rgb": "t0",
+    "t1_rgb": "t1",
+    "diff_rgb": "diff",
+    "heatmap": "heatmap",
+    "overlay": "overlay",
+    "landcover": "landcover",
+    "anomaly_u8": "anomaly_u8",
+}
+ASSET_FILES = {k: f"{name}.{ENCODER.ext}" for k, name in ASSET_NAMES.items()}
+
+# GIS layers (detect?cog=1) under <run>/cog/: anomaly score, threshold mask and
+# landcover as Cloud-Optimized GeoTIFFs on t1's grid. COG_ANOMALY_DTYPE is
+# uint8 (the quantized map, scale 1/255) or float16 (the [0,1] scores).
+COG_DIR = "cog"
+COG_FILES = {"anomaly": "anomaly.tif", "mask": "mask.tif", "landcover": "landcover.tif"}
+COG_ANOMALY_DTYPE = os.environ.get("COG_ANOMALY_DTYPE", "uint8")
+
+# Batch detect: max scene files per request and job-status poll interval
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "128"))
+BATCH_POLL_S = 0.5
+# Batch runs waiting for a JOBS slot, as (run_id, result key), and the
+# submitted ones still in flight (see _drain_batches)
+_BATCH_LOCK = threading.RLock()  # a job that finishes at once drains from inside submit
+_BATCH_WAITING: List[Tuple[str, str]] = []
+_BATCH_RUNNING: Dict[str, str] = {}
+
+# Recent /threshold results kept in memory
+THRESHOLD_MEMO = int(os.environ.get("THRESHOLD_MEMO", "64"))
+
+# Assets the viewer pans/zooms get an XYZ tile pyramid under <run>/tiles/
+TILE_ASSETS = ("t0_rgb", "t1_rgb", "heatmap", "overlay")
+TILE_CACHE_CONTROL = "public, max-age=31536000"
+
+# Anomaly regions (regions.geojson): components of at least REGIONS_MIN_PIXELS,
+# the REGIONS_MAX largest kept, outlines simplified to REGIONS_SIMPLIFY_PX.
+REGIONS_FILE = "regions.geojson"
+REGIONS_MIN_PIXELS = int(os.environ.get("REGIONS_MIN_PIXELS", 16))
+REGIONS_MAX = int(os.environ.get("REGIONS_MAX", 10000))
+REGIONS_SIMPLIFY_PX = float(os.environ.get("REGIONS_SIMPLIFY_PX", 1.0))
+
+# Outputs derived from a run on request (ROIs, quick looks, the progressive
+# preview, re-thresholded overlays); counted in the run's size, not cached
+DERIVED_DIRS = ("roi", "quicklook", "preview", "thresholds")
+
+# Time-series runs (static/series/<id>): scenes are appended one at a time and
+# each is compared with the previous one. The deviation heatmap shows distance
+# from the per-pixel baseline of all earlier scenes, SERIES_Z_MAX std = white.
+SERIES_DIR = STATIC_DIR / "series"
+SERIES_Z_MAX = 4.0
+SERIES_FILES = {
+    **{k: ASSET_FILES[k] for k in ("t1_rgb", "heatmap", "overlay", "anomaly_u8", "landcover")},
+    "deviation": f"deviation.{ENCODER.ext}",
+}
+SERIES_LOCK = threading.Lock()  # series.json read-modify-write in the API process
+
+# Region-of-interest detect (runs/<id>/roi/<col>_<row>_<w>_<h>): windows up to
+# ROI_SYNC_PIXELS are computed inside the request, larger ones go to JOBS.
+ROI_SYNC_PIXELS = int(os.environ.get("ROI_SYNC_PIXELS", 2048 * 2048))
+
+# Quick-look detect (?preview=1, runs/<id>/quicklook/<scale>): the pipeline on
+# both scenes decimated by `scale`, from internal overviews when the files
+# have them, and never above QUICKLOOK_MAX_SIDE. Answered inline, approximate.
+QUICKLOOK_SCALE = float(os.environ.get("QUICKLOOK_SCALE", 0.125))
+QUICKLOOK_MAX_SIDE = int(os.environ.get("QUICKLOOK_MAX_SIDE", 2048))
+
+# Scenes are processed in TILE_SIZE blocks; TILE_OVERLAP is the SSIM window
+# radius so tiles stitch without seams.
+TILE_SIZE = 1024
+TILE_OVERLAP = HALO
+
+# Background detect jobs: DETECT_WORKERS processes, and at most
+# DETECT_MAX_PENDING runs queued or in flight before detect answers 429.
+DETECT_WORKERS = int(os.environ.get("DETECT_WORKERS", 2))
+DETECT_MAX_PENDING = int(os.environ.get("DETECT_MAX_PENDING", 8))
+DETECT_RETRY_AFTER = 5  # seconds
+
+JOBS = JobScheduler(
+    max_workers=DETECT_WORKERS,
+    max_pending=DETECT_MAX_PENDING,
+    on_finish=lambda job_id, status: _on_job_finish(job_id, status),
+)
+
+# Tile-level threads inside each detect process; split the cores between
+# the DETECT_WORKERS processes so concurrent jobs don't oversubscribe.
+ANOMALY = AnomalyEngine(workers=max(1, (os.cpu_count() or 1) // DETECT_WORKERS))
+
+# progress(stage, fraction) callback threaded through long pipeline steps;
+# under JOBS it also has .event(kind, **data) for the run's event log
+Progress = Callable[..., None]
+
+# Live progress: detect publishes a coarse PREVIEW_SIDE px anomaly preview
+# before the full-resolution pass and refreshes it at most every
+# PREVIEW_INTERVAL_S as tiles complete. .../events streams the event log as
+# SSE, polling it every SSE_POLL_S, with a comment every SSE_KEEPALIVE_S
+# so idle proxies keep the connection open.
+PREVIEW_SIDE = int(os.environ.get("PREVIEW_SIDE", 512))
+PREVIEW_INTERVAL_S = float(os.environ.get("PREVIEW_INTERVAL_S", 1.0))
+SSE_POLL_S = 0.25
+SSE_KEEPALIVE_S = 15.0
+
+# Per-stage profiling (result.json "timings") and Prometheus /metrics.
+# PROFILE_ALLOC=0 skips tracemalloc's peak-allocation tracking.
+PROFILE_ALLOC = os.environ.get("PROFILE_ALLOC", "1") == "1"
+METRICS = Registry()
+STAGE_SECONDS = METRICS.register(Histogram(
+    "detect_stage_seconds", "Detect stage duration by clock (wall/cpu).",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+    labels=("stage", "clock"),
+))
+STAGE_ALLOC = METRICS.register(Histogram(
+    "detect_stage_peak_alloc_bytes", "Peak traced allocation during a detect stage.",
+    buckets=tuple(float(1 << n) for n in range(20, 36, 2)),
+    labels=("stage",),
+))
+DETECT_RUNS = METRICS.register(Counter("detect_runs_total", "Finished detect runs by outcome.", labels=("status",)))
+METRICS.register(Gauge("detect_jobs_pending", "Detect jobs queued or running.", lambda: {(): JOBS.pending()}))
+METRICS.register(Gauge(
+    "result_cache_bytes", "Bytes held by the detect result cache.",
+    lambda: {(): RESULT_CACHE.stats()["bytes"]},
+))
+
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # before serving: _require_run 404s runs the index doesn't know yet
+    await asyncio.to_thread(_backfill_index)
+    stop = threading.Event()
+    worker = threading.Thread(target=_retention_loop, args=(stop,), name="retention", daemon=True)
+    worker.start()
+    yield
+    stop.set()
+
+
+app = FastAPI(title="Satellite Anomaly Studio (MVP)", lifespan=_lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,7 +248,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+app.mount(
+    "/static",
+    LazyStaticFiles(directory=str(STATIC_DIR), render=lambda path: _render_lazy_asset(path)),
+    name="static",
+)
 
 
 # -----------------------------
@@ -40,53 +260,18 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 # -----------------------------
 def _read_geotiff(path: Path) -> np.ndarray:
     """
-    Reads OSCD multi-band GeoTIFF and resamples all bands to 10m resolution.
-    Returns HxWxC float32 image in [0,1].
+    Reads a whole OSCD scene by stitching its windowed tiles: a multi-band
+    GeoTIFF, or a directory of per-band rasters resampled to the finest (10m)
+    grid. Returns HxWxC float32 image in [0,1].
+    detect() streams tiles instead; only use this when the full stack is needed.
     """
+    with open_scene(path) as src:
+        out = np.empty((src.height, src.width, src.count), dtype=np.float32)
+        grid = tile_grid(src.height, src.width, TILE_SIZE, overlap=0)
+        for tile, arr in iter_tiles(src, grid):
+            out[tile.dst] = arr
 
-    with rasterio.open(path) as src:
-        meta = src.meta.copy()
-
-        # Get full resolution for band 4 (Red, 10m)
-        # If TIFF uses 20m/60m scale, pick largest resolution available.
-        max_w = src.width
-        max_h = src.height
-
-        # Build target transform
-        target_transform = src.transform
-
-        # Prepare output array
-        bands = []
-        for b in range(1, src.count + 1):
-            band = src.read(b)
-
-            # If band is not same resolution → resample to match largest (10m)
-            if band.shape != (max_h, max_w):
-                # Compute scale (old → new)
-                src_h, src_w = band.shape
-                bandscale_x = src_w / max_w
-                bandscale_y = src_h / max_h
-
-                band = cv2.resize(
-                    band.astype(np.float32),
-                    (max_w, max_h),
-                    interpolation=cv2.INTER_LINEAR,
-                )
-
-            bands.append(band.astype(np.float32))
-
-    # Stack to HxWxC
-    arr = np.stack(bands, axis=-1)
-
-    # Robust normalize each band
-    out = np.empty_like(arr, dtype=np.float32)
-    for c in range(arr.shape[2]):
-        band = arr[..., c]
-        lo = np.percentile(band, 2)
-        hi = np.percentile(band, 98)
-        out[..., c] = (band - lo) / (hi - lo + 1e-6)
-
-    return np.clip(out, 0.0, 1.0)
+    return out
 
 def _pick_s2_rgb(img: np.ndarray) -> np.ndarray:
     """
@@ -96,20 +281,27 @@ def _pick_s2_rgb(img: np.ndarray) -> np.ndarray:
     If we can't, fallback to first 3 channels.
     Returns float32 HxWx3 in [0,1].
     """
-    c = img.shape[2]
+    rgb = img[..., _rgb_bands(img.shape[2])]
+    return np.clip(rgb, 0.0, 1.0)
+
+
+def _rgb_bands(c: int) -> List[int]:
+    """0-based band indices _pick_s2_rgb uses for a C-band stack."""
     if c >= 4:
         # R,G,B = B4,B3,B2
-        rgb = img[..., [3, 2, 1]]
-    elif c >= 3:
-        rgb = img[..., :3]
-    else:
-        rgb = np.repeat(img[..., :1], 3, axis=2)
-    return np.clip(rgb, 0.0, 1.0)
+        return [3, 2, 1]
+    if c >= 3:
+        return [0, 1, 2]
+    return [0, 0, 0]
 
 
-def _save_png(rgb01: np.ndarray, path: Path) -> None:
-    rgb8 = (np.clip(rgb01, 0, 1) * 255).astype(np.uint8)
-    Image.fromarray(rgb8).save(path)
+def _to_u8(x01: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    return quantize(x01, out)
+
+
+def _save_rgb(rgb01: np.ndarray, path: Path) -> None:
+    rgb8 = rgb01 if rgb01.dtype == np.uint8 else _to_u8(rgb01)
+    ENCODER.save(rgb8, path)
 
 
 # -----------------------------
@@ -123,6 +315,8 @@ LC_COLORS = {
     2: (34, 139, 34),    # green
     3: (30, 144, 255),   # blue
 }
+LC_LABELS = {"urban": 0, "agriculture": 1, "forest": 2, "water": 3}
+LC_PALETTE = palette_lut(LC_COLORS)
 
 def _landcover_heuristic(img_allbands: np.ndarray) -> np.ndarray:
     """
@@ -134,43 +328,56 @@ def _landcover_heuristic(img_allbands: np.ndarray) -> np.ndarray:
     Red ~ B4 at index 3 if C>=4
     Green ~ B3 at index 2 if C>=3
     """
-    h, w, c = img_allbands.shape
-    lc = np.zeros((h, w), dtype=np.uint8)
+    bands = _landcover_bands(img_allbands.shape[2])
+    if bands:
+        red, green, nir = (img_allbands[..., i] for i in bands)
+        return _landcover_from_bands(red, green, nir)
 
-    if c >= 8:
-        red = img_allbands[..., 3]
-        green = img_allbands[..., 2]
-        nir = img_allbands[..., 7]
+    # Fallback: everything urban/other
+    return np.zeros(img_allbands.shape[:2], dtype=np.uint8)
 
-        ndvi = (nir - red) / (nir + red + 1e-6)
-        ndwi = (green - nir) / (green + nir + 1e-6)
 
-        # water first
-        water = ndwi > 0.20
-        lc[water] = 3
+def _landcover_bands(c: int) -> List[int]:
+    """0-based (red, green, nir) indices, or [] when the stack has no NIR."""
+    return [3, 2, 7] if c >= 8 else []
 
-        # vegetation
-        veg = (ndvi > 0.30) & (~water)
-        # split agri vs forest by NDVI strength (rough heuristic)
-        forest = (ndvi > 0.60) & veg
-        agri = veg & (~forest)
 
-        lc[forest] = 2
-        lc[agri] = 1
+def _landcover_from_bands(red: np.ndarray, green: np.ndarray, nir: np.ndarray) -> np.ndarray:
+    lc = np.zeros(red.shape, dtype=np.uint8)
+    ndvi = (nir - red) / (nir + red + 1e-6)
+    ndwi = (green - nir) / (green + nir + 1e-6)
 
-        # remaining is urban/other (0)
-        return lc
+    # water first
+    water = ndwi > 0.20
+    lc[water] = 3
 
-    # Fallback: everything urban/other
+    # vegetation
+    veg = (ndvi > 0.30) & (~water)
+    # split agri vs forest by NDVI strength (rough heuristic)
+    forest = (ndvi > 0.60) & veg
+    agri = veg & (~forest)
+
+    lc[forest] = 2
+    lc[agri] = 1
+
+    # remaining is urban/other (0)
     return lc
 
 
-def _save_landcover_png(lc: np.ndarray, path: Path) -> None:
-    h, w = lc.shape
-    out = np.zeros((h, w, 3), dtype=np.uint8)
-    for k, color in LC_COLORS.items():
-        out[lc == k] = color
-    Image.fromarray(out).save(path)
+# Bands each pipeline stage reads, as a function of the stack's band count.
+# detect() only pulls the union of the enabled stages' bands off disk.
+STAGE_BANDS = {
+    "rgb": _rgb_bands,
+    "landcover": _landcover_bands,
+}
+
+
+def _band_plan(count: int, stages: Sequence[str]) -> BandPlan:
+    return BandPlan.from_needs(STAGE_BANDS[s](count) for s in stages)
+
+
+def _save_landcover(lc: np.ndarray, path: Path) -> None:
+    ENCODER.save(apply_lut(lc, LC_PALETTE), path, lossless=True)
 
 
 # -----------------------------
@@ -179,162 +386,1599 @@ def _save_landcover_png(lc: np.ndarray, path: Path) -> None:
 def _compute_anomaly_map(t0_rgb: np.ndarray, t1_rgb: np.ndarray) -> np.ndarray:
     """
     Inputs are HxWx3 float32 in [0,1]. Output is HxW float32 in [0,1].
+    Tiled and multi-threaded, see utils/anomaly.py.
     """
-    diff = np.mean(np.abs(t1_rgb - t0_rgb), axis=2)  # HxW
+    return ANOMALY.anomaly_map(t0_rgb, t1_rgb)
 
-    g0 = np.mean(t0_rgb, axis=2)
-    g1 = np.mean(t1_rgb, axis=2)
 
-    # SSIM returns similarity; convert to anomaly
-    _, ssim_map = ssim(g0, g1, full=True, data_range=1.0)
-    ssim_anom = 1.0 - ssim_map
+# red at 35% over t1 where the anomaly passes the threshold
+OVERLAY_LUT = blend_lut((255, 0, 0), 0.35)
 
-    score = 0.6 * diff + 0.4 * ssim_anom
-    score = (score - score.min()) / (score.max() - score.min() + 1e-6)
-    return score.astype(np.float32)
 
-
-def _save_heatmap(anom01: np.ndarray, path: Path) -> None:
-    heat = cv2.applyColorMap((np.clip(anom01, 0, 1) * 255).astype(np.uint8), cv2.COLORMAP_HOT)
-    heat = cv2.cvtColor(heat, cv2.COLOR_BGR2RGB)
-    Image.fromarray(heat).save(path)
+def _render_heatmap(anom01: np.ndarray) -> np.ndarray:
+    """HOT colormap of the anomaly map (float in [0,1], or already quantized uint8)."""
+    return heatmap(anom01 if anom01.dtype == np.uint8 else _to_u8(anom01))
 
 
-def _save_diff_rgb(t0_rgb: np.ndarray, t1_rgb: np.ndarray, path: Path) -> None:
-    diff = np.abs(t1_rgb - t0_rgb)
-    _save_png(diff, path)
+def _save_heatmap(anom01: np.ndarray, path: Path) -> None:
+    ENCODER.save(_render_heatmap(anom01), path)
 
 
-def _save_overlay(t1_rgb: np.ndarray, anom01: np.ndarray, threshold: float, path: Path) -> None:
+def _render_overlay(t1_rgb: np.ndarray, anom01: np.ndarray, threshold: float) -> np.ndarray:
     """
     Creates a premium-looking overlay: red mask over t1.
     """
-    base = (np.clip(t1_rgb, 0, 1) * 255).astype(np.uint8)
-    mask = (anom01 >= threshold).astype(np.uint8)
+    base = t1_rgb if t1_rgb.dtype == np.uint8 else _to_u8(t1_rgb)
+    return overlay(base, anom01 >= threshold, OVERLAY_LUT)
 
-    overlay = base.copy()
-    # red overlay where mask=1
-    overlay[mask == 1] = (0.65 * overlay[mask == 1] + 0.35 * np.array([255, 0, 0], dtype=np.float32)).astype(np.uint8)
 
-    Image.fromarray(overlay).save(path)
+def _save_overlay(t1_rgb: np.ndarray, anom01: np.ndarray, threshold: float, path: Path) -> None:
+    ENCODER.save(_render_overlay(t1_rgb, anom01, threshold), path)
 
 
 def _save_anomaly_u8(anom01: np.ndarray, path: Path) -> None:
     """
     Save grayscale 0..255 anomaly map so frontend can threshold instantly on canvas.
     """
-    u8 = (np.clip(anom01, 0, 1) * 255).astype(np.uint8)
-    Image.fromarray(u8, mode="L").save(path)
+    anom_u8 = anom01 if anom01.dtype == np.uint8 else _to_u8(anom01)
+    ENCODER.save(anom_u8, path, lossless=True)
 
 
-def _metrics(anom01: np.ndarray, lc: np.ndarray, thr: float) -> Dict:
-    binmask = (anom01 >= thr).astype(np.uint8)
-    global_pct = float(binmask.mean() * 100.0)
+def _metrics(anom01: np.ndarray, lc: np.ndarray, thr: float, anom_u8: Optional[np.ndarray] = None) -> Dict:
+    """
+    Global and per-landcover anomaly stats from one bincount pass
+    (utils.metrics); p95 comes from the uint8 map's histogram.
+    """
+    if anom_u8 is None:
+        anom_u8 = _to_u8(anom01)
+    stats = anomaly_stats(anom01, anom_u8, lc, len(LC_COLORS), [thr])
+    total = max(stats.total, 1)
 
     by_cat = {}
-    for name, lab in [("urban", 0), ("agriculture", 1), ("forest", 2), ("water", 3)]:
-        region = (lc == lab)
-        denom = int(region.sum())
+    for name, lab in LC_LABELS.items():
+        denom = int(stats.pixels[lab])
         if denom == 0:
             by_cat[name] = {"anomaly_pixels_pct": 0.0, "pixels": 0}
         else:
-            pct = float((binmask[region].mean()) * 100.0)
+            pct = float(stats.anomalies[lab, 0] / denom * 100.0)
             by_cat[name] = {"anomaly_pixels_pct": pct, "pixels": denom}
 
     return {
         "global": {
-            "anomaly_pixels_pct": global_pct,
-            "score_mean": float(anom01.mean()),
-            "score_p95": float(np.quantile(anom01, 0.95)),
+            "anomaly_pixels_pct": float(stats.anomalies[:, 0].sum() / total * 100.0),
+            "score_mean": stats.score_sum / total,
+            "score_p95": stats.percentile(95.0),
         },
         "by_category": by_cat,
     }
 
 
 # -----------------------------
-# API
+# Pipeline
 # -----------------------------
-@app.post("/api/runs")
-async def create_run(t0: UploadFile = File(...), t1: UploadFile = File(...)):
+def _detect_tiles(
+    src0,
+    src1,
+    progress: Optional[Progress] = None,
+    prof: Optional[StageProfiler] = None,
+    preview: Optional[ProgressivePreview] = None,
+    on_tile: Optional[Callable[[int, int], None]] = None,
+    window: Optional[Window] = None,
+    score_range: Optional[Tuple[float, float]] = None,
+    scene_keys: Optional[Tuple[str, str]] = None,
+) -> Tuple:
+    """
+    Streams t0/t1 tile by tile and stitches the per-pixel products.
+    Only the current tile is held as a float band stack; the scene-sized
+    outputs are uint8 RGB, uint8 landcover and the float32 anomaly map.
+    Per-tile work is charged to prof spans (read / anomaly / rgb_u8 / landcover).
+    Scored tiles are folded into `preview`, and on_tile(done, total) is
+    called as each one completes.
+    With `window` only that part of t1's grid is processed (tiles still read
+    their SSIM halo from outside it). The anomaly map is stretched by its
+    own raw min/max, or by `score_range` when given.
+    With `scene_keys` (see _scene_keys) tiles come from the decoded-scene cache.
+    Returns (t0_u8, t1_u8, diff_u8, lc, anom01, (raw min, raw max)).
+    """
+    prof = prof or StageProfiler(trace_alloc=False)
+    h, w = (int(window.height), int(window.width)) if window is not None else (src1.height, src1.width)
+    grid = tile_grid(src1.height, src1.width, TILE_SIZE, TILE_OVERLAP, region=window, min_window=SSIM_WIN)
+
+    # t0 only feeds the RGB comparison; t1 also drives landcover. The same
+    # upload on both sides is decoded once and its tiles used for both.
+    same = scene_keys is not None and scene_keys[0] == scene_keys[1]
+    plan1 = _band_plan(src1.count, ("rgb", "landcover"))
+    plan0 = plan1 if same else _band_plan(src0.count, ("rgb",))
+    rgb_idx0, rgb_idx1 = _rgb_bands(src0.count), _rgb_bands(src1.count)
+    lc_idx = _landcover_bands(src1.count)
+
+    t0_u8 = np.empty((h, w, 3), dtype=np.uint8)
+    t1_u8 = np.empty((h, w, 3), dtype=np.uint8)
+    diff_u8 = np.empty((h, w, 3), dtype=np.uint8)
+    lc = np.empty((h, w), dtype=np.uint8)
+    anom = np.empty((h, w), dtype=np.float32)
+
+    def process(tile, a0, a1):
+        # runs on the ANOMALY thread pool; tiles write disjoint slices
+        rgb0 = plan0.take(a0, rgb_idx0)
+        rgb1 = plan1.take(a1, rgb_idx1)
+
+        with prof.span("anomaly"):
+            score = anomaly_score(rgb0, rgb1)[tile.core]
+            anom[tile.dst] = score
+            if preview is not None:
+                preview.add_tile(tile.dst, score)
+
+        with prof.span("rgb_u8"):
+            rgb0, rgb1 = rgb0[tile.core], rgb1[tile.core]
+            _to_u8(rgb0, out=t0_u8[tile.dst])
+            _to_u8(rgb1, out=t1_u8[tile.dst])
+            diff = rgb1 - rgb0
+            _to_u8(np.abs(diff, out=diff), out=diff_u8[tile.dst])
+        with prof.span("landcover"):
+            if lc_idx:
+                core1 = a1[tile.core]
+                red, green, nir = (core1[..., plan1.index[b]] for b in lc_idx)
+                lc[tile.dst] = _landcover_from_bands(red, green, nir)
+            else:
+                lc[tile.dst] = 0
+        return float(score.min()), float(score.max())
+
+    # rasterio handles aren't thread-safe: tiles are read here, in order,
+    # and handed to the pool with a bounded number in flight
+    if same:
+        tiles = SCENES.tiles(scene_keys[1], src1, grid, plan1.bands, full=window is None)
+        pairs = ((tile, a, a) for tile, a in tiles)
+    else:
+        if scene_keys is not None:
+            tiles0 = SCENES.tiles(scene_keys[0], src0, grid, plan0.bands, full=window is None)
+            tiles1 = SCENES.tiles(scene_keys[1], src1, grid, plan1.bands, full=window is None)
+        else:
+            tiles0 = iter_tiles(src0, grid, plan0.bands)
+            tiles1 = iter_tiles(src1, grid, plan1.bands)
+        pairs = ((tile, a0, a1) for (tile, a0), (_, a1) in zip(tiles0, tiles1))
+    reads = prof.iter_span("read", pairs)
+    lo, hi = np.inf, -np.inf
+    for i, (tlo, thi) in enumerate(ANOMALY.imap(process, reads)):
+        lo, hi = min(lo, tlo), max(hi, thi)
+        if progress:
+            progress("tiles", (i + 1) / len(grid))
+        if on_tile:
+            on_tile(i + 1, len(grid))
+
+    # global min/max normalization from the tile stats, in place
+    normalize_(anom, *(score_range or (lo, hi)))
+    return t0_u8, t1_u8, diff_u8, lc, anom, (float(lo), float(hi))
+
+
+def _find_uploads(run_dir: Path) -> Tuple[Path, Path]:
+    """
+    The run's t0/t1 upload paths. Uploads with a recorded sha256 get their
+    stretch limits cached by content (see set_content_id).
+    """
+    inputs_path = run_dir / "inputs.json"
+    if inputs_path.exists():
+        inputs = json.loads(inputs_path.read_text())
+        paths = tuple(run_dir / f"{k}_{inputs[k]['filename']}" for k in ("t0", "t1"))
+        if all(p.exists() for p in paths):
+            for k, path in zip(("t0", "t1"), paths):
+                if "sha256" in inputs[k]:
+                    set_content_id(path, inputs[k]["sha256"])
+            return paths
+    t0_files = list(run_dir.glob("t0_*"))
+    t1_files = list(run_dir.glob("t1_*"))
+    if not t0_files or not t1_files:
+        raise HTTPException(status_code=400, detail="Missing t0/t1 uploads in run dir")
+    return t0_files[0], t1_files[0]
+
+
+def _scene_keys(run_dir: Path, src0, src1) -> Optional[Tuple[str, str]]:
+    """Decoded-scene cache keys of a run's t0/t1 as opened for detect, None when the cache is off."""
+    if SCENES is None:
+        return None
+    hashes = _input_hashes(run_dir)
+    return scene_cache_key(hashes["t0"], src0), scene_cache_key(hashes["t1"], src1)
+
+
+def _asset_urls(run_id: str) -> Dict[str, str]:
+    return {k: f"/static/runs/{run_id}/{name}" for k, name in ASSET_FILES.items()}
+
+
+def _input_hashes(run_dir: Path) -> Dict[str, str]:
+    """sha256 of the t0/t1 uploads, recorded at upload time (hashed lazily for older runs)."""
+    inputs_path = run_dir / "inputs.json"
+    inputs = json.loads(inputs_path.read_text()) if inputs_path.exists() else {}
+    if not all("sha256" in inputs.get(k, {}) for k in ("t0", "t1")):
+        for k, path in zip(("t0", "t1"), _find_uploads(run_dir)):
+            inputs[k] = {"filename": path.name[3:], "sha256": sha256_file(path), "size": path.stat().st_size}
+        _write_json(inputs_path, inputs)
+    return {k: inputs[k]["sha256"] for k in ("t0", "t1")}
+
+
+def _detect_params(cog: bool) -> Dict:
+    """Detect options that change its outputs, as result-cache key params."""
+    return {"cog": COG_ANOMALY_DTYPE} if cog else {}
+
+
+def _result_key(run_dir: Path, **params) -> str:
+    hashes = _input_hashes(run_dir)
+    params = {"format": ENCODER.fmt, "lazy": LAZY_ASSETS, **params}
+    return cache_key(t0=hashes["t0"], t1=hashes["t1"], version=PIPELINE_VERSION, params=params)
+
+
+def _run_artifacts(run_dir: Path) -> List[Path]:
+    """Detect outputs present in run_dir (lazy assets may not be rendered yet)."""
+    names = list(ASSET_FILES.values()) + [
+        "anomaly.npy", "landcover.npy", SOURCES_DIR, REGIONS_FILE, "tiles", COG_DIR, "result.json",
+    ]
+    return [run_dir / n for n in names if (run_dir / n).exists()]
+
+
+def _threshold_overlay_name(thr: float) -> str:
+    return f"overlay_{thr:.3f}.{ENCODER.ext}"
+
+
+def _rgb_source(run_dir: Path, key: str) -> np.ndarray:
+    """The t0_rgb / t1_rgb pixels detect rendered: the lossless source copy if any, else the asset."""
+    path = run_dir / SOURCES_DIR / ASSET_FILES[key]
+    if not path.exists():
+        path = run_dir / ASSET_FILES[key]
+    return np.asarray(Image.open(path).convert("RGB"))
+
+
+def _render_threshold_overlay(run_dir: Path, name: str, out: Path) -> bool:
+    m = re.fullmatch(rf"overlay_([01]\.\d{{3}})\.{ENCODER.ext}", name)
+    anom_path = run_dir / "anomaly.npy"
+    if m is None or not anom_path.exists():
+        return False
+    t1_u8 = _rgb_source(run_dir, "t1_rgb")
+    out.parent.mkdir(exist_ok=True)
+    _save_overlay(t1_u8, np.load(anom_path, mmap_mode="r"), float(m.group(1)), out)
+    return True
+
+
+def _render_lazy_asset(path: str) -> bool:
+    """
+    LazyStaticFiles hook: renders a deferred asset (runs/<id>/<name>) or a
+    re-thresholded overlay (runs/<id>/thresholds/<name>) on its first
+    request. Returns True once the file exists.
+    """
+    parts = Path(path).parts
+    if len(parts) not in (3, 4) or parts[0] != "runs" or not parts[1].isalnum():
+        return False
+    run_dir = RUNS_DIR / parts[1]
+    if not (run_dir / "result.json").exists():
+        return False
+    out = run_dir.joinpath(*parts[2:])
+    if out.exists():
+        return True
+    if len(parts) == 4:
+        if parts[2] != "thresholds" or not _render_threshold_overlay(run_dir, parts[3], out):
+            return False
+        _record_outputs(parts[1])
+        return True
+
+    key = next((k for k in LAZY_KEYS if ASSET_FILES[k] == parts[2]), None)
+    if key is None:
+        return False
+
+    t1_u8 = _rgb_source(run_dir, "t1_rgb")
+    if key == "diff_rgb":
+        # |q(t1) - q(t0)| is within 1 LSB of the eager q(|t1 - t0|)
+        _save_rgb(cv2.absdiff(t1_u8, _rgb_source(run_dir, "t0_rgb")), out)
+    else:
+        anom_path = run_dir / "anomaly.npy"
+        thr = json.loads((run_dir / "result.json").read_text())["threshold_suggestion"]
+        _save_overlay(t1_u8, np.load(anom_path, mmap_mode="r"), thr, out)
+    _record_outputs(parts[1])
+    return True
+
+
+def _from_cache(run_id: str, key: str) -> Optional[Dict]:
+    """Links a cached result into the run and returns its result.json, or None."""
+    entry = RESULT_CACHE.get(key)
+    if entry is None:
+        return None
+    run_dir = RUNS_DIR / run_id
+    RESULT_CACHE.materialize(key, run_dir)
+    result = json.loads((entry / "result.json").read_text())
+    result.update(run_id=run_id, assets=_asset_urls(run_id), cached=True)
+    if "tiles" in result:
+        result["tiles"]["url"] = f"/api/runs/{run_id}/tiles/{{asset}}/{{z}}/{{x}}/{{y}}"
+    if "regions" in result:
+        result["regions"]["url"] = f"/static/runs/{run_id}/{REGIONS_FILE}"
+    if "cog" in result:
+        result["cog"].update(_cog_urls(run_id))
+    _write_json(run_dir / "result.json", result)
+    return result
+
+
+def _new_run(files: Dict[str, ReceivedFile], blobs: Dict[str, Path]) -> Tuple[str, Dict]:
+    """
+    Creates a run from received t0/t1 files already adopted into BLOBS
+    (`blobs[key]`); uploads are stored once by content hash and linked in.
+    """
     run_id = uuid.uuid4().hex
     run_dir = RUNS_DIR / run_id
     run_dir.mkdir(parents=True, exist_ok=True)
 
-    t0_path = run_dir / f"t0_{t0.filename}"
-    t1_path = run_dir / f"t1_{t1.filename}"
-    t0_path.write_bytes(await t0.read())
-    t1_path.write_bytes(await t1.read())
+    inputs = {}
+    for key in ("t0", "t1"):
+        f = files[key]
+        link_or_copy(blobs[key], run_dir / f"{key}_{f.filename}")
+        inputs[key] = {"filename": f.filename, "sha256": f.sha256, "size": f.size, "kind": f.kind}
+    _write_json(run_dir / "inputs.json", inputs)
+    RUN_INDEX.add(run_id, inputs)
+    return run_id, inputs
 
-    return {"run_id": run_id}
 
+def _require_run(run_id: str) -> Path:
+    """Run dir of an indexed run (marking it as accessed), else 404."""
+    if not run_id.isalnum() or RUN_INDEX.get(run_id) is None:
+        raise HTTPException(status_code=404, detail="run_id not found")
+    return RUNS_DIR / run_id
 
-@app.post("/api/runs/{run_id}/detect")
-def detect(run_id: str):
-    run_dir = RUNS_DIR / run_id
-    if not run_dir.exists():
+
+def _lease_run(run_id: str, holder: str) -> None:
+    """Marks the run busy for `holder` until released (or RUN_LEASE_S), else 404."""
+    if not RUN_INDEX.lease(run_id, holder, RUN_LEASE_S):
         raise HTTPException(status_code=404, detail="run_id not found")
 
-    # locate uploaded files
-    t0_files = list(run_dir.glob("t0_*"))
-    t1_files = list(run_dir.glob("t1_*"))
-    if not t0_files or not t1_files:
-        raise HTTPException(status_code=400, detail="Missing t0/t1 uploads in run dir")
 
-    t0_all = _read_geotiff(t0_files[0])
-    t1_all = _read_geotiff(t1_files[0])
+@contextmanager
+def _leased(run_id: str):
+    holder = f"inline-{uuid.uuid4().hex}"
+    _lease_run(run_id, holder)
+    try:
+        yield
+    finally:
+        RUN_INDEX.release(run_id, holder)
 
-    t0_rgb = _pick_s2_rgb(t0_all)
-    t1_rgb = _pick_s2_rgb(t1_all)
 
-    # landcover (heuristic)
-    lc = _landcover_heuristic(t1_all)
+def _record_outputs(run_id: str, status: Optional[str] = None) -> None:
+    """Records the run's output bytes (detect artifacts and derived outputs) and, if given, its status."""
+    run_dir = RUNS_DIR / run_id
+    paths = _run_artifacts(run_dir) + [run_dir / d for d in DERIVED_DIRS if (run_dir / d).exists()]
+    fields = {"bytes": sum(tree_size(p) for p in paths)}
+    if status is not None:
+        fields["status"] = status
+    RUN_INDEX.update(run_id, **fields)
+
 
-    # anomaly map
-    anom = _compute_anomaly_map(t0_rgb, t1_rgb)
+def _cached_detect(run_id: str, cog: bool = False) -> Optional[Dict]:
+    """Answers detect from the result cache (marking the job done), or None."""
+    run_dir = RUNS_DIR / run_id
+    if JOBS.is_active(run_id):
+        return None
+    cached = _from_cache(run_id, _result_key(run_dir, **_detect_params(cog)))
+    if cached is not None:
+        write_status(run_dir / "job.json", status="done", stage="cached", progress=1.0, error=None)
+        append_event(run_dir / "job.json", "status", reset=True, status="done", stage="cached")
+        DETECT_RUNS.inc("cached")
+        _record_outputs(run_id, "done")
+    return cached
+
+
+def _observe_run(run_id: str, status: Dict) -> None:
+    """JOBS on_finish hook: records the outcome in the index, timings in /metrics."""
+    DETECT_RUNS.inc(status.get("status", "failed"))
+    _record_outputs(run_id, status.get("status", "failed"))
+    if status.get("status") != "done":
+        return
+    try:
+        timings = json.loads((RUNS_DIR / run_id / "result.json").read_text())["timings"]
+    except (OSError, ValueError, KeyError):
+        return
+    for stage, t in timings["stages"].items():
+        STAGE_SECONDS.observe(t["wall_s"], stage, "wall")
+        STAGE_SECONDS.observe(t["cpu_s"], stage, "cpu")
+        if "peak_alloc_mb" in t:
+            STAGE_ALLOC.observe(t["peak_alloc_mb"] * (1 << 20), stage)
+    STAGE_SECONDS.observe(timings["total"]["wall_s"], "total", "wall")
+    STAGE_SECONDS.observe(timings["total"]["cpu_s"], "total", "cpu")
+
+
+def _backfill_index() -> int:
+    """Indexes run dirs that predate the index. They are pinned (never auto-evicted)."""
+    known = RUN_INDEX.known()
+    added = 0
+    for run_dir in RUNS_DIR.iterdir():
+        if not run_dir.is_dir() or run_dir.name in known or not run_dir.name.isalnum():
+            continue
+        inputs_path = run_dir / "inputs.json"
+        inputs = json.loads(inputs_path.read_text()) if inputs_path.exists() else {}
+        job = read_status(run_dir / "job.json") or {}
+        status = job.get("status") or ("done" if (run_dir / "result.json").exists() else "created")
+        RUN_INDEX.add(run_dir.name, inputs, status=status, pinned=True, created_at=run_dir.stat().st_mtime)
+        RUN_INDEX.update(run_dir.name, bytes=tree_size(run_dir))
+        added += 1
+    return added
+
+
+def _enforce_retention() -> Dict[str, int]:
+    """
+    Deletes idle runs past RUNS_MAX_AGE_DAYS, then least recently used runs
+    until the index is under RUNS_MAX_BYTES, then upload blobs no run uses.
+    Leased runs (work in flight in any worker) are skipped.
+    """
+    total = RUN_INDEX.usage()["bytes"]
+    cutoff = time.time() - RUNS_MAX_AGE_DAYS * 86400 if RUNS_MAX_AGE_DAYS > 0 else None
+    removed = freed = 0
+    for row in RUN_INDEX.eviction_order():
+        expired = cutoff is not None and row["accessed_at"] < cutoff
+        if not expired and total <= RUNS_MAX_BYTES:
+            break
+        # unindex first: a lease taken from here on fails with 404
+        if not RUN_INDEX.delete_idle(row["run_id"]):
+            continue
+        shutil.rmtree(RUNS_DIR / row["run_id"], ignore_errors=True)
+        total -= row["size"]
+        freed += row["size"]
+        removed += 1
+    return {"runs_removed": removed, "run_bytes": freed, "blob_bytes": BLOBS.gc()}
+
+
+def _retention_loop(stop: threading.Event) -> None:
+    while True:
+        try:
+            _enforce_retention()
+        except Exception:  # keep the loop alive; next pass retries
+            logger.exception("retention pass failed")
+        if stop.wait(RETENTION_INTERVAL_S):
+            return
+
+
+def _write_json(path: Path, data: Dict, indent: Optional[int] = 2) -> None:
+    # readers poll result.json while detect runs: never expose a partial file
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(json.dumps(data, indent=indent))
+    tmp.replace(path)
+
+
+def _suggest_threshold(anom01: np.ndarray) -> float:
+    # p95 is often too aggressive; use p90-ish
+    return float(np.clip(float(np.quantile(anom01, 0.90)), 0.35, 0.85))
+
+
+def _save_regions(anom01: np.ndarray, lc: np.ndarray, thr: float, transform, crs, path: Path) -> Dict:
+    """Writes the anomaly regions GeoJSON to `path`; returns its summary for result.json."""
+    regions = label_regions(anom01, lc, thr, len(LC_COLORS))
+    geojson = regions_geojson(
+        regions, transform, crs,
+        class_names={v: k for k, v in LC_LABELS.items()},
+        min_pixels=REGIONS_MIN_PIXELS,
+        max_regions=REGIONS_MAX,
+        simplify_px=REGIONS_SIMPLIFY_PX,
+        properties={"threshold": thr},
+    )
+    _write_json(path, geojson, indent=None)
+    props = geojson["properties"]
+    return {"count": props["regions_emitted"], "total": props["regions_total"], "threshold": thr, "crs": props["crs"]}
+
+
+def _cog_urls(run_id: str) -> Dict[str, str]:
+    return {k: f"/static/runs/{run_id}/{COG_DIR}/{name}" for k, name in COG_FILES.items()}
+
+
+def _save_cogs(anom01: np.ndarray, anom_u8: np.ndarray, lc: np.ndarray, thr: float, transform, crs, out_dir: Path) -> Dict:
+    """
+    Anomaly score, `anom01 >= thr` mask and landcover labels as COGs carrying
+    the scene's CRS and transform. Returns their description for result.json.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    files = {k: out_dir / name for k, name in COG_FILES.items()}
+    if COG_ANOMALY_DTYPE == "float16":
+        # half floats: float32 samples packed to 16 bits by GDAL
+        write_cog(files["anomaly"], anom01, transform, crs, nbits=16)
+    else:
+        write_cog(files["anomaly"], anom_u8, transform, crs, scale=1 / 255)
+    write_cog(
+        files["mask"], (anom01 >= thr).view(np.uint8), transform, crs,
+        resampling="nearest", nbits=1, tags={"threshold": f"{thr:.4f}"},
+    )
+    write_cog(
+        files["landcover"], lc, transform, crs, resampling="nearest", colormap=LC_COLORS,
+        tags={f"class_{lab}": name for name, lab in LC_LABELS.items()},
+    )
+    return {
+        "anomaly_dtype": COG_ANOMALY_DTYPE,
+        "threshold": thr,
+        "crs": crs.to_string() if crs is not None else None,
+        "transform": list(transform)[:6],
+    }
 
-    # choose a reasonable default threshold (p95 is often too aggressive; use p90-ish)
-    thr = float(np.quantile(anom, 0.90))
-    thr = float(np.clip(thr, 0.35, 0.85))
 
-    # save assets
-    _save_png(t0_rgb, run_dir / "t0.png")
-    _save_png(t1_rgb, run_dir / "t1.png")
-    _save_diff_rgb(t0_rgb, t1_rgb, run_dir / "diff.png")
-    _save_heatmap(anom, run_dir / "heatmap.png")
-    _save_overlay(t1_rgb, anom, thr, run_dir / "overlay.png")
-    _save_anomaly_u8(anom, run_dir / "anomaly_u8.png")
-    _save_landcover_png(lc, run_dir / "landcover.png")
+def _emit(progress: Optional[Progress], kind: str, **data) -> None:
+    """Adds an event to the run's event log when running under JOBS."""
+    event = getattr(progress, "event", None)
+    if event is not None:
+        event(kind, **data)
+
+
+def _coarse_preview(src0, src1) -> ProgressivePreview:
+    """Anomaly of both scenes decimated to PREVIEW_SIDE, as the starting preview."""
+    rgb0 = read_preview(src0, [b + 1 for b in _rgb_bands(src0.count)], PREVIEW_SIDE)
+    rgb1 = read_preview(src1, [b + 1 for b in _rgb_bands(src1.count)], PREVIEW_SIDE)
+    score = anomaly_score(rgb0, rgb1)
+    return ProgressivePreview((src1.height, src1.width), normalize_(score, float(score.min()), float(score.max())))
+
+
+def _preview_publisher(run_id: str, preview: ProgressivePreview, progress: Progress) -> Callable[[int, int], None]:
+    """
+    on_tile callback for _detect_tiles: re-renders the preview heatmap and
+    emits a `preview` event, at most every PREVIEW_INTERVAL_S and once the
+    last tile is in.
+    """
+    out = RUNS_DIR / run_id / "preview" / f"heatmap.{ENCODER.ext}"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    state = {"version": 0, "at": 0.0}
+
+    def publish(done: int, total: int) -> None:
+        now = time.monotonic()
+        if done < total and now - state["at"] < PREVIEW_INTERVAL_S:
+            return
+        ENCODER.save(_render_heatmap(preview.render()), out)
+        state["version"] += 1
+        state["at"] = now
+        _emit(
+            progress, "preview",
+            url=f"/static/runs/{run_id}/preview/{out.name}?v={state['version']}",
+            size=[preview.coarse.shape[1], preview.coarse.shape[0]],
+            tiles_done=done, tiles_total=total,
+        )
+
+    return publish
+
+
+def _run_detect(run_id: str, cog: bool = False, progress: Optional[Progress] = None) -> Dict:
+    """
+    The full detect pipeline for one run. Runs inside a JOBS worker process;
+    `progress(stage, fraction)` is forwarded to the run's job.json.
+    With `cog`, GIS layers are written as COGs too (see _save_cogs).
+    """
+    progress = progress or (lambda stage, fraction=0.0: None)
+    prof = StageProfiler(trace_alloc=PROFILE_ALLOC)
+    run_dir = RUNS_DIR / run_id
+    t0_path, t1_path = _find_uploads(run_dir)
+
+    progress("reading", 0.0)
+    with ExitStack() as scenes:
+        # t0 is read on t1's grid; a coarser or offset t0 is resampled per tile
+        try:
+            src1 = scenes.enter_context(open_scene(t1_path))
+            src0 = scenes.enter_context(open_scene(t0_path, like=src1))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"t0/t1 rasters don't line up: {e}")
+        preview = on_tile = None
+        if hasattr(progress, "event"):
+            with prof.stage("preview"):
+                preview = _coarse_preview(src0, src1)
+                on_tile = _preview_publisher(run_id, preview, progress)
+                on_tile(0, 1)
+        with prof.stage("tiles"):
+            t0_rgb, t1_rgb, diff_rgb, lc, anom, score_range = _detect_tiles(
+                src0, src1, progress, prof, preview, on_tile, scene_keys=_scene_keys(run_dir, src0, src1),
+            )
+        transform, crs = src1.transform, src1.crs
+
+    with prof.stage("threshold"):
+        thr = _suggest_threshold(anom)
+
+    # save assets; assets may be hard links shared with the result cache,
+    # so drop them instead of overwriting in place
+    for path in _run_artifacts(run_dir) + [run_dir / "thresholds"]:
+        if not path.exists():
+            continue
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    with prof.stage("anomaly_u8"):
+        anom_u8 = _to_u8(anom)
+    # rendered once, for the full-size assets and the tile pyramids
+    with prof.stage("render"):
+        heat = _render_heatmap(anom_u8)
+        over = _render_overlay(t1_rgb, anom, thr)
+    files = {k: run_dir / name for k, name in ASSET_FILES.items()}
+    renders = {
+        "t0_rgb": lambda: _save_rgb(t0_rgb, files["t0_rgb"]),
+        "t1_rgb": lambda: _save_rgb(t1_rgb, files["t1_rgb"]),
+        "diff_rgb": lambda: _save_rgb(diff_rgb, files["diff_rgb"]),
+        "heatmap": lambda: ENCODER.save(heat, files["heatmap"]),
+        "overlay": lambda: ENCODER.save(over, files["overlay"]),
+        "anomaly_u8": lambda: _save_anomaly_u8(anom_u8, files["anomaly_u8"]),
+        "landcover": lambda: _save_landcover(lc, files["landcover"]),
+    }
+    # raw maps for re-thresholding and deferred renders (the u8 PNG is quantized)
+    with prof.stage("save_npy"):
+        np.save(run_dir / "anomaly.npy", anom)
+        np.save(run_dir / "landcover.npy", lc)
+    if LAZY_ASSETS:
+        for k in LAZY_KEYS:
+            del renders[k]
+    if ENCODER.lossy:
+        (run_dir / SOURCES_DIR).mkdir(exist_ok=True)
+        sources = {"t1_rgb": t1_rgb, "t0_rgb": t0_rgb} if LAZY_ASSETS else {"t1_rgb": t1_rgb}
+        for k, rgb in sources.items():
+            renders[f"{k}_source"] = partial(ENCODER.save, rgb, run_dir / SOURCES_DIR / ASSET_FILES[k], lossless=True)
+    progress("encoding", 0.0)
+    with prof.stage("encode"):
+        ENCODER.run_all(renders.values())
+
+    # tile pyramids for the map viewer
+    progress("tiles_pyramid", 0.0)
+    tile_sources = {"t0_rgb": t0_rgb, "t1_rgb": t1_rgb, "heatmap": heat, "overlay": over}
+    with prof.stage("pyramid"):
+        for i, asset in enumerate(TILE_ASSETS):
+            tasks = build_tasks(tile_sources[asset], run_dir / "tiles" / asset, ENCODER.ext, ENCODER.save)
+            ENCODER.run_all(tasks)
+            progress("tiles_pyramid", (i + 1) / len(TILE_ASSETS))
+
+    with prof.stage("metrics"):
+        metrics = _metrics(anom, lc, thr, anom_u8)
+
+    progress("regions", 0.0)
+    with prof.stage("regions"):
+        regions = _save_regions(anom, lc, thr, transform, crs, run_dir / REGIONS_FILE)
+
+    cogs = None
+    if cog:
+        progress("cog", 0.0)
+        with prof.stage("cog"):
+            cogs = _save_cogs(anom, anom_u8, lc, thr, transform, crs, run_dir / COG_DIR)
 
     result = {
         "run_id": run_id,
         "size": [int(t1_rgb.shape[1]), int(t1_rgb.shape[0])],
-        "assets": {
-            "t0_rgb": f"/static/runs/{run_id}/t0.png",
-            "t1_rgb": f"/static/runs/{run_id}/t1.png",
-            "diff_rgb": f"/static/runs/{run_id}/diff.png",
-            "heatmap": f"/static/runs/{run_id}/heatmap.png",
-            "overlay": f"/static/runs/{run_id}/overlay.png",
-            "landcover": f"/static/runs/{run_id}/landcover.png",
-            "anomaly_u8": f"/static/runs/{run_id}/anomaly_u8.png",
+        "assets": _asset_urls(run_id),
+        "tiles": {
+            "url": f"/api/runs/{run_id}/tiles/{{asset}}/{{z}}/{{x}}/{{y}}",
+            "assets": list(TILE_ASSETS),
+            "tile_size": TILE,
+            "max_zoom": max_zoom(*anom.shape),
+            "format": ENCODER.ext,
+        },
+        "metrics": metrics,
+        "regions": {"url": f"/static/runs/{run_id}/{REGIONS_FILE}", **regions},
+        "threshold_suggestion": thr,
+        "score_range": list(score_range),
+        "landcover_labels": LC_LABELS,
+        "timings": prof.as_dict(),
+    }
+    if cogs is not None:
+        result["cog"] = {**_cog_urls(run_id), **cogs}
+
+    _write_json(run_dir / "result.json", result)
+    RESULT_CACHE.put(_result_key(run_dir, **_detect_params(cog)), _run_artifacts(run_dir))
+    return result
+
+
+# -----------------------------
+# Quick look
+# -----------------------------
+def _run_quicklook(run_id: str, scale: float) -> Dict:
+    """
+    detect on decimated reads of both scenes: same anomaly / landcover /
+    metrics chain, low-resolution assets, no pyramid or regions. Scene stats
+    are reused when a full run has computed them and otherwise estimated on
+    the decimated pixels, so nothing reads the scenes at full resolution.
+    """
+    prof = StageProfiler(trace_alloc=False)
+    run_dir = RUNS_DIR / run_id
+    out_dir = run_dir / "quicklook" / f"{scale:g}"
+    t0_path, t1_path = _find_uploads(run_dir)
+
+    with ExitStack() as scenes:
+        try:
+            src1 = scenes.enter_context(open_scene(t1_path))
+            src0 = scenes.enter_context(open_scene(t0_path, like=src1))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"t0/t1 rasters don't line up: {e}")
+        max_side = min(max(1, round(max(src1.height, src1.width) * scale)), QUICKLOOK_MAX_SIDE)
+        shape = preview_shape(src1.height, src1.width, max_side)
+        plan0 = _band_plan(src0.count, ("rgb",))
+        plan1 = _band_plan(src1.count, ("rgb", "landcover"))
+        with prof.stage("read"):
+            a0 = read_preview(src0, plan0.bands, max_side, approx_stats=True)
+            a1 = read_preview(src1, plan1.bands, max_side, approx_stats=True)
+        overviews = [overview_factor(src0, shape), overview_factor(src1, shape)]
+        full_size = [src1.width, src1.height]
+
+    t0_rgb = plan0.take(a0, _rgb_bands(src0.count))
+    t1_rgb = plan1.take(a1, _rgb_bands(src1.count))
+    with prof.stage("anomaly"):
+        anom = _compute_anomaly_map(t0_rgb, t1_rgb)
+    with prof.stage("landcover"):
+        lc_idx = _landcover_bands(src1.count)
+        if lc_idx:
+            lc = _landcover_from_bands(*(a1[..., plan1.index[b]] for b in lc_idx))
+        else:
+            lc = np.zeros(anom.shape, dtype=np.uint8)
+    with prof.stage("threshold"):
+        thr = _suggest_threshold(anom)
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    anom_u8 = _to_u8(anom)
+    files = {k: out_dir / name for k, name in ASSET_FILES.items()}
+    with prof.stage("encode"):
+        ENCODER.run_all([
+            lambda: _save_rgb(t0_rgb, files["t0_rgb"]),
+            lambda: _save_rgb(t1_rgb, files["t1_rgb"]),
+            lambda: _save_rgb(np.abs(t1_rgb - t0_rgb), files["diff_rgb"]),
+            lambda: _save_heatmap(anom_u8, files["heatmap"]),
+            lambda: _save_overlay(t1_rgb, anom, thr, files["overlay"]),
+            lambda: _save_anomaly_u8(anom_u8, files["anomaly_u8"]),
+            lambda: _save_landcover(lc, files["landcover"]),
+        ])
+    with prof.stage("metrics"):
+        metrics = _metrics(anom, lc, thr, anom_u8)
+
+    base = f"/static/runs/{run_id}/quicklook/{out_dir.name}"
+    result = {
+        "run_id": run_id,
+        # low-resolution estimate; run detect without preview for the real thing
+        "approximate": True,
+        "quicklook": {
+            "scale": shape[1] / full_size[0],
+            "full_size": full_size,
+            # decimation factor of the overview each scene was read from, null = decimated full-res read
+            "overviews": overviews,
         },
-        "metrics": _metrics(anom, lc, thr),
+        "size": [int(shape[1]), int(shape[0])],
+        "assets": {k: f"{base}/{path.name}" for k, path in files.items()},
+        "metrics": metrics,
         "threshold_suggestion": thr,
-        "landcover_labels": {"urban": 0, "agriculture": 1, "forest": 2, "water": 3},
+        "landcover_labels": LC_LABELS,
+        "timings": prof.as_dict(),
     }
+    _write_json(out_dir / "result.json", result)
+    return result
+
+
+def _quicklook(run_id: str, run_dir: Path, scale: float) -> Dict:
+    path = run_dir / "quicklook" / f"{scale:g}" / "result.json"
+    if path.exists():
+        return json.loads(path.read_text())
+    with _leased(run_id):
+        result = _run_quicklook(run_id, scale)
+        _record_outputs(run_id)
+    return result
+
+
+# -----------------------------
+# Region of interest
+# -----------------------------
+def _roi_window(src, bbox: str, bbox_crs: str) -> Window:
+    """
+    Pixel window of t1's grid covering `bbox` ("minx,miny,maxx,maxy"), given
+    in pixels (col/row, bbox_crs="pixel") or in any CRS rasterio understands
+    (e.g. "EPSG:4326"), converted through the scene's CRS and transform.
+    Rounded outwards and clipped to the scene.
+    """
+    try:
+        x0, y0, x1, y1 = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minx,miny,maxx,maxy")
+    if x1 <= x0 or y1 <= y0:
+        raise HTTPException(status_code=400, detail="bbox is empty")
+
+    if bbox_crs == "pixel":
+        cols, rows = (x0, x1), (y0, y1)
+    else:
+        if src.crs is None or src.transform.is_identity:
+            raise HTTPException(status_code=400, detail="scene is not georeferenced; use bbox_crs=pixel")
+        try:
+            bounds = transform_bounds(bbox_crs, src.crs, x0, y0, x1, y1)
+        except (rasterio.errors.CRSError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"bad bbox_crs: {e}")
+        win = from_bounds(*bounds, transform=src.transform)
+        cols = (win.col_off, win.col_off + win.width)
+        rows = (win.row_off, win.row_off + win.height)
+
+    c0, c1 = max(math.floor(cols[0]), 0), min(math.ceil(cols[1]), src.width)
+    r0, r1 = max(math.floor(rows[0]), 0), min(math.ceil(rows[1]), src.height)
+    if c1 <= c0 or r1 <= r0:
+        raise HTTPException(status_code=400, detail="bbox does not intersect the scene")
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+
+def _roi_id(window: Window) -> str:
+    return f"{int(window.col_off)}_{int(window.row_off)}_{int(window.width)}_{int(window.height)}"
+
+
+def _full_result(run_dir: Path) -> Optional[Dict]:
+    """The run's full-scene result if it has what an ROI needs to match it."""
+    path = run_dir / "result.json"
+    if not path.exists():
+        return None
+    result = json.loads(path.read_text())
+    return result if "score_range" in result else None
+
+
+def _run_detect_roi(
+    run_id: str, roi: Tuple[int, int, int, int], progress: Optional[Progress] = None, inline: bool = False
+) -> Dict:
+    """
+    detect over a (col, row, width, height) window of t1's grid. Only the
+    window and its SSIM halo are read; bands are stretched with the
+    scene-level limits, and when the run already has a full result its raw
+    score range and threshold are reused, so ROI pixels equal the full
+    run's. Otherwise the map is stretched over the ROI alone.
+    `inline` runs (in the API process) don't trace allocations: tracemalloc
+    is process-wide and would stay on for every later request.
+    """
+    progress = progress or (lambda stage, fraction=0.0: None)
+    prof = StageProfiler(trace_alloc=PROFILE_ALLOC and not inline)
+    run_dir = RUNS_DIR / run_id
+    window = Window(*roi)
+    out_dir = run_dir / "roi" / _roi_id(window)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    full = _full_result(run_dir)
+    t0_path, t1_path = _find_uploads(run_dir)
+
+    progress("reading", 0.0)
+    with ExitStack() as scenes:
+        try:
+            src1 = scenes.enter_context(open_scene(t1_path))
+            src0 = scenes.enter_context(open_scene(t0_path, like=src1))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"t0/t1 rasters don't line up: {e}")
+        with prof.stage("tiles"):
+            t0_rgb, t1_rgb, diff_rgb, lc, anom, _ = _detect_tiles(
+                src0, src1, progress, prof,
+                window=window, score_range=tuple(full["score_range"]) if full else None,
+                scene_keys=_scene_keys(run_dir, src0, src1),
+            )
+        transform, crs = window_transform(window, src1.transform), src1.crs
+
+    with prof.stage("threshold"):
+        thr = full["threshold_suggestion"] if full else _suggest_threshold(anom)
+    anom_u8 = _to_u8(anom)
+    files = {k: out_dir / name for k, name in ASSET_FILES.items()}
+    progress("encoding", 0.0)
+    with prof.stage("encode"):
+        ENCODER.run_all([
+            lambda: _save_rgb(t0_rgb, files["t0_rgb"]),
+            lambda: _save_rgb(t1_rgb, files["t1_rgb"]),
+            lambda: _save_rgb(diff_rgb, files["diff_rgb"]),
+            lambda: _save_heatmap(anom_u8, files["heatmap"]),
+            lambda: _save_overlay(t1_rgb, anom, thr, files["overlay"]),
+            lambda: _save_anomaly_u8(anom_u8, files["anomaly_u8"]),
+            lambda: _save_landcover(lc, files["landcover"]),
+        ])
+    with prof.stage("metrics"):
+        metrics = _metrics(anom, lc, thr, anom_u8)
+    with prof.stage("regions"):
+        regions = _save_regions(anom, lc, thr, transform, crs, out_dir / REGIONS_FILE)
+
+    base = f"/static/runs/{run_id}/roi/{out_dir.name}"
+    georef = crs is not None and not transform.is_identity
+    result = {
+        "run_id": run_id,
+        "roi": {
+            "id": out_dir.name,
+            "window": list(roi),
+            "bounds": list(rasterio.transform.array_bounds(roi[3], roi[2], transform)) if georef else None,
+            "crs": crs.to_string() if georef else None,
+        },
+        "size": [int(window.width), int(window.height)],
+        "assets": {k: f"{base}/{path.name}" for k, path in files.items()},
+        "metrics": metrics,
+        "regions": {"url": f"{base}/{REGIONS_FILE}", **regions},
+        "threshold_suggestion": thr,
+        # "scene": stretched like the full run; "roi": by the ROI's own range
+        "normalization": "scene" if full else "roi",
+        "landcover_labels": LC_LABELS,
+        "timings": prof.as_dict(),
+    }
+    _write_json(out_dir / "result.json", result)
+    return result
+
+
+def _cached_roi(run_dir: Path, roi_id: str) -> Optional[Dict]:
+    """A stored ROI result, unless a full run has since made a better-matching one possible."""
+    path = run_dir / "roi" / roi_id / "result.json"
+    if not path.exists():
+        return None
+    result = json.loads(path.read_text())
+    if result["normalization"] == "roi" and _full_result(run_dir) is not None:
+        return None
+    return result
+
+
+def _detect_roi(run_id: str, run_dir: Path, bbox: str, bbox_crs: str, response: Response) -> Dict:
+    _, t1_path = _find_uploads(run_dir)
+    try:
+        with open_scene(t1_path) as src:
+            window = _roi_window(src, bbox, bbox_crs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    roi_id = _roi_id(window)
+    roi = (int(window.col_off), int(window.row_off), int(window.width), int(window.height))
+
+    cached = _cached_roi(run_dir, roi_id)
+    if cached is None and roi[2] * roi[3] <= ROI_SYNC_PIXELS:
+        with _leased(run_id):
+            cached = _run_detect_roi(run_id, roi, inline=True)
+            _record_outputs(run_id)
+    if cached is not None:
+        response.status_code = 200
+        return cached
+
+    roi_dir = run_dir / "roi" / roi_id
+    roi_dir.mkdir(parents=True, exist_ok=True)
+    job_id = f"roi-{run_id}-{roi_id}"
+    _lease_run(run_id, job_id)
+    try:
+        job = JOBS.submit(job_id, roi_dir / "job.json", _run_detect_roi, run_id, roi)
+    except QueueFull:
+        RUN_INDEX.release(run_id, job_id)
+        raise HTTPException(
+            status_code=429,
+            detail="Detection queue is full, retry shortly",
+            headers={"Retry-After": str(DETECT_RETRY_AFTER)},
+        )
+    return {"run_id": run_id, "roi": {"id": roi_id, "window": list(roi)}, "job": job}
+
+
+# -----------------------------
+# Time series
+# -----------------------------
+def _series_tiles(
+    src, state: SeriesState, progress: Optional[Progress] = None, prof: Optional[StageProfiler] = None
+) -> Tuple[np.ndarray, ...]:
+    """
+    _detect_tiles for one appended scene. The previous scene comes from the
+    series state (normalized RGB and grayscale memmaps) instead of being read
+    and normalized again; the new scene is written into the state and folded
+    into the per-pixel baseline as its tiles go by.
+    Returns (rgb_u8, lc, anom01 or None for the first scene, deviation).
+    """
+    prof = prof or StageProfiler(trace_alloc=False)
+    h, w = src.height, src.width
+    grid = tile_grid(h, w, TILE_SIZE, TILE_OVERLAP, min_window=SSIM_WIN)
+    plan = _band_plan(src.count, ("rgb", "landcover"))
+    rgb_idx, lc_idx = _rgb_bands(src.count), _landcover_bands(src.count)
+    prev_rgb, prev_gray = state.previous("rgb"), state.previous("gray")
+
+    rgb_u8 = np.empty((h, w, 3), dtype=np.uint8)
+    lc = np.empty((h, w), dtype=np.uint8)
+    anom = np.empty((h, w), dtype=np.float32) if prev_rgb is not None else None
+    dev = np.empty((h, w), dtype=np.float32)
+
+    def process(tile, a):
+        rgb = plan.take(a, rgb_idx)
+        gray = grayscale(rgb)
+        lo, hi = np.inf, -np.inf
+        if prev_rgb is not None:
+            with prof.span("anomaly"):
+                rows, cols = tile.window.toslices()
+                score = anomaly_score(prev_rgb[rows, cols], rgb, prev_gray[rows, cols], gray)[tile.core]
+                anom[tile.dst] = score
+                lo, hi = float(score.min()), float(score.max())
+        with prof.span("baseline"):
+            dev[tile.dst] = state.update(tile.dst, rgb[tile.core], gray[tile.core])
+        with prof.span("rgb_u8"):
+            rgb_u8[tile.dst] = _to_u8(rgb[tile.core])
+        with prof.span("landcover"):
+            if lc_idx:
+                core = a[tile.core]
+                red, green, nir = (core[..., plan.index[b]] for b in lc_idx)
+                lc[tile.dst] = _landcover_from_bands(red, green, nir)
+            else:
+                lc[tile.dst] = 0
+        return lo, hi
+
+    reads = prof.iter_span("read", iter_tiles(src, grid, plan.bands))
+    lo, hi = np.inf, -np.inf
+    for i, (tlo, thi) in enumerate(ANOMALY.imap(process, reads)):
+        lo, hi = min(lo, tlo), max(hi, thi)
+        if progress:
+            progress("tiles", (i + 1) / len(grid))
+
+    if anom is not None:
+        normalize_(anom, lo, hi)
+    return rgb_u8, lc, anom, dev
+
+
+def _series_scene_path(series_dir: Path, scene: Dict) -> Path:
+    return series_dir / "scenes" / f"{scene['index']:04d}_{scene['filename']}"
+
+
+def _series_pending(series_dir: Path) -> List[Dict]:
+    """Appended scenes that have no step result yet, in order."""
+    scenes = json.loads((series_dir / "series.json").read_text())["scenes"]
+    return [s for s in scenes if not (series_dir / "steps" / str(s["index"]) / "result.json").exists()]
+
+
+def _series_step(series_id: str, scene: Dict, state: SeriesState, progress: Progress) -> Dict:
+    prof = StageProfiler(trace_alloc=PROFILE_ALLOC)
+    series_dir = SERIES_DIR / series_id
+    k = scene["index"]
+    step_dir = series_dir / "steps" / str(k)
+    step_dir.mkdir(parents=True, exist_ok=True)
+    base = f"/static/series/{series_id}/steps/{k}"
+    n_before, compared_to = state.count, state.meta.get("index")
+
+    progress("reading", 0.0)
+    with ExitStack() as stack:
+        # every scene is read on the grid of the series' first scene
+        try:
+            ref = stack.enter_context(open_scene(_series_scene_path(series_dir, state.meta["first"]))) if n_before else None
+            src = stack.enter_context(open_scene(_series_scene_path(series_dir, scene), like=ref))
+            state.begin((src.height, src.width))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"scene {k} doesn't line up with the series: {e}")
+        try:
+            with prof.stage("tiles"):
+                rgb_u8, lc, anom, dev = _series_tiles(src, state, progress, prof)
+        except BaseException:
+            state.abort()
+            raise
+        transform, crs = src.transform, src.crs
+
+    files = {key: step_dir / name for key, name in SERIES_FILES.items()}
+    renders = [
+        lambda: _save_rgb(rgb_u8, files["t1_rgb"]),
+        lambda: _save_landcover(lc, files["landcover"]),
+    ]
+    result = {
+        "series_id": series_id,
+        "index": k,
+        "scene": {"filename": scene["filename"], "acquired_at": scene.get("acquired_at")},
+        "compared_to": compared_to,
+        "size": [int(rgb_u8.shape[1]), int(rgb_u8.shape[0])],
+    }
+    if anom is not None:
+        with prof.stage("threshold"):
+            thr = _suggest_threshold(anom)
+        with prof.stage("anomaly_u8"):
+            anom_u8 = _to_u8(anom)
+        renders += [
+            lambda: _save_heatmap(anom_u8, files["heatmap"]),
+            lambda: _save_overlay(rgb_u8, anom, thr, files["overlay"]),
+            lambda: _save_anomaly_u8(anom_u8, files["anomaly_u8"]),
+        ]
+        with prof.stage("metrics"):
+            result["metrics"] = _metrics(anom, lc, thr, anom_u8)
+        with prof.stage("regions"):
+            regions = _save_regions(anom, lc, thr, transform, crs, step_dir / REGIONS_FILE)
+        result["regions"] = {"url": f"{base}/{REGIONS_FILE}", **regions}
+        result["threshold_suggestion"] = thr
+    if n_before >= 2:
+        renders.append(lambda: _save_heatmap(np.clip(dev / SERIES_Z_MAX, 0.0, 1.0), files["deviation"]))
+        result["baseline"] = {
+            "scenes": n_before,
+            "deviation_3sd_pct": float(np.count_nonzero(dev > 3.0) / max(dev.size, 1) * 100.0),
+            "deviation_max_sd": SERIES_Z_MAX,
+        }
+    progress("encoding", 0.0)
+    with prof.stage("encode"):
+        ENCODER.run_all(renders)
+
+    result["assets"] = {key: f"{base}/{path.name}" for key, path in files.items() if path.exists()}
+    result["landcover_labels"] = LC_LABELS
+    result["timings"] = prof.as_dict()
+
+    if not n_before:
+        state.meta["first"] = scene
+    state.meta["index"] = k
+    state.commit()
+    _write_json(step_dir / "result.json", result)
+    return result
+
+
+def _run_series(series_id: str, progress: Optional[Progress] = None) -> None:
+    """
+    JOBS worker: processes every pending scene of a series, oldest first,
+    including scenes appended while it runs. A scene that can't be used
+    (unreadable, different footprint) gets an error result and is skipped.
+    """
+    progress = progress or (lambda stage, fraction=0.0: None)
+    series_dir = SERIES_DIR / series_id
+    state = SeriesState(series_dir / "state")
+    while True:
+        pending = _series_pending(series_dir)
+        if not pending:
+            return
+        scene = pending[0]
+        try:
+            _series_step(series_id, scene, state, progress)
+        except (HTTPException, rasterio.errors.RasterioIOError) as e:
+            detail = getattr(e, "detail", None) or str(e)
+            _write_json(series_dir / "steps" / str(scene["index"]) / "result.json", {
+                "series_id": series_id, "index": scene["index"], "error": detail,
+            })
+
+
+def _series_job(series_id: str) -> Dict:
+    series_dir = SERIES_DIR / series_id
+    try:
+        return JOBS.submit(f"series-{series_id}", series_dir / "job.json", _run_series, series_id)
+    except QueueFull:
+        # the scene is stored; GET /api/series/{id} submits it later
+        return {"status": "deferred"}
+
+
+def _on_job_finish(job_id: str, status: Dict) -> None:
+    kind, _, rest = job_id.partition("-")
+    if kind == "series":
+        # a scene appended just as the worker drained the queue is still pending
+        if status.get("status") == "done" and _series_pending(SERIES_DIR / rest):
+            _series_job(rest)
+    elif kind == "roi":
+        run_id = rest.partition("-")[0]
+        _record_outputs(run_id)
+        RUN_INDEX.release(run_id, job_id)
+    else:
+        _observe_run(job_id, status)
+        RUN_INDEX.release(job_id, job_id)
+    _drain_batches()
+
+
+# -----------------------------
+# API
+# -----------------------------
+@app.post("/api/runs")
+async def create_run(request: Request):
+    """
+    multipart/form-data with t0 and t1 files. Bodies are streamed to disk,
+    hashed and size/format-checked as they arrive (see utils/uploads.py).
+    """
+    try:
+        files = await receive_files(request, BLOBS.root, ("t0", "t1"), MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    blobs = {key: BLOBS.adopt(f.path, f.sha256) for key, f in files.items()}
+    run_id, inputs = _new_run(files, blobs)
+    return {"run_id": run_id, "inputs": inputs}
+
+
+@app.get("/api/runs")
+def list_runs(
+    limit: int = Query(50, ge=1, le=RUNS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """
+    Runs from the index, newest first. Pass `next_cursor` back as `cursor`
+    for the next page; it is null on the last one.
+    """
+    try:
+        rows, next_cursor = RUN_INDEX.page(limit, cursor, status)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    runs = [
+        {
+            "run_id": r["run_id"],
+            "status": r["status"],
+            "created_at": r["created_at"],
+            "accessed_at": r["accessed_at"],
+            "inputs": {
+                k: {"filename": r[f"{k}_name"], "sha256": r[f"{k}_sha256"]} for k in ("t0", "t1")
+            },
+            "bytes": r["bytes"] + r["input_bytes"],
+            "pinned": bool(r["pinned"]),
+        }
+        for r in rows
+    ]
+    return {"runs": runs, "next_cursor": next_cursor}
+
+
+@app.post("/api/runs/{run_id}/detect", status_code=202)
+def detect(
+    run_id: str,
+    response: Response,
+    bbox: Optional[str] = None,
+    bbox_crs: str = "pixel",
+    preview: bool = False,
+    scale: float = Query(QUICKLOOK_SCALE, gt=0.0, le=1.0),
+    cog: bool = False,
+):
+    """
+    Queues the detect pipeline and returns immediately.
+    Poll GET /api/runs/{run_id} for status/progress and, once done, the result.
+    Identical inputs already processed by this pipeline version are answered
+    from the result cache with 200 and the result itself.
+
+    With `bbox` ("minx,miny,maxx,maxy" in pixels, or in `bbox_crs`, e.g.
+    EPSG:4326) only that region is read and processed. Small regions are
+    answered directly with 200; larger ones are queued, poll
+    GET /api/runs/{run_id}/roi/{roi_id}.
 
-    (run_dir / "result.json").write_text(json.dumps(result, indent=2))
+    With `preview` the whole scene is processed at `scale` and the
+    approximate result comes back directly with 200.
+
+    With `cog` the anomaly score, threshold mask and landcover are also
+    written as georeferenced Cloud-Optimized GeoTIFFs (result["cog"]).
+    """
+    run_dir = _require_run(run_id)
+    _find_uploads(run_dir)
+    if preview:
+        if bbox is not None:
+            raise HTTPException(status_code=400, detail="preview and bbox can't be combined")
+        response.status_code = 200
+        return _quicklook(run_id, run_dir, scale)
+    if bbox is not None:
+        return _detect_roi(run_id, run_dir, bbox, bbox_crs, response)
+
+    cached = _cached_detect(run_id, cog)
+    if cached is not None:
+        response.status_code = 200
+        return cached
+
+    # before submit: the on_finish hook may record the outcome before submit returns
+    RUN_INDEX.update(run_id, status="queued")
+    _lease_run(run_id, run_id)
+    try:
+        job = JOBS.submit(run_id, run_dir / "job.json", _run_detect, run_id, cog)
+    except QueueFull:
+        RUN_INDEX.release(run_id, run_id)
+        RUN_INDEX.update(run_id, status=(read_status(run_dir / "job.json") or {}).get("status", "created"))
+        raise HTTPException(
+            status_code=429,
+            detail="Detection queue is full, retry shortly",
+            headers={"Retry-After": str(DETECT_RETRY_AFTER)},
+        )
+    return {"run_id": run_id, "job": job}
+
+
+@app.get("/api/runs/{run_id}/roi/{roi_id}")
+def get_roi(run_id: str, roi_id: str):
+    roi_dir = _require_run(run_id) / "roi" / roi_id
+    if not re.fullmatch(r"\d+_\d+_\d+_\d+", roi_id) or not roi_dir.exists():
+        raise HTTPException(status_code=404, detail="roi not found")
+    job = read_status(roi_dir / "job.json")
+    if job is not None and job.get("status") != "done":
+        return {"run_id": run_id, "roi": {"id": roi_id}, "job": job}
+    result = json.loads((roi_dir / "result.json").read_text())
+    if job is not None:
+        result["job"] = job
     return result
 
 
+async def _event_stream(status_path: Path, last_id: int = 0):
+    """
+    Server-Sent Events from a job's events.ndjson: replays the log after
+    event `last_id` (Last-Event-ID of a reconnecting client), then follows it
+    until the job reaches a terminal status. Event ids are log line numbers.
+    """
+    path = events_path(status_path)
+    if not path.exists():
+        job = read_status(status_path)
+        if job is None and not (status_path.parent / "result.json").exists():
+            # never submitted: nothing will ever be logged
+            data = json.dumps({"event": "status", "status": "idle"})
+            yield f"event: status\ndata: {data}\n\n".encode()
+            return
+        job = job or {}
+        if job.get("status") in TERMINAL or (status_path.parent / "result.json").exists():
+            # finished before event logs existed
+            data = json.dumps({"event": "status", "status": job.get("status", "done")})
+            yield f"event: status\ndata: {data}\n\n".encode()
+            return
+
+    seen = offset = 0
+    buf = b""
+    idle = 0.0
+    while True:
+        size = path.stat().st_size if path.exists() else 0
+        if size < offset:
+            # the job was submitted again and its log restarted
+            seen = offset = last_id = 0
+            buf = b""
+        if size > offset:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                buf += f.read(size - offset)
+            offset = size
+            *lines, buf = buf.split(b"\n")
+            for line in lines:
+                seen += 1
+                if seen <= last_id:
+                    continue
+                event = json.loads(line)
+                yield f"id: {seen}\nevent: {event['event']}\ndata: {line.decode()}\n\n".encode()
+                if event["event"] == "status" and event.get("status") in TERMINAL:
+                    return
+            idle = 0.0
+        else:
+            idle += SSE_POLL_S
+            if idle >= SSE_KEEPALIVE_S:
+                idle = 0.0
+                yield b": keepalive\n\n"
+        await asyncio.sleep(SSE_POLL_S)
+
+
+def _sse_response(status_path: Path, request: Request) -> StreamingResponse:
+    last_id = request.headers.get("last-event-id", "")
+    return StreamingResponse(
+        _event_stream(status_path, int(last_id) if last_id.isdigit() else 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/runs/{run_id}/events")
+def run_events(run_id: str, request: Request):
+    """
+    Live detect progress as Server-Sent Events: `status` (queued / running /
+    done / failed), `progress` (stage, fraction; per tile during the tile
+    pass) and `preview` (URL of a low-resolution anomaly heatmap, available
+    within a second and refined as full-resolution tiles complete). The
+    stream ends after the final status; then GET /api/runs/{run_id}.
+    A run that was never detected gets a single `idle` status and the
+    stream closes.
+    """
+    return _sse_response(_require_run(run_id) / "job.json", request)
+
+
 @app.get("/api/runs/{run_id}")
 def get_run(run_id: str):
-    run_dir = RUNS_DIR / run_id
-    if not run_dir.exists():
-        raise HTTPException(status_code=404, detail="run_id not found")
+    run_dir = _require_run(run_id)
+    job = read_status(run_dir / "job.json")
     result_path = run_dir / "result.json"
+    if job is not None and job.get("status") != "done":
+        # queued / running / failed: report the job, not a stale result
+        return {"run_id": run_id, "job": job}
     if not result_path.exists():
         raise HTTPException(status_code=404, detail="No result.json yet. Call /detect first.")
-    return json.loads(result_path.read_text())
+    result = json.loads(result_path.read_text())
+    if job is not None:
+        result["job"] = job
+    return result
+
+
+def _parse_manifest(text: str, files: Dict[str, ReceivedFile]) -> List[Dict[str, str]]:
+    try:
+        pairs = json.loads(text)["pairs"]
+        pairs = [{"name": str(p.get("name", i)), "t0": p["t0"], "t1": p["t1"]} for i, p in enumerate(pairs)]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail='manifest must be {"pairs": [{"name", "t0", "t1"}, ...]}')
+    if not pairs:
+        raise HTTPException(status_code=400, detail="manifest has no pairs")
+    unknown = sorted({p[k] for p in pairs for k in ("t0", "t1")} - set(files))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"manifest references missing file field(s): {', '.join(unknown)}")
+    return pairs
+
+
+def _queue_batch(run_ids: List[str]) -> None:
+    """
+    Marks every run of a batch queued (index, job.json, lease) and hands
+    them to the batch backlog, which JOBS drains as slots free up whether or
+    not the client is still reading the response.
+    """
+    for run_id in run_ids:
+        status_path = RUNS_DIR / run_id / "job.json"
+        RUN_INDEX.update(run_id, status="queued")
+        _lease_run(run_id, run_id)  # the job's own lease, released when it finishes
+        write_status(status_path, status="queued", stage="queued", progress=0.0, error=None)
+        append_event(status_path, "status", reset=True, status="queued")
+        key = _result_key(RUNS_DIR / run_id)
+        with _BATCH_LOCK:
+            _BATCH_WAITING.append((run_id, key))
+    _drain_batches()
+
+
+def _drain_batches() -> None:
+    """
+    Submits waiting batch runs while JOBS has room. A run whose inputs match
+    one still in flight waits for it and is then answered from the result
+    cache. Called after queueing a batch and after every finished job.
+    """
+    with _BATCH_LOCK:
+        for run_id in [r for r in _BATCH_RUNNING if not JOBS.is_active(r)]:
+            del _BATCH_RUNNING[run_id]
+        busy = set(_BATCH_RUNNING.values())
+        for run_id, key in list(_BATCH_WAITING):
+            if key in busy or (run_id, key) not in _BATCH_WAITING:
+                continue
+            if _cached_detect(run_id) is not None:
+                _BATCH_WAITING.remove((run_id, key))
+                RUN_INDEX.release(run_id, run_id)
+                continue
+            try:
+                JOBS.submit(run_id, RUNS_DIR / run_id / "job.json", _run_detect, run_id)
+            except QueueFull:
+                break
+            _BATCH_WAITING.remove((run_id, key))
+            _BATCH_RUNNING[run_id] = key
+            busy.add(key)
+
+
+def _batch_line(name: str, run_id: str) -> bytes:
+    """NDJSON line for a finished run: its result, or the job error."""
+    run_dir = RUNS_DIR / run_id
+    job = read_status(run_dir / "job.json") or {}
+    line = {"name": name, "run_id": run_id, "status": job.get("status", "failed")}
+    if line["status"] == "done":
+        line["result"] = json.loads((run_dir / "result.json").read_text())
+    else:
+        line["error"] = job.get("error")
+    return (json.dumps(line) + "\n").encode()
+
+
+async def _stream_batch(runs: List[Tuple[str, str]]):
+    """Yields the batch's run ids, then one NDJSON line per run as it finishes."""
+    yield (json.dumps({"batch": [{"name": n, "run_id": r} for n, r in runs]}) + "\n").encode()
+    left = {run_id: name for name, run_id in runs}
+    while left:
+        await asyncio.sleep(BATCH_POLL_S)
+        for run_id, name in list(left.items()):
+            job = read_status(RUNS_DIR / run_id / "job.json") or {}
+            if job.get("status") in TERMINAL and not JOBS.is_active(run_id):
+                del left[run_id]
+                yield await run_in_threadpool(_batch_line, name, run_id)
+
+
+@app.post("/api/batch")
+async def batch_detect(request: Request):
+    """
+    Detect for many scene pairs in one request. multipart/form-data with any
+    number of scene files plus a `manifest` field:
+        {"pairs": [{"name": "paris", "t0": "<file field>", "t1": "<file field>"}, ...]}
+    A file may appear in several pairs; it is uploaded and stored once.
+    Every pair becomes a regular run (pollable via GET /api/runs/{id}). The
+    response is NDJSON: a first line listing the run ids, then one line per
+    pair as it finishes.
+    """
+    try:
+        files, values = await receive_form(
+            request, BLOBS.root, None, MAX_UPLOAD_BYTES, values=("manifest",), max_files=BATCH_MAX_FILES
+        )
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        pairs = _parse_manifest(values["manifest"], files)
+    except HTTPException:
+        for f in files.values():
+            f.path.unlink(missing_ok=True)
+        raise
+
+    blobs = {field: BLOBS.adopt(f.path, f.sha256) for field, f in files.items()}
+    runs = []
+    for p in pairs:
+        run_id, _ = _new_run(
+            {"t0": files[p["t0"]], "t1": files[p["t1"]]},
+            {"t0": blobs[p["t0"]], "t1": blobs[p["t1"]]},
+        )
+        runs.append((p["name"], run_id))
+    # queued before the response starts: a client that disconnects early
+    # doesn't stop the rest of the batch
+    await run_in_threadpool(_queue_batch, [run_id for _, run_id in runs])
+    return StreamingResponse(_stream_batch(runs), media_type="application/x-ndjson")
+
+
+def _require_series(series_id: str) -> Path:
+    series_dir = SERIES_DIR / series_id
+    if not series_id.isalnum() or not (series_dir / "series.json").exists():
+        raise HTTPException(status_code=404, detail="series_id not found")
+    return series_dir
+
+
+@app.post("/api/series", status_code=201)
+def create_series():
+    """Starts an empty time series; append acquisitions to it in order."""
+    series_id = uuid.uuid4().hex
+    series_dir = SERIES_DIR / series_id
+    (series_dir / "scenes").mkdir(parents=True)
+    _write_json(series_dir / "series.json", {"series_id": series_id, "created_at": time.time(), "scenes": []})
+    return {"series_id": series_id}
+
+
+@app.post("/api/series/{series_id}/scenes", status_code=202)
+async def append_scene(series_id: str, request: Request, acquired_at: Optional[str] = None):
+    """
+    multipart/form-data with one `scene` file: the next acquisition of the
+    series. It is compared with the previous scene in the background; poll
+    GET /api/series/{series_id} for the per-scene results.
+    """
+    series_dir = _require_series(series_id)
+    try:
+        files = await receive_files(request, BLOBS.root, ("scene",), MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    f = files["scene"]
+    blob = BLOBS.adopt(f.path, f.sha256)
+    with SERIES_LOCK:
+        meta = json.loads((series_dir / "series.json").read_text())
+        scene = {
+            "index": len(meta["scenes"]),
+            "filename": f.filename,
+            "sha256": f.sha256,
+            "size": f.size,
+            "kind": f.kind,
+            "acquired_at": acquired_at,
+        }
+        link_or_copy(blob, _series_scene_path(series_dir, scene))
+        meta["scenes"].append(scene)
+        _write_json(series_dir / "series.json", meta)
+    return {"series_id": series_id, "index": scene["index"], "job": _series_job(series_id)}
+
+
+@app.get("/api/series/{series_id}/events")
+def series_events(series_id: str, request: Request):
+    """Progress of the series' current job as Server-Sent Events (see /api/runs/{run_id}/events)."""
+    return _sse_response(_require_series(series_id) / "job.json", request)
+
+
+@app.get("/api/series/{series_id}")
+def get_series(series_id: str):
+    series_dir = _require_series(series_id)
+    meta = json.loads((series_dir / "series.json").read_text())
+    job_id = f"series-{series_id}"
+    job = read_status(series_dir / "job.json")
+    if not JOBS.is_active(job_id) and _series_pending(series_dir) and (job or {}).get("status") != "failed":
+        job = _series_job(series_id)
+
+    for scene in meta["scenes"]:
+        result_path = series_dir / "steps" / str(scene["index"]) / "result.json"
+        scene["result"] = json.loads(result_path.read_text()) if result_path.exists() else None
+    meta["job"] = job
+    return meta
+
+
+@lru_cache(maxsize=THRESHOLD_MEMO)
+def _threshold_metrics(run_id: str, stamp: int, thr: float) -> Dict:
+    # `stamp` (anomaly.npy mtime) keys out entries from an earlier detect
+    run_dir = RUNS_DIR / run_id
+    anom = np.load(run_dir / "anomaly.npy", mmap_mode="r")
+    lc = np.load(run_dir / "landcover.npy", mmap_mode="r")
+    return _metrics(anom, lc, thr)
+
+
+@app.get("/api/runs/{run_id}/threshold")
+def rethreshold(run_id: str, thr: float = Query(..., ge=0.0, le=1.0)):
+    """
+    Metrics and overlay for another threshold, from the anomaly/landcover
+    maps persisted by detect. The overlay URL is rendered on first fetch.
+    """
+    run_dir = _require_run(run_id)
+    try:
+        stamp = (run_dir / "anomaly.npy").stat().st_mtime_ns
+    except FileNotFoundError:
+        raise HTTPException(status_code=409, detail="No anomaly map for this run. Call /detect first.")
+    if not (run_dir / "landcover.npy").exists():
+        raise HTTPException(status_code=409, detail="Run predates re-thresholding. Call /detect again.")
+
+    thr = round(thr, 3)
+    return {
+        "run_id": run_id,
+        "threshold": thr,
+        "metrics": _threshold_metrics(run_id, stamp, thr),
+        "assets": {"overlay": f"/static/runs/{run_id}/thresholds/{_threshold_overlay_name(thr)}"},
+    }
+
+
+@app.get("/api/runs/{run_id}/tiles/{asset}/{z}/{x}/{y}")
+def get_tile(run_id: str, asset: str, z: int, x: int, y: int, request: Request):
+    """
+    One TILE x TILE tile of an asset's pyramid (z=max_zoom is full resolution).
+    Tiles never change for a finished run, so they carry an ETag and a long
+    Cache-Control; a matching If-None-Match gets 304.
+    """
+    if asset not in TILE_ASSETS or not run_id.isalnum():
+        raise HTTPException(status_code=404, detail="unknown tile asset")
+    path = tile_path(RUNS_DIR / run_id / "tiles" / asset, z, x, y, ENCODER.ext)
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="tile not found")
+
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {"ETag": etag, "Cache-Control": TILE_CACHE_CONTROL}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=f"image/{ENCODER.ext}", headers=headers)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition: stage timing/allocation histograms, run counts, queue and cache gauges."""
+    return Response(METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 if __name__ == "__main__":
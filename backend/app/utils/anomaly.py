@@ -0,0 +1,117 @@
+"""
+Tiled AbsDiff + SSIM anomaly engine.
+
+The score is pixelwise apart from the SSIM window, so a scene can be cut into
+tiles that overlap by the window radius (HALO), scored independently on a
+thread pool (numpy / scipy.ndimage release the GIL) and stitched back without
+seams. Everything stays float32; the global min/max normalization is a second
+pass driven by the per-tile min/max.
+"""
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+from .raster import tile_grid
+
+SSIM_WIN = 7             # skimage default window
+HALO = SSIM_WIN // 2     # tile overlap that makes tiled SSIM exact
+W_DIFF, W_SSIM = 0.6, 0.4
+
+
+def grayscale(rgb: np.ndarray) -> np.ndarray:
+    """The hxw float32 grayscale anomaly_score runs SSIM on."""
+    return rgb.mean(axis=2, dtype=np.float32)
+
+
+def anomaly_score(
+    t0_rgb: np.ndarray,
+    t1_rgb: np.ndarray,
+    g0: Optional[np.ndarray] = None,
+    g1: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Raw (un-normalized) score. Inputs are hxwx3 float32 in [0,1]; float32 out.
+    g0 / g1 are the inputs' grayscale() when the caller already has them.
+    """
+    t0_rgb = t0_rgb.astype(np.float32, copy=False)
+    t1_rgb = t1_rgb.astype(np.float32, copy=False)
+
+    diff = np.abs(t1_rgb - t0_rgb).mean(axis=2, dtype=np.float32)
+    g0 = grayscale(t0_rgb) if g0 is None else g0
+    g1 = grayscale(t1_rgb) if g1 is None else g1
+
+    # SSIM returns similarity; convert to anomaly. float32 inputs keep the
+    # filter intermediates float32 too.
+    _, score = ssim(g0, g1, win_size=SSIM_WIN, full=True, data_range=1.0)
+    score = score.astype(np.float32, copy=False)
+    np.subtract(1.0, score, out=score)
+    score *= W_SSIM
+    diff *= W_DIFF
+    score += diff
+    return score
+
+
+def normalize_(score: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    """Global min/max stretch to [0,1], in place."""
+    score -= lo
+    score /= hi - lo + 1e-6
+    return score
+
+
+class AnomalyEngine:
+    def __init__(self, workers: Optional[int] = None, tile_size: int = 512):
+        self.workers = workers or os.cpu_count() or 1
+        self.tile_size = tile_size
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        # created lazily so it is built inside whichever process runs detect
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="anomaly")
+        return self._pool
+
+    def imap(self, fn: Callable, items: Iterable, max_inflight: Optional[int] = None) -> Iterator:
+        """
+        Ordered, bounded parallel map: at most `max_inflight` items are
+        submitted ahead of the consumer, which keeps memory at a few tiles.
+        """
+        max_inflight = max_inflight or 2 * self.workers
+        pending = deque()
+        for item in items:
+            pending.append(self.pool.submit(fn, *item))
+            if len(pending) >= max_inflight:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def score_map(self, t0_rgb: np.ndarray, t1_rgb: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        """
+        Tiled raw score for whole HxWx3 arrays. Returns (score, lo, hi) with
+        lo/hi gathered from the per-tile minima/maxima.
+        """
+        h, w = t0_rgb.shape[:2]
+        out = np.empty((h, w), dtype=np.float32)
+        grid = tile_grid(h, w, self.tile_size, HALO, min_window=SSIM_WIN)
+
+        def one(tile):
+            rows, cols = tile.window.toslices()
+            core = anomaly_score(t0_rgb[rows, cols], t1_rgb[rows, cols])[tile.core]
+            out[tile.dst] = core
+            return float(core.min()), float(core.max())
+
+        stats = list(self.imap(one, ((t,) for t in grid)))
+        lo = min(s[0] for s in stats)
+        hi = max(s[1] for s in stats)
+        return out, lo, hi
+
+    def anomaly_map(self, t0_rgb: np.ndarray, t1_rgb: np.ndarray) -> np.ndarray:
+        """HxWx3 float32 in [0,1] -> HxW float32 anomaly in [0,1]."""
+        score, lo, hi = self.score_map(t0_rgb, t1_rgb)
+        return normalize_(score, lo, hi)
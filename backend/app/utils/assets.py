@@ -0,0 +1,103 @@
+"""
+Asset encoding for detect outputs.
+
+Encoder writes images in the configured format (PNG or WebP) and compression
+level, atomically, and can run a batch of encodes on a thread pool (PIL's
+encoders release the GIL). LazyStaticFiles lets secondary assets be rendered
+on their first request instead of during detect.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+import numpy as np
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+FORMATS = {"png": "PNG", "webp": "WEBP"}
+
+
+class Encoder:
+    def __init__(self, fmt: str = "png", png_level: int = 1, webp_quality: int = 90, workers: int = 4):
+        fmt = fmt.lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"unsupported asset format {fmt!r}, expected one of {sorted(FORMATS)}")
+        self.fmt = fmt
+        self.png_level = png_level
+        self.webp_quality = webp_quality
+        self.workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def ext(self) -> str:
+        return self.fmt
+
+    @property
+    def lossy(self) -> bool:
+        """Whether saved pixels may differ from the array (WebP without `lossless`)."""
+        return self.fmt == "webp"
+
+    def save(self, arr: np.ndarray, path: Path, lossless: bool = False) -> None:
+        """
+        Encodes a uint8 HxW / HxWx3 array to `path`. `lossless` is for data
+        layers (anomaly_u8, landcover) whose pixel values must survive WebP.
+        Written to a temp file first so a concurrent reader never sees half
+        an image.
+        """
+        path = Path(path)
+        img = Image.fromarray(arr)
+        if self.fmt == "png":
+            params = {"compress_level": self.png_level}
+        elif lossless:
+            params = {"lossless": True, "quality": 0}  # quality = effort when lossless
+        else:
+            params = {"quality": self.webp_quality}
+
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        img.save(tmp, format=FORMATS[self.fmt], **params)
+        os.replace(tmp, path)
+
+    def run_all(self, tasks: Iterable[Callable[[], None]]) -> None:
+        """Runs encode callables in parallel; re-raises the first failure."""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encode")
+        for fut in [self._pool.submit(t) for t in tasks]:
+            fut.result()
+
+
+class LazyStaticFiles(StaticFiles):
+    """
+    StaticFiles that, on a 404, asks `render(path)` to produce the file and
+    serves it if that succeeded. Renders of the same path are serialized.
+    """
+
+    def __init__(self, *args, render: Callable[[str], bool], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.render = render
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _render_once(self, path: str) -> bool:
+        with self._locks_guard:
+            lock = self._locks.setdefault(path, threading.Lock())
+        with lock:
+            try:
+                return self.render(path)
+            finally:
+                with self._locks_guard:
+                    self._locks.pop(path, None)
+
+    async def get_response(self, path: str, scope):
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404 or not await run_in_threadpool(self._render_once, path):
+                raise
+        return await super().get_response(path, scope)
@@ -0,0 +1,223 @@
+"""
+Content-addressed storage for uploads and detect results.
+
+Uploads are stored once per sha256 and hard-linked into run directories.
+Detect artifacts are cached under a key derived from the input hashes and
+the pipeline version/params, so re-running an identical pair just links the
+cached files into the new run. The result cache is size-bounded and evicts
+least-recently-used entries; the total it holds is recorded on every
+eviction pass, so reporting it doesn't walk the cache.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+CHUNK = 1 << 20
+USED_MARKER = ".used"
+STATS_FILE = ".stats.json"
+
+
+def sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(**fields) -> str:
+    """Stable hash of JSON-serializable key fields (input hashes, version, params)."""
+    return hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """
+    Hard-links src to dst (replacing dst), copying across filesystems.
+    Directories are mirrored file by file.
+    """
+    if Path(src).is_dir():
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst, copy_function=_link_file)
+        return
+    if dst.exists():
+        dst.unlink()
+    _link_file(src, dst)
+
+
+def _link_file(src, dst) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def tree_size(path: Path) -> int:
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+class BlobStore:
+    """Upload bodies keyed by sha256: <root>/<aa>/<sha256>."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, sha: str) -> Path:
+        return self.root / sha[:2] / sha
+
+    def adopt(self, tmp: Path, sha: str) -> Path:
+        """Moves a fully written temp file into the store under `sha`."""
+        dst = self.path(sha)
+        if dst.exists():
+            Path(tmp).unlink()
+            os.utime(dst)  # fresh mtime keeps gc() off a blob about to be linked
+        else:
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp, dst)
+        return dst
+
+    def gc(self, grace_s: float = 600.0) -> int:
+        """
+        Deletes blobs no run links to any more (link count 1) that are older
+        than grace_s; returns bytes freed.
+        """
+        freed = 0
+        if not self.root.exists():
+            return freed
+        cutoff = time.time() - grace_s
+        for f in self.root.glob("??/*"):
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            if f.name.startswith(".") or st.st_nlink > 1 or st.st_mtime > cutoff:
+                continue
+            f.unlink(missing_ok=True)
+            freed += st.st_size
+        return freed
+
+    def put_bytes(self, data: bytes) -> str:
+        sha = hashlib.sha256(data).hexdigest()
+        dst = self.path(sha)
+        if not dst.exists():
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            tmp = dst.with_name(f".{sha}.{uuid.uuid4().hex}")
+            tmp.write_bytes(data)
+            os.replace(tmp, dst)
+        return sha
+
+
+class ResultCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key
+
+    def get(self, key: str) -> Optional[Path]:
+        """Entry dir for `key` (marked as just used), or None."""
+        entry = self._entry(key)
+        marker = entry / USED_MARKER
+        if not marker.exists():
+            return None
+        os.utime(marker)
+        return entry
+
+    def put(self, key: str, files: Iterable[Path]) -> Path:
+        """Links `files` into a new entry for `key`, then enforces the size budget."""
+        entry = self._entry(key)
+        if (entry / USED_MARKER).exists():
+            return entry
+
+        tmp = self.root / f".tmp-{key}-{uuid.uuid4().hex}"
+        tmp.mkdir(parents=True)
+        for f in files:
+            link_or_copy(Path(f), tmp / Path(f).name)
+        (tmp / USED_MARKER).touch()
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # another process cached the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict(keep=key)
+        return entry
+
+    def materialize(self, key: str, dst_dir: Path) -> List[Path]:
+        """Links every cached file of `key` into dst_dir."""
+        entry = self._entry(key)
+        out = []
+        for f in entry.iterdir():
+            if f.name == USED_MARKER:
+                continue
+            link_or_copy(f, dst_dir / f.name)
+            out.append(dst_dir / f.name)
+        return out
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Entry count and bytes as of the last put/evict (any process), read
+        from the stats file; the cache is scanned only if there is none yet.
+        """
+        try:
+            recorded = json.loads((self.root / STATS_FILE).read_text())
+        except (FileNotFoundError, ValueError):
+            with self._lock:
+                entries = self._scan()
+                recorded = self._record(len(entries), sum(e[2] for e in entries))
+        return {"entries": recorded["entries"], "bytes": recorded["bytes"], "max_bytes": self.max_bytes}
+
+    def _record(self, entries: int, total: int) -> Dict[str, int]:
+        """Writes the cache's current totals to the stats file (atomic replace)."""
+        recorded = {"entries": entries, "bytes": total}
+        if self.root.exists():
+            tmp = self.root / f".{STATS_FILE}.{os.getpid()}.tmp"
+            tmp.write_text(json.dumps(recorded))
+            os.replace(tmp, self.root / STATS_FILE)
+        return recorded
+
+    def _scan(self):
+        """[(last_used, entry, bytes)] for complete entries."""
+        out = []
+        if not self.root.exists():
+            return out
+        for entry in self.root.iterdir():
+            marker = entry / USED_MARKER
+            try:
+                used = marker.stat().st_mtime
+                size = tree_size(entry)
+            except OSError:
+                continue
+            out.append((used, entry, size))
+        return out
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """Drops least-recently-used entries until under max_bytes; returns bytes freed."""
+        with self._lock:
+            entries = sorted(self._scan(), key=lambda e: e[0])
+            total = sum(e[2] for e in entries)
+            freed = 0
+            removed = 0
+            for used, entry, size in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry.name == keep:
+                    continue
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                freed += size
+                removed += 1
+            self._record(len(entries) - removed, total)
+            return freed
@@ -0,0 +1,75 @@
+"""
+Cloud-Optimized GeoTIFF writers for detect's raster layers.
+
+Each layer is handed to GDAL as an in-memory dataset carrying the scene's CRS
+and transform and copied out through the COG driver: 512 px internal tiles,
+DEFLATE, overviews down to a single tile, IFDs up front. GIS tools can
+overlay the files directly and HTTP clients can range-read only the tiles
+and zoom level they need.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Sequence
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from affine import Affine
+
+BLOCK = 512
+
+
+def write_cog(
+    path: Path,
+    data: np.ndarray,
+    transform: Affine,
+    crs=None,
+    resampling: str = "average",
+    nbits: Optional[int] = None,
+    colormap: Optional[Mapping[int, Sequence[int]]] = None,
+    nodata: Optional[float] = None,
+    scale: Optional[float] = None,
+    tags: Optional[Dict[str, str]] = None,
+) -> Path:
+    """
+    Writes an HxW array as a single-band COG. `nbits` packs the samples
+    (1 for masks, 16 on float32 data for half floats); `resampling` is the
+    overview kernel (nearest for labels); `scale` is recorded as the band's
+    value scale (e.g. 1/255 for a quantized [0,1] map). Written to a temp
+    name and renamed.
+    """
+    path = Path(path)
+    h, w = data.shape
+    opts = {
+        "COMPRESS": "DEFLATE",
+        "BLOCKSIZE": BLOCK,
+        "OVERVIEWS": "AUTO",
+        "RESAMPLING": resampling.upper(),
+        "NUM_THREADS": "ALL_CPUS",
+    }
+    if nbits is not None:
+        opts["NBITS"] = nbits
+    if data.dtype.kind == "f":
+        opts["PREDICTOR"] = "FLOATING_POINT"
+
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    profile = dict(
+        driver="MEM", width=w, height=h, count=1, dtype=data.dtype.name,
+        crs=crs, transform=transform, nodata=nodata,
+    )
+    try:
+        with rasterio.open("", "w", **profile) as mem:
+            mem.write(data, 1)
+            if colormap is not None:
+                mem.write_colormap(1, colormap)
+            if scale is not None:
+                mem.scales = (scale,)
+            if tags:
+                mem.update_tags(**tags)
+            rasterio.shutil.copy(mem, tmp, driver="COG", **opts)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return path
@@ -0,0 +1,158 @@
+"""
+Bounded background scheduler for long pipeline runs.
+
+Jobs run on a small process pool so a big scene never blocks an API worker.
+Each job owns a JSON status file (status / stage / progress) that the worker
+process updates as it goes and the API reads back when polled. Next to it,
+an append-only events.ndjson log records every status change, progress step
+and pipeline event (e.g. previews) in order, for streaming to clients. The
+scheduler refuses new jobs once `max_pending` are queued or running
+(backpressure).
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+TERMINAL = ("done", "failed")
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+def read_status(path: Path) -> Optional[Dict]:
+    try:
+        return json.loads(Path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def events_path(status_path: Path) -> Path:
+    return Path(status_path).with_name("events.ndjson")
+
+
+def append_event(status_path: Path, kind: str, reset: bool = False, **data) -> None:
+    """Appends one event line to the job's log (`reset` starts a new log)."""
+    line = json.dumps({"event": kind, "t": round(time.time(), 3), **data}) + "\n"
+    with open(events_path(status_path), "w" if reset else "a") as f:
+        f.write(line)
+
+
+def write_status(path: Path, **fields) -> Dict:
+    """Merges `fields` into the status file (atomic replace)."""
+    path = Path(path)
+    status = read_status(path) or {}
+    status.update(fields)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(status))
+    os.replace(tmp, path)
+    return status
+
+
+class JobProgress:
+    """
+    Picklable progress callback handed to the job function:
+    progress("ssim", 0.4) records the current stage and its completion.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def __call__(self, stage: str, fraction: float = 0.0) -> None:
+        fraction = round(float(fraction), 4)
+        write_status(self.path, stage=stage, progress=fraction)
+        append_event(self.path, "progress", stage=stage, progress=fraction)
+
+    def event(self, kind: str, **data) -> None:
+        """A pipeline event for the log only, e.g. a preview becoming available."""
+        append_event(self.path, kind, **data)
+
+
+def _run_job(status_path: Path, fn: Callable, args: tuple):
+    write_status(status_path, status="running", started_at=time.time())
+    append_event(status_path, "status", status="running")
+    try:
+        fn(*args, progress=JobProgress(status_path))
+    except Exception as e:
+        detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+        write_status(status_path, status="failed", error=detail, finished_at=time.time())
+        append_event(status_path, "status", status="failed", error=detail)
+        return
+    write_status(status_path, status="done", stage="done", progress=1.0, finished_at=time.time())
+    append_event(status_path, "status", status="done")
+
+
+class JobScheduler:
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_pending: int = 8,
+        on_finish: Optional[Callable[[str, Dict], None]] = None,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        # called in the API process with (job_id, final status) of every job
+        self.on_finish = on_finish
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._active: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: the API process is multi-threaded, forking it is unsafe
+            ctx = multiprocessing.get_context("spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+        return self._pool
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._active)
+
+    def is_active(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._active
+
+    def submit(self, job_id: str, status_path: Path, fn: Callable, *args) -> Dict:
+        """
+        Queues fn(*args, progress=...) unless the same job is already in
+        flight. Raises QueueFull when max_pending jobs are outstanding.
+        """
+        with self._lock:
+            if job_id in self._active:
+                return read_status(status_path) or {"status": "queued"}
+            if len(self._active) >= self.max_pending:
+                raise QueueFull(f"{len(self._active)} jobs pending")
+
+            status = write_status(
+                status_path, status="queued", stage="queued", progress=0.0, error=None,
+                submitted_at=time.time(), started_at=None, finished_at=None,
+            )
+            append_event(status_path, "status", reset=True, status="queued")
+            fut = self._executor().submit(_run_job, status_path, fn, args)
+            self._active[job_id] = fut
+
+        fut.add_done_callback(lambda f: self._finish(job_id, status_path, f))
+        return status
+
+    def _finish(self, job_id: str, status_path: Path, fut: Future) -> None:
+        err = None if fut.cancelled() else fut.exception()
+        with self._lock:
+            self._active.pop(job_id, None)
+            if isinstance(err, BrokenProcessPool):
+                # a worker died (e.g. OOM-killed); start a fresh pool next time
+                self._pool = None
+
+        status = read_status(status_path) or {}
+        if status.get("status") not in TERMINAL:
+            status = write_status(status_path, status="failed", error=str(err or "worker exited"), finished_at=time.time())
+            append_event(status_path, "status", status="failed", error=status["error"])
+        if self.on_finish is not None:
+            self.on_finish(job_id, status)
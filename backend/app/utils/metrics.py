@@ -0,0 +1,75 @@
+"""
+Single-pass anomaly statistics.
+
+Per-class pixel and anomaly counts come from one np.bincount over a combined
+index `label * (T + 1) + level`, where `level` is how many of the T thresholds
+a pixel reaches; the anomaly count for every threshold is then a suffix sum.
+Percentiles are read from a 256-bin histogram of the uint8 anomaly map. Rows
+are processed in blocks so the int index never exceeds a few MB.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+from .normalize import DNHistogram
+
+BLOCK_PIXELS = 1 << 21
+
+
+@dataclass
+class AnomalyStats:
+    thresholds: np.ndarray   # (T,) ascending
+    pixels: np.ndarray       # (K,) pixels per class
+    anomalies: np.ndarray    # (K, T) pixels per class with score >= threshold
+    score_sum: float
+    hist: DNHistogram        # of the uint8 anomaly map
+
+    @property
+    def total(self) -> int:
+        return int(self.pixels.sum())
+
+    def percentile(self, p: float) -> float:
+        """Score percentile from the uint8 histogram, in [0,1] (bin centre)."""
+        dn = float(self.hist.percentiles((p,))[0, 0])
+        return min(1.0, (dn + 0.5) / 255.0)
+
+
+def anomaly_stats(
+    anom01: np.ndarray, anom_u8: np.ndarray, labels: np.ndarray, n_classes: int, thresholds: Sequence[float]
+) -> AnomalyStats:
+    """
+    anom01: HxW float anomaly map, anom_u8 its uint8 quantization, labels:
+    HxW class ids in [0, n_classes). Any number of thresholds costs the same
+    single bincount per block.
+    """
+    thr = np.sort(np.asarray(thresholds, dtype=anom01.dtype))
+    levels = len(thr) + 1
+    nbins = n_classes * levels
+    counts = np.zeros(nbins, dtype=np.int64)
+    hist = DNHistogram(1, np.uint8)
+    score_sum = 0.0
+
+    h, w = anom01.shape
+    step = max(1, BLOCK_PIXELS // max(w, 1))
+    for r in range(0, h, step):
+        a = anom01[r:r + step]
+        idx = labels[r:r + step].astype(np.intp)
+        idx *= levels
+        idx += np.searchsorted(thr, a, side="right")
+        counts += np.bincount(idx.ravel(), minlength=nbins)[:nbins]
+        hist.add(anom_u8[None, r:r + step])
+        score_sum += float(a.sum(dtype=np.float64))
+
+    counts = counts.reshape(n_classes, levels)
+    # anomalies at threshold j = pixels whose level is > j
+    above = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    return AnomalyStats(
+        thresholds=thr,
+        pixels=above[:, 0],
+        anomalies=above[:, 1:],
+        score_sum=score_sum,
+        hist=hist,
+    )
@@ -0,0 +1,198 @@
+"""
+Robust per-band stretch (2/98 percentiles) for Sentinel-2 DN stacks.
+
+Percentiles are read off fixed-bin histograms of the native integer DNs, built
+with a single bincount per block for all bands at once, so no band is ever
+sorted. Limits are cached per scene (by the upload's content hash once
+set_content_id has seen it, else per file) and reused by every later read;
+with a `root` directory the cache is also kept on disk, so every process
+(detect workers, inline ROI requests) normalizes a scene with the same limits
+and computes them once.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Hashable, Optional, Sequence, Tuple
+
+import numpy as np
+
+PCT = (2.0, 98.0)
+
+
+@dataclass(frozen=True)
+class Stretch:
+    lo: np.ndarray  # per band, float32
+    hi: np.ndarray
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        """
+        Maps a CxHxW float32 stack to [0,1] in place and returns it.
+        """
+        data -= self.lo[:, None, None]
+        data /= (self.hi - self.lo + 1e-6)[:, None, None]
+        np.clip(data, 0.0, 1.0, out=data)
+        return data
+
+
+def has_dn_histogram(dtype) -> bool:
+    """Integer rasters up to 16 bit get exact histograms; anything else falls back."""
+    dtype = np.dtype(dtype)
+    return dtype.kind in "ui" and dtype.itemsize <= 2
+
+
+class DNHistogram:
+    """
+    Per-band DN counts for a C-band integer raster, accumulated block by block.
+    Band k occupies bins [k*nbins, (k+1)*nbins) of one flat count vector so a
+    whole CxHxW block goes through one np.bincount.
+    """
+
+    def __init__(self, n_bands: int, dtype):
+        info = np.iinfo(dtype)
+        self.offset = int(info.min)
+        self.nbins = int(info.max) - int(info.min) + 1
+        self.n_bands = n_bands
+        self.counts = np.zeros(n_bands * self.nbins, dtype=np.int64)
+        self._base = (np.arange(n_bands, dtype=np.int64) * self.nbins - self.offset)[:, None]
+
+    def add(self, block: np.ndarray) -> None:
+        idx = block.reshape(self.n_bands, -1).astype(np.int64)
+        idx += self._base
+        self.counts += np.bincount(idx.ravel(), minlength=self.counts.size)
+
+    def percentiles(self, pct: Sequence[float] = PCT) -> np.ndarray:
+        """
+        Returns (C, len(pct)) float32, matching np.percentile's default
+        linear interpolation on the raw pixels.
+        """
+        cum = np.cumsum(self.counts.reshape(self.n_bands, self.nbins), axis=1)
+        out = np.empty((self.n_bands, len(pct)), dtype=np.float64)
+        for b in range(self.n_bands):
+            n = cum[b, -1]
+            for j, p in enumerate(pct):
+                pos = (n - 1) * p / 100.0
+                k = int(np.floor(pos))
+                v0, v1 = np.searchsorted(cum[b], [k, min(k + 1, n - 1)], side="right")
+                out[b, j] = v0 + (pos - k) * (v1 - v0)
+        return (out + self.offset).astype(np.float32)
+
+
+def _file_id(path) -> Tuple[int, int, int, int]:
+    """Identity of a file on disk: (device, inode, mtime_ns, size)."""
+    st = os.stat(path)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+# file identity -> content hash of the scene it holds (see set_content_id)
+_CONTENT_IDS: "OrderedDict[Tuple[int, int, int, int], str]" = OrderedDict()
+_CONTENT_IDS_MAX = 4096
+_content_lock = threading.Lock()
+
+
+def set_content_id(path, digest: str) -> None:
+    """
+    Records that the scene at `path` (a raster, or a directory of per-band
+    rasters) holds the content hashed `digest`, e.g. the upload's sha256.
+    Its stretch limits are then cached under the hash: they survive the blob
+    store touching the file on a re-upload, and an inode reused by another
+    file after the blob is deleted can't pick them up.
+    """
+    path = Path(path)
+    files = sorted(f for f in path.iterdir() if f.is_file()) if path.is_dir() else [path]
+    with _content_lock:
+        for f in files:
+            fid = _file_id(f)
+            _CONTENT_IDS[fid] = digest if f == path else f"{digest}/{f.name}"
+            _CONTENT_IDS.move_to_end(fid)
+        while len(_CONTENT_IDS) > _CONTENT_IDS_MAX:
+            _CONTENT_IDS.popitem(last=False)
+
+
+def scene_key(path) -> Hashable:
+    """
+    Stretch cache key of a scene file: its content hash if set_content_id
+    recorded one for the file as it is now, else its identity on disk
+    (device, inode, mtime_ns, size). Inode rather than path, so every run
+    hard-linked to the same upload blob shares one cache entry.
+    """
+    fid = _file_id(path)
+    with _content_lock:
+        digest = _CONTENT_IDS.get(fid)
+    return ("sha256", digest) if digest is not None else fid
+
+
+class StretchCache:
+    """
+    Small thread-safe LRU of per-band (lo, hi) limits keyed by (scene, band),
+    so a scene's stats are computed once no matter which bands a stage reads.
+    """
+
+    def __init__(self, max_entries: int = 1024, root: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.root = Path(root) if root is not None else None
+        self._data: "OrderedDict[Tuple[Hashable, int], Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _file(self, key: Hashable) -> Path:
+        return self.root / f"{hashlib.sha1(repr(key).encode()).hexdigest()}.json"
+
+    def _load(self, key: Hashable) -> Dict[int, Tuple[float, float]]:
+        try:
+            return {int(b): tuple(lohi) for b, lohi in json.loads(self._file(key).read_text()).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _remember(self, key: Hashable, limits: Dict[int, Tuple[float, float]]) -> None:
+        for b, lohi in limits.items():
+            self._data[(key, b)] = lohi
+            self._data.move_to_end((key, b))
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def get(self, key: Hashable, bands: Sequence[int]) -> Dict[int, Tuple[float, float]]:
+        found = {}
+        with self._lock:
+            for b in bands:
+                hit = self._data.get((key, b))
+                if hit is not None:
+                    self._data.move_to_end((key, b))
+                    found[b] = hit
+            if len(found) < len(bands) and self.root is not None:
+                stored = self._load(key)
+                self._remember(key, stored)
+                found.update({b: stored[b] for b in bands if b in stored})
+        return found
+
+    def put(self, key: Hashable, limits: Dict[int, Tuple[float, float]]) -> None:
+        with self._lock:
+            self._remember(key, limits)
+            if self.root is not None:
+                self.root.mkdir(parents=True, exist_ok=True)
+                merged = {**self._load(key), **limits}
+                tmp = self._file(key).with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps({str(b): list(lohi) for b, lohi in merged.items()}))
+                os.replace(tmp, self._file(key))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            if self.root is not None and self.root.exists():
+                for f in self.root.glob("*.json"):
+                    f.unlink(missing_ok=True)
+
+    def stretch(self, key: Hashable, bands: Sequence[int]) -> Optional[Stretch]:
+        found = self.get(key, bands)
+        if len(found) != len(bands):
+            return None
+        lo = np.array([found[b][0] for b in bands], dtype=np.float32)
+        hi = np.array([found[b][1] for b in bands], dtype=np.float32)
+        return Stretch(lo, hi)
+
+
+STRETCH_CACHE = StretchCache()
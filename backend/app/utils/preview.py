@@ -0,0 +1,58 @@
+"""
+Progressive low-resolution anomaly preview.
+
+Detect first scores both scenes decimated to a few hundred pixels (well
+under a second), which gives a coarse map right away. As full-resolution
+tiles are scored, each one is area-averaged down to its footprint in the
+preview and replaces the coarse pixels there, so the preview converges to a
+downsampled copy of the final map. Raw tile scores are normalized with the
+running min/max of the tiles done so far, the same stretch detect applies
+to the whole map at the end.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+Slices = Tuple[slice, slice]
+
+
+class ProgressivePreview:
+    def __init__(self, full_shape: Tuple[int, int], coarse01: np.ndarray):
+        self.full_shape = full_shape
+        self.coarse = coarse01.astype(np.float32, copy=False)
+        self.raw = np.zeros_like(self.coarse)
+        self.done = np.zeros(self.coarse.shape, dtype=bool)
+        self.lo, self.hi = np.inf, -np.inf
+        self._lock = threading.Lock()
+
+    def _rect(self, dst: Slices) -> Slices:
+        (h, w), (ph, pw) = self.full_shape, self.coarse.shape
+        rows, cols = dst
+        return (
+            slice(round(rows.start * ph / h), round(rows.stop * ph / h)),
+            slice(round(cols.start * pw / w), round(cols.stop * pw / w)),
+        )
+
+    def add_tile(self, dst: Slices, score: np.ndarray) -> None:
+        """Raw (un-normalized) full-resolution score of the scene slices `dst`."""
+        rows, cols = self._rect(dst)
+        ph, pw = rows.stop - rows.start, cols.stop - cols.start
+        lo, hi = float(score.min()), float(score.max())
+        small = cv2.resize(score, (pw, ph), interpolation=cv2.INTER_AREA) if ph and pw else None
+        with self._lock:
+            self.lo, self.hi = min(self.lo, lo), max(self.hi, hi)
+            if small is not None:
+                self.raw[rows, cols] = small
+                self.done[rows, cols] = True
+
+    def render(self) -> np.ndarray:
+        """Current preview, HxW float32 in [0,1]."""
+        with self._lock:
+            if not self.done.any():
+                return self.coarse.copy()
+            refined = (self.raw - self.lo) / (self.hi - self.lo + 1e-6)
+            return np.where(self.done, np.clip(refined, 0.0, 1.0), self.coarse)
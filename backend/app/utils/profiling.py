@@ -0,0 +1,196 @@
+"""
+Stage-level profiling for the detect pipeline and a tiny Prometheus registry.
+
+StageProfiler records wall time, CPU time and peak traced allocation
+(tracemalloc sees numpy buffers, not GDAL/OpenCV/PIL internals) per stage of
+one run. Work that is spread over a thread pool is recorded with span(),
+which sums per-thread busy wall/CPU time instead.
+
+Histogram / Counter / Gauge render the Prometheus text exposition format so
+the API can serve /metrics without a client library.
+"""
+from __future__ import annotations
+
+import bisect
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+MB = 1 << 20
+
+
+def max_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+class StageProfiler:
+    def __init__(self, trace_alloc: bool = True):
+        self.trace_alloc = trace_alloc
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+
+    def _add(self, name: str, wall: float, cpu: float, peak: Optional[int] = None) -> None:
+        with self._lock:
+            s = self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0})
+            s["wall_s"] += wall
+            s["cpu_s"] += cpu
+            s["calls"] += 1
+            if peak is not None:
+                s["peak_alloc_mb"] = max(s.get("peak_alloc_mb", 0.0), peak / MB)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """A main-thread step: wall, process CPU (all threads) and peak allocation."""
+        tracing = self.trace_alloc
+        if tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(1)
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        w0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] - base if tracing else None
+            self._add(name, time.perf_counter() - w0, time.process_time() - c0, peak)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Per-thread busy time, summed over every call (e.g. one per tile)."""
+        w0, c0 = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - w0, time.thread_time() - c0)
+
+    def iter_span(self, name: str, items: Iterable) -> Iterator:
+        """Yields from `items`, charging the time spent producing each to `name`."""
+        it = iter(items)
+        while True:
+            w0, c0 = time.perf_counter(), time.thread_time()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self._add(name, time.perf_counter() - w0, time.thread_time() - c0)
+            yield item
+
+    def as_dict(self) -> Dict:
+        stages = {
+            name: {k: (round(v, 4) if isinstance(v, float) else v) for k, v in s.items()}
+            for name, s in self.stages.items()
+        }
+        return {
+            "stages": stages,
+            "total": {
+                "wall_s": round(time.perf_counter() - self._t0, 4),
+                "cpu_s": round(time.process_time() - self._c0, 4),
+                "worker_max_rss_mb": round(max_rss_bytes() / MB, 1),
+            },
+        }
+
+
+# -----------------------------
+# Prometheus exposition
+# -----------------------------
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Read at scrape time from `fn()` -> {label values tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Dict[Tuple[str, ...], float]], labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in sorted(self.fn().items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.buckets = sorted(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts + [sum, count]
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            s = self._series.setdefault(labels, [0.0] * (len(self.buckets) + 2))
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self.header()
+        for labels, s in items:
+            cum = 0.0
+            for le, n in zip(self.buckets, s):
+                cum += n
+                bucket = _labels(self.label_names, labels, 'le="%.15g"' % le)
+                lines.append(f"{self.name}_bucket{bucket} {cum:g}")
+            bucket = _labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {s[-1]:g}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {s[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {s[-1]:g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for m in self.metrics for line in m.render()) + "\n"
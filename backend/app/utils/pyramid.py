@@ -0,0 +1,67 @@
+"""
+Multi-resolution tile pyramids for run assets (XYZ / slippy-map layout).
+
+Zoom `max_zoom` is the full-resolution image; each lower zoom halves it until
+the whole image fits in one TILE x TILE tile at z=0. Tiles are stored as
+<root>/<z>/<x>/<y>.<ext>; edge tiles are padded to TILE with transparent
+pixels so map viewers can place every tile on the same grid.
+"""
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Callable, Iterator, List, Tuple
+
+import cv2
+import numpy as np
+
+TILE = 256
+
+
+def max_zoom(height: int, width: int, tile: int = TILE) -> int:
+    return max(0, math.ceil(math.log2(max(height, width) / tile)))
+
+
+def levels(img: np.ndarray, tile: int = TILE) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields (z, image at zoom z) from full resolution down to z=0."""
+    zmax = max_zoom(img.shape[0], img.shape[1], tile)
+    level = img
+    for z in range(zmax, -1, -1):
+        yield z, level
+        if z:
+            h, w = level.shape[:2]
+            level = cv2.resize(level, (max(1, (w + 1) // 2), max(1, (h + 1) // 2)), interpolation=cv2.INTER_AREA)
+
+
+def _pad(t: np.ndarray, tile: int) -> np.ndarray:
+    h, w = t.shape[:2]
+    if h == tile and w == tile:
+        return t
+    rgb = t if t.ndim == 3 else np.repeat(t[..., None], 3, axis=2)
+    out = np.zeros((tile, tile, 4), dtype=np.uint8)
+    out[:h, :w, :3] = rgb
+    out[:h, :w, 3] = 255
+    return out
+
+
+def tile_path(root: Path, z: int, x: int, y: int, ext: str) -> Path:
+    return Path(root) / str(z) / str(x) / f"{y}.{ext}"
+
+
+def build_tasks(
+    img: np.ndarray, root: Path, ext: str, save: Callable[[np.ndarray, Path], None], tile: int = TILE
+) -> List[Callable[[], None]]:
+    """
+    Cuts every level of `img` (uint8 HxW or HxWx3) into tiles and returns one
+    save callable per tile, so the encodes can run on a pool.
+    """
+    tasks = []
+    for z, level in levels(img, tile):
+        h, w = level.shape[:2]
+        for x in range(math.ceil(w / tile)):
+            (Path(root) / str(z) / str(x)).mkdir(parents=True, exist_ok=True)
+            for y in range(math.ceil(h / tile)):
+                t = level[y * tile:(y + 1) * tile, x * tile:(x + 1) * tile]
+                path = tile_path(root, z, x, y, ext)
+                tasks.append(lambda t=t, path=path: save(_pad(t, tile), path))
+    return tasks
@@ -0,0 +1,458 @@
+"""
+Windowed GeoTIFF access for the detect pipeline.
+
+Full Sentinel-2 scenes are never read in one go: the raster is cut into a grid
+of tiles and every tile is read through a rasterio window, padded with a small
+overlap so neighbourhood filters (SSIM) see real pixels across tile seams.
+
+A scene may also be a set of rasters at different native resolutions (OSCD's
+per-band 10/20/60 m files) or sit on a different grid than its pair. Scene
+reads each tile from every source at native resolution and resamples all
+bands that share a grid in one multi-channel pass, following a ResamplePlan
+cached per (source grid, target grid).
+"""
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.coords import BoundingBox
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.windows import Window
+
+from .normalize import PCT, STRETCH_CACHE, DNHistogram, Stretch, has_dn_histogram, scene_key
+
+Slices = Tuple[slice, slice]
+
+
+@dataclass(frozen=True)
+class Tile:
+    window: Window  # read window, overlap included
+    core: Slices    # tile-local slices without the overlap
+    dst: Slices     # scene slices the core maps onto
+
+
+def _span(lo: int, hi: int, overlap: int, min_window: int, size: int) -> Tuple[int, int]:
+    """[lo, hi) grown by `overlap`, then to at least min_window px, within [0, size)."""
+    a, b = max(lo - overlap, 0), min(hi + overlap, size)
+    if b - a < min_window:
+        # a thin remainder (or region) on the raster edge: widen it inwards
+        a = max(min(a, b - min_window), 0)
+        b = min(max(b, a + min_window), size)
+    return a, b
+
+
+def tile_grid(
+    height: int,
+    width: int,
+    tile_size: int = 1024,
+    overlap: int = 16,
+    region: Optional[Window] = None,
+    min_window: int = 0,
+) -> List[Tile]:
+    """
+    Splits a height x width raster, or only its `region` window, into
+    tile_size blocks, each grown by `overlap` pixels on every side (clamped
+    to the raster bounds, so tiles on a region's edge still overlap the real
+    pixels around it). Read windows are further grown to at least
+    `min_window` px per side where the raster allows (e.g. the SSIM window
+    for a 1-3 px remainder tile). dst slices are relative to the region.
+    """
+    r_lo, c_lo, r_hi, c_hi = 0, 0, height, width
+    if region is not None:
+        r_lo, c_lo = int(region.row_off), int(region.col_off)
+        r_hi, c_hi = r_lo + int(region.height), c_lo + int(region.width)
+    tiles = []
+    for r0 in range(r_lo, r_hi, tile_size):
+        r1 = min(r0 + tile_size, r_hi)
+        rr0, rr1 = _span(r0, r1, overlap, min_window, height)
+        for c0 in range(c_lo, c_hi, tile_size):
+            c1 = min(c0 + tile_size, c_hi)
+            cc0, cc1 = _span(c0, c1, overlap, min_window, width)
+            tiles.append(
+                Tile(
+                    window=Window(cc0, rr0, cc1 - cc0, rr1 - rr0),
+                    core=(slice(r0 - rr0, r1 - rr0), slice(c0 - cc0, c1 - cc0)),
+                    dst=(slice(r0 - r_lo, r1 - r_lo), slice(c0 - c_lo, c1 - c_lo)),
+                )
+            )
+    return tiles
+
+
+@dataclass(frozen=True)
+class BandPlan:
+    """
+    Which bands of a scene to read from disk. Stages ask for 0-based scene
+    band indices; the plan reads the union once and maps them back.
+    """
+    bands: Tuple[int, ...]  # 1-based band numbers to read, ascending
+    index: Dict[int, int]   # 0-based scene band -> channel in the read stack
+
+    @classmethod
+    def from_needs(cls, needs: Iterable[Sequence[int]]) -> "BandPlan":
+        wanted = sorted({int(i) for need in needs for i in need})
+        return cls(bands=tuple(i + 1 for i in wanted), index={i: k for k, i in enumerate(wanted)})
+
+    def take(self, arr: np.ndarray, scene_idx: Sequence[int]) -> np.ndarray:
+        """Channels of a read stack (hxwxk) for the given scene band indices."""
+        return arr[..., [self.index[i] for i in scene_idx]]
+
+
+@dataclass(frozen=True)
+class ResamplePlan:
+    """
+    Bilinear mapping from a target grid onto one source grid covering the
+    same footprint. Per axis, target pixel i samples source coordinate
+    scale * i + shift (pixel-centre convention, as cv2.resize). With an
+    integer upsampling factor and aligned origins a tile is resampled by
+    cv2.resize of its native window, bit-identical to resizing the whole band.
+    """
+    src_shape: Tuple[int, int]
+    scale: Tuple[float, float]   # source pixels per target pixel (rows, cols)
+    shift: Tuple[float, float]
+    factor: Optional[Tuple[int, int]]
+
+    @property
+    def identity(self) -> bool:
+        return self.scale == (1.0, 1.0) and self.shift == (0.0, 0.0)
+
+    def _span(self, start: int, length: int, axis: int) -> Tuple[int, int]:
+        s, t, n = self.scale[axis], self.shift[axis], self.src_shape[axis]
+        lo = math.floor(s * start + t) - 1
+        hi = math.ceil(s * (start + length - 1) + t) + 2
+        return min(max(lo, 0), n - 1), min(max(hi, 1), n)
+
+    def src_window(self, window: Window) -> Window:
+        """Native window holding every source pixel the target window samples (+1 px margin)."""
+        r0, r1 = self._span(int(window.row_off), int(window.height), 0)
+        c0, c1 = self._span(int(window.col_off), int(window.width), 1)
+        return Window(c0, r0, c1 - c0, r1 - r0)
+
+    def resample(self, data: np.ndarray, src_win: Window, window: Window) -> np.ndarray:
+        """data: hxwxC native pixels of src_win -> window.height x window.width x C."""
+        h, w = int(window.height), int(window.width)
+        if self.factor is not None:
+            fy, fx = self.factor
+            up = cv2.resize(data, (data.shape[1] * fx, data.shape[0] * fy), interpolation=cv2.INTER_LINEAR)
+            r = int(window.row_off) - int(src_win.row_off) * fy
+            c = int(window.col_off) - int(src_win.col_off) * fx
+            out = up[r:r + h, c:c + w]
+        else:
+            (sy, sx), (ty, tx) = self.scale, self.shift
+            m = np.float32([
+                [sx, 0, sx * window.col_off + tx - src_win.col_off],
+                [0, sy, sy * window.row_off + ty - src_win.row_off],
+            ])
+            out = cv2.warpAffine(
+                data, m, (w, h), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE
+            )
+        return out.reshape(h, w, -1)
+
+
+@lru_cache(maxsize=256)
+def resample_plan(
+    src_shape: Tuple[int, int], src_transform: Affine, dst_shape: Tuple[int, int], dst_transform: Affine
+) -> ResamplePlan:
+    """
+    Plan for sampling a src grid at dst resolution. Georeferenced grids are
+    aligned through their transforms; ungeoreferenced ones (identity
+    transforms) are stretched edge to edge like cv2.resize.
+    """
+    if src_transform.is_identity or dst_transform.is_identity:
+        sy, sx = src_shape[0] / dst_shape[0], src_shape[1] / dst_shape[1]
+        oy = ox = 0.0
+    else:
+        if not (src_transform.is_rectilinear and dst_transform.is_rectilinear):
+            raise ValueError("rotated rasters are not supported")
+        m = ~src_transform * dst_transform
+        sx, ox, sy, oy = m.a, m.c, m.e, m.f
+    shift = (0.5 * sy + oy - 0.5, 0.5 * sx + ox - 0.5)
+
+    factor = None
+    fy, fx = (round(1 / sy), round(1 / sx)) if sy > 0 and sx > 0 else (0, 0)
+    if (
+        oy == 0 and ox == 0 and fy >= 1 and fx >= 1
+        and math.isclose(sy * fy, 1.0) and math.isclose(sx * fx, 1.0)
+        and dst_shape[0] <= src_shape[0] * fy and dst_shape[1] <= src_shape[1] * fx
+    ):
+        factor = (fy, fx)
+        sy, sx = 1 / fy, 1 / fx
+        shift = (0.5 * sy - 0.5, 0.5 * sx - 0.5)
+    if factor == (1, 1):
+        shift = (0.0, 0.0)
+    return ResamplePlan(src_shape=tuple(src_shape), scale=(sy, sx), shift=shift, factor=factor)
+
+
+def grid_of(src) -> Tuple[Tuple[int, int], Affine]:
+    return (src.height, src.width), src.transform
+
+
+class Scene:
+    """
+    Several rasters read as one band stack on a common target grid (by
+    default the finest source). Bands are numbered 1..count across sources
+    in order. Enough of the rasterio dataset interface for scene_stats /
+    iter_tiles and georeferencing: name, height, width, count, dtypes,
+    transform, crs, bounds, read().
+    """
+
+    def __init__(self, datasets: Sequence, target: Optional[Tuple[Tuple[int, int], Affine]] = None, name: str = ""):
+        self.datasets = list(datasets)
+        if target is None:
+            finest = max(self.datasets, key=lambda d: d.height * d.width)
+            target = grid_of(finest)
+        (self.height, self.width), self.transform = target
+        self.name = name or self.datasets[0].name
+        self.crs = self.datasets[0].crs
+
+        self.bands: List[Tuple[int, int]] = []  # scene band - 1 -> (dataset, local band)
+        for i, ds in enumerate(self.datasets):
+            self.bands += [(i, b) for b in range(1, ds.count + 1)]
+        self.count = len(self.bands)
+        self.dtypes = [self.datasets[i].dtypes[b - 1] for i, b in self.bands]
+        self.plans = [resample_plan(*grid_of(ds), *target) for ds in self.datasets]
+
+    @property
+    def bounds(self) -> BoundingBox:
+        return BoundingBox(*array_bounds(self.height, self.width, self.transform))
+
+    def read(self, bands: Sequence[int], window: Window, out_dtype=np.float32) -> np.ndarray:
+        """CxHxW float32 for `bands` (1-based) over a target-grid window."""
+        h, w = int(window.height), int(window.width)
+        out = np.empty((len(bands), h, w), dtype=np.float32)
+
+        # bands of every source on the same native grid are resampled together
+        groups: Dict[ResamplePlan, List[Tuple[int, List[int], List[int]]]] = {}
+        for k, b in enumerate(bands):
+            i, local = self.bands[b - 1]
+            entry = groups.setdefault(self.plans[i], [])
+            item = next((e for e in entry if e[0] == i), None)
+            if item is None:
+                item = (i, [], [])
+                entry.append(item)
+            item[1].append(local)
+            item[2].append(k)
+
+        for plan, members in groups.items():
+            src_win = window if plan.identity else plan.src_window(window)
+            stack = np.concatenate(
+                [self.datasets[i].read(local, window=src_win, out_dtype=np.float32) for i, local, _ in members]
+            )
+            order = [k for _, _, ks in members for k in ks]
+            if plan.identity:
+                out[order] = stack
+            else:
+                res = plan.resample(np.moveaxis(stack, 0, -1), src_win, window)
+                out[order] = np.moveaxis(res, -1, 0)
+        return out
+
+    def read_decimated(self, bands: Sequence[int], shape: Tuple[int, int], resampling=Resampling.average) -> np.ndarray:
+        """CxHxW float32 of the whole scene at `shape`; every source is read straight at that size."""
+        out = np.empty((len(bands), *shape), dtype=np.float32)
+        for k, b in enumerate(bands):
+            i, local = self.bands[b - 1]
+            out[k] = self.datasets[i].read(local, out_shape=shape, resampling=resampling, out_dtype=np.float32)
+        return out
+
+    def stretch(self, bands: Sequence[int]) -> Stretch:
+        """Scene stretch from each source's native-resolution stats."""
+        lo = np.empty(len(bands), dtype=np.float32)
+        hi = np.empty(len(bands), dtype=np.float32)
+        for i, ds in enumerate(self.datasets):
+            ks = [k for k, b in enumerate(bands) if self.bands[b - 1][0] == i]
+            if ks:
+                st = scene_stats(ds, [self.bands[bands[k] - 1][1] for k in ks])
+                lo[ks], hi[ks] = st.lo, st.hi
+        return Stretch(lo, hi)
+
+    def close(self) -> None:
+        for ds in self.datasets:
+            ds.close()
+
+    def __enter__(self) -> "Scene":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+RASTER_SUFFIXES = (".tif", ".tiff", ".jp2")
+
+
+def open_scene(path, like=None):
+    """
+    Opens a scene: a raster file, or a directory of per-band rasters (sorted
+    by name, e.g. B01.tif .. B12.tif, B8A.tif). With `like`, the scene is read
+    on like's grid, which must cover the same footprint. A single raster that
+    needs no resampling is returned as the plain rasterio dataset.
+    """
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(f for f in path.iterdir() if f.suffix.lower() in RASTER_SUFFIXES)
+        if not files:
+            raise ValueError(f"no rasters in {path.name}")
+        datasets = [rasterio.open(f) for f in files]
+    else:
+        datasets = [rasterio.open(path)]
+
+    target = grid_of(like) if like is not None else None
+    if len(datasets) == 1 and (target is None or grid_of(datasets[0]) == target):
+        return datasets[0]
+    try:
+        scene = Scene(datasets, target, name=str(path))
+        if like is not None:
+            _check_footprint(scene, like)
+        return scene
+    except Exception:
+        for ds in datasets:
+            ds.close()
+        raise
+
+
+def _check_footprint(scene: Scene, like) -> None:
+    for ds in scene.datasets:
+        if ds.transform.is_identity or like.transform.is_identity:
+            continue
+        tol = max(abs(ds.transform.a), abs(ds.transform.e))
+        a, b = ds.bounds, like.bounds
+        if max(abs(a.left - b.left), abs(a.right - b.right), abs(a.top - b.top), abs(a.bottom - b.bottom)) > tol:
+            raise ValueError("rasters cover different footprints")
+
+
+def all_bands(src) -> List[int]:
+    return list(range(1, src.count + 1))
+
+
+def scene_stats(
+    src,
+    bands: Optional[Sequence[int]] = None,
+    block: int = 512,
+    max_side: int = 2048,
+) -> Stretch:
+    """
+    Scene-level robust stretch limits for `bands` (1-based).
+    Integer rasters are histogrammed block by block in one pass (exact 2/98
+    percentiles, bounded memory); other dtypes fall back to np.percentile on a
+    decimated read. Results are cached per scene file and per band.
+    """
+    bands = list(bands) if bands is not None else all_bands(src)
+    if isinstance(src, Scene):
+        return src.stretch(bands)
+    key = scene_key(src.name)
+    cached = STRETCH_CACHE.stretch(key, bands)
+    if cached is not None:
+        return cached
+
+    missing = [b for b in bands if b not in STRETCH_CACHE.get(key, bands)]
+    dtype = src.dtypes[missing[0] - 1]
+    if has_dn_histogram(dtype) and all(src.dtypes[b - 1] == dtype for b in missing):
+        hist = DNHistogram(len(missing), dtype)
+        for tile in tile_grid(src.height, src.width, block, overlap=0):
+            hist.add(src.read(missing, window=tile.window))
+        lohi = hist.percentiles(PCT)
+    else:
+        scale = max(src.height, src.width) / max_side
+        out_shape = None
+        if scale > 1:
+            out_shape = (len(missing), math.ceil(src.height / scale), math.ceil(src.width / scale))
+        data = src.read(missing, out_shape=out_shape, resampling=Resampling.nearest)
+        lohi = np.percentile(data.reshape(len(missing), -1), PCT, axis=1).T
+
+    STRETCH_CACHE.put(key, {b: (float(lo), float(hi)) for b, (lo, hi) in zip(missing, lohi)})
+    return STRETCH_CACHE.stretch(key, bands)
+
+
+def cached_stats(src, bands: Sequence[int]) -> Optional[Stretch]:
+    """The scene stretch for `bands` if every band's limits are cached already, else None."""
+    if isinstance(src, Scene):
+        refs = [(src.datasets[i].name, local) for i, local in (src.bands[b - 1] for b in bands)]
+    else:
+        refs = [(src.name, b) for b in bands]
+    lo, hi = [], []
+    for name, b in refs:
+        hit = STRETCH_CACHE.get(scene_key(name), [b]).get(b)
+        if hit is None:
+            return None
+        lo.append(hit[0])
+        hi.append(hit[1])
+    return Stretch(np.array(lo, dtype=np.float32), np.array(hi, dtype=np.float32))
+
+
+def overview_factor(src, shape: Tuple[int, int]) -> Optional[int]:
+    """
+    Decimation factor of the internal overview GDAL serves a read at `shape`
+    from (the coarsest one still at least that fine), None when the read
+    decimates full-resolution pixels.
+    """
+    ds = src.datasets[0] if isinstance(src, Scene) else src
+    need = min(ds.height / shape[0], ds.width / shape[1])
+    usable = [f for f in ds.overviews(1) if f <= need]
+    return max(usable) if usable else None
+
+
+def preview_shape(height: int, width: int, max_side: int) -> Tuple[int, int]:
+    scale = max(height, width) / max_side
+    if scale <= 1:
+        return height, width
+    return max(1, round(height / scale)), max(1, round(width / scale))
+
+
+def read_preview(
+    src,
+    bands: Sequence[int],
+    max_side: int = 512,
+    stretch: Optional[Stretch] = None,
+    approx_stats: bool = False,
+) -> np.ndarray:
+    """
+    The whole scene decimated to at most `max_side` pixels, hxwxC float32 in
+    [0,1] with the scene stretch. Reads through rasterio's out_shape, which
+    uses the file's overviews when it has them.
+    With `approx_stats`, a scene whose stats aren't cached yet is stretched by
+    the percentiles of the decimated read instead of a full-resolution pass.
+    """
+    bands = list(bands)
+    if stretch is None:
+        stretch = cached_stats(src, bands) if approx_stats else scene_stats(src, bands)
+    shape = preview_shape(src.height, src.width, max_side)
+    if isinstance(src, Scene):
+        data = src.read_decimated(bands, shape)
+    else:
+        data = src.read(bands, out_shape=(len(bands), *shape), resampling=Resampling.average, out_dtype=np.float32)
+    if stretch is None:
+        lo, hi = np.percentile(data.reshape(len(bands), -1), PCT, axis=1).astype(np.float32)
+        stretch = Stretch(lo, hi)
+    return np.moveaxis(stretch.apply(data), 0, -1)
+
+
+def read_tile(src, tile: Tile, bands: Sequence[int], stretch: Stretch) -> np.ndarray:
+    """
+    Reads `bands` (1-based) for one tile and applies the scene stretch in place.
+    Returns hxwxC float32 in [0,1].
+    """
+    data = src.read(list(bands), window=tile.window, out_dtype=np.float32)
+    return np.moveaxis(stretch.apply(data), 0, -1)
+
+
+def iter_tiles(
+    src,
+    grid: Sequence[Tile],
+    bands: Optional[Sequence[int]] = None,
+    stretch: Optional[Stretch] = None,
+) -> Iterator[Tuple[Tile, np.ndarray]]:
+    """
+    Yields (tile, normalized hxwxC array) over `grid`. Only one tile's worth
+    of pixels is alive at a time.
+    """
+    bands = list(bands) if bands is not None else all_bands(src)
+    stretch = stretch if stretch is not None else scene_stats(src, bands)
+    for tile in grid:
+        yield tile, read_tile(src, tile, bands, stretch)
@@ -0,0 +1,67 @@
+"""
+uint8 rendering of the visual assets.
+
+Float maps are quantized to uint8 once (same truncation as the original
+clip * 255 cast), and every colour asset is then a table lookup on uint8
+data: the heatmap goes through a 256-entry colormap, landcover a class palette,
+and the anomaly overlay blends through a per-channel 256-entry table applied
+with cv2.LUT, so no float copy of an RGB image is made.
+"""
+from __future__ import annotations
+
+from typing import Mapping, Optional, Sequence
+
+import cv2
+import numpy as np
+
+
+def quantize(x01: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """[0,1] floats -> uint8, identical to (clip(x, 0, 1) * 255).astype(uint8)."""
+    tmp = np.clip(x01, 0, 1)
+    tmp *= 255
+    if out is None:
+        return tmp.astype(np.uint8)
+    np.copyto(out, tmp, casting="unsafe")
+    return out
+
+
+def colormap_lut(colormap: int) -> np.ndarray:
+    """(256, 1, 3) RGB table of an OpenCV colormap."""
+    ramp = np.arange(256, dtype=np.uint8).reshape(256, 1)
+    return cv2.cvtColor(cv2.applyColorMap(ramp, colormap), cv2.COLOR_BGR2RGB)
+
+
+def palette_lut(colors: Mapping[int, Sequence[int]]) -> np.ndarray:
+    """(256, 1, 3) RGB table of a class -> colour mapping; unlisted classes are black."""
+    lut = np.zeros((256, 1, 3), dtype=np.uint8)
+    for k, color in colors.items():
+        lut[k, 0] = color
+    return lut
+
+
+def blend_lut(color: Sequence[int], alpha: float) -> np.ndarray:
+    """
+    (256, 1, 3) cv2.LUT table of (1 - alpha) * v + alpha * color per channel,
+    truncated, the same arithmetic as blending the pixels in float.
+    """
+    v = np.arange(256)[:, None]
+    return ((1.0 - alpha) * v + alpha * np.array(color, dtype=np.float32)).astype(np.uint8).reshape(256, 1, 3)
+
+
+HOT = colormap_lut(cv2.COLORMAP_HOT)
+
+
+def apply_lut(index_u8: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """HxW uint8 -> HxWx3 uint8 through a (256, 1, 3) table (a user colormap to OpenCV)."""
+    return cv2.applyColorMap(index_u8, lut)
+
+
+def heatmap(anom_u8: np.ndarray) -> np.ndarray:
+    return apply_lut(anom_u8, HOT)
+
+
+def overlay(base_u8: np.ndarray, mask: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """`base_u8` with the pixels under `mask` recoloured through `lut` (see blend_lut)."""
+    out = cv2.LUT(np.ascontiguousarray(base_u8), lut)
+    np.copyto(out, base_u8, where=~mask[..., None])
+    return out
@@ -0,0 +1,170 @@
+"""
+SQLite index of detect runs.
+
+One row per run with its inputs, status, artifact size and last access, so
+the API can look runs up and list them without touching the filesystem, and
+a retention pass can pick the runs to delete under a disk budget. Jobs hold
+an expiring lease on their run (one row per holder, so jobs in any worker
+process count) and retention never deletes a leased run. Each
+thread gets its own connection; the database runs in WAL mode so readers
+don't block the writer.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    status      TEXT NOT NULL,
+    t0_name     TEXT,
+    t0_sha256   TEXT,
+    t1_name     TEXT,
+    t1_sha256   TEXT,
+    input_bytes INTEGER NOT NULL DEFAULT 0,
+    bytes       INTEGER NOT NULL DEFAULT 0,
+    pinned      INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (created_at DESC, run_id DESC);
+CREATE INDEX IF NOT EXISTS runs_accessed ON runs (accessed_at);
+CREATE TABLE IF NOT EXISTS leases (
+    run_id     TEXT NOT NULL,
+    holder     TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (run_id, holder)
+);
+"""
+
+LEASED = "EXISTS (SELECT 1 FROM leases l WHERE l.run_id = runs.run_id AND l.expires_at > ?)"
+
+# accessed_at is only rewritten when it is at least this stale, so polling
+# a run doesn't turn every GET into a write
+TOUCH_GRANULARITY_S = 60.0
+
+
+class RunIndex:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._init_lock:
+                if not self._ready:
+                    conn.executescript(SCHEMA)
+                    self._ready = True
+            self._local.conn = conn
+        return conn
+
+    def add(self, run_id: str, inputs: Dict, status: str = "created", pinned: bool = False,
+            created_at: Optional[float] = None) -> None:
+        now = time.time()
+        t0, t1 = inputs.get("t0", {}), inputs.get("t1", {})
+        self._conn().execute(
+            "INSERT OR IGNORE INTO runs (run_id, created_at, accessed_at, status, t0_name, t0_sha256,"
+            " t1_name, t1_sha256, input_bytes, pinned) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                run_id, created_at or now, created_at or now, status,
+                t0.get("filename"), t0.get("sha256"), t1.get("filename"), t1.get("sha256"),
+                int(t0.get("size", 0)) + int(t1.get("size", 0)), int(pinned),
+            ),
+        )
+
+    def get(self, run_id: str, touch: bool = True) -> Optional[Dict]:
+        conn = self._conn()
+        row = conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if touch and now - row["accessed_at"] >= TOUCH_GRANULARITY_S:
+            conn.execute("UPDATE runs SET accessed_at = ? WHERE run_id = ?", (now, run_id))
+        return dict(row)
+
+    def update(self, run_id: str, **fields) -> None:
+        if not fields:
+            return
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self._conn().execute(f"UPDATE runs SET {cols} WHERE run_id = ?", (*fields.values(), run_id))
+
+    def delete(self, run_id: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+        conn.execute("DELETE FROM leases WHERE run_id = ?", (run_id,))
+
+    def lease(self, run_id: str, holder: str, ttl: float) -> bool:
+        """Marks the run busy for `holder` during `ttl` seconds; False if the run isn't indexed."""
+        cur = self._conn().execute(
+            "INSERT OR REPLACE INTO leases (run_id, holder, expires_at)"
+            " SELECT run_id, ?, ? FROM runs WHERE run_id = ?",
+            (holder, time.time() + ttl, run_id),
+        )
+        return cur.rowcount > 0
+
+    def release(self, run_id: str, holder: str) -> None:
+        self._conn().execute("DELETE FROM leases WHERE run_id = ? AND holder = ?", (run_id, holder))
+
+    def busy(self, run_id: str) -> bool:
+        sql = f"SELECT 1 FROM runs WHERE run_id = ? AND {LEASED}"
+        return self._conn().execute(sql, (run_id, time.time())).fetchone() is not None
+
+    def delete_idle(self, run_id: str) -> bool:
+        """Deletes the run unless it is leased; the check and the delete are one statement."""
+        conn = self._conn()
+        cur = conn.execute(f"DELETE FROM runs WHERE run_id = ? AND NOT {LEASED}", (run_id, time.time()))
+        if cur.rowcount == 0:
+            return False
+        conn.execute("DELETE FROM leases WHERE run_id = ?", (run_id,))
+        return True
+
+    def known(self) -> set:
+        return {r[0] for r in self._conn().execute("SELECT run_id FROM runs")}
+
+    def page(self, limit: int = 50, cursor: Optional[str] = None,
+             status: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Newest first. `cursor` is the opaque value returned with the previous
+        page (keyset pagination, stable while runs are being added).
+        """
+        where, args = [], []
+        if cursor:
+            created, _, run_id = cursor.partition(":")
+            where.append("(created_at, run_id) < (?, ?)")
+            args += [float(created), run_id]
+        if status:
+            where.append("status = ?")
+            args.append(status)
+        sql = "SELECT * FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, run_id DESC LIMIT ?"
+        rows = [dict(r) for r in self._conn().execute(sql, (*args, limit + 1))]
+        more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['created_at']!r}:{rows[-1]['run_id']}" if more else None
+        return rows, next_cursor
+
+    def usage(self) -> Dict[str, int]:
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(bytes + input_bytes), 0) FROM runs").fetchone()
+        return {"runs": row[0], "bytes": row[1]}
+
+    def eviction_order(self) -> List[Dict]:
+        """Unpinned, unleased runs, least recently accessed first."""
+        sql = (
+            "SELECT run_id, accessed_at, bytes + input_bytes AS size FROM runs"
+            f" WHERE pinned = 0 AND NOT {LEASED} ORDER BY accessed_at"
+        )
+        return [dict(r) for r in self._conn().execute(sql, (time.time(),))]
@@ -0,0 +1,171 @@
+"""
+Decoded-scene cache: normalized band stacks as memory-mapped .npy files.
+
+Decoding a GeoTIFF and applying the scene stretch is the same work every time
+a scene is read, so the result is kept once on local disk, one float32 HxW
+array per band under <root>/<key>/, keyed by the upload's sha256 and the grid
+it was read on. Every process maps the same files read-only: tiles are sliced
+out of the page cache instead of being decoded again, and the pages are
+shared between detect workers.
+
+A stack is written through by the first full-scene pass (each tile's core
+goes into fresh memmaps as detect streams it) and swapped in atomically once
+the pass completes. Entries are evicted least-recently-used beyond max_bytes.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from .cache import USED_MARKER, cache_key
+from .normalize import PCT
+from .raster import Tile, iter_tiles
+
+STALE_TMP_S = 3600
+
+
+def scene_cache_key(sha256: str, src) -> str:
+    """Key of `src`'s pixels (upload hash) as read on its current grid and stretch."""
+    return cache_key(sha256=sha256, grid=[src.height, src.width, *src.transform[:6]], pct=list(PCT))
+
+
+class DecodedScene:
+    """Read-only view of a cached stack, enough for the tiled readers."""
+
+    def __init__(self, arrays: Dict[int, np.memmap]):
+        self.arrays = arrays
+
+    def read(self, bands: Sequence[int], tile: Tile) -> np.ndarray:
+        """hxwxC float32 in [0,1] for one tile's window (overlap included)."""
+        w = tile.window
+        rows = slice(int(w.row_off), int(w.row_off + w.height))
+        cols = slice(int(w.col_off), int(w.col_off + w.width))
+        return np.stack([self.arrays[b][rows, cols] for b in bands], axis=-1)
+
+    def tiles(self, grid: Sequence[Tile], bands: Sequence[int]) -> Iterator[Tuple[Tile, np.ndarray]]:
+        for tile in grid:
+            yield tile, self.read(bands, tile)
+
+
+class DecodedSceneCache:
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    def _band(self, key: str, band: int, tmp: Optional[str] = None) -> Path:
+        """A band's file, or with `tmp` a writer's private temp file for it."""
+        name = f".b{band:02d}.{tmp}.npy" if tmp else f"b{band:02d}.npy"
+        return self.root / key / name
+
+    def open(self, key: str, bands: Sequence[int]) -> Optional[DecodedScene]:
+        """The cached stack if it has every band, else None. Marks the entry as used."""
+        try:
+            arrays = {b: open_memmap(self._band(key, b), mode="r") for b in bands}
+        except FileNotFoundError:
+            return None
+        (self.root / key / USED_MARKER).touch()
+        return DecodedScene(arrays)
+
+    def tiles(
+        self,
+        key: str,
+        src,
+        grid: Sequence[Tile],
+        bands: Sequence[int],
+        full: bool,
+    ) -> Iterator[Tuple[Tile, np.ndarray]]:
+        """
+        iter_tiles(src, grid, bands), served from the cache when the stack is
+        there. Otherwise the scene is decoded, and when `grid` covers all of
+        it (`full`) the decoded tiles are written through into the cache.
+        """
+        bands = list(bands)
+        hit = self.open(key, bands)
+        if hit is not None:
+            yield from hit.tiles(grid, bands)
+            return
+        if not full:
+            yield from iter_tiles(src, grid, bands)
+            return
+
+        (self.root / key).mkdir(parents=True, exist_ok=True)
+        shape = (src.height, src.width)
+        # temp names unique per writer: another process, or another generator
+        # over the same scene, may be writing the same entry
+        tmp = f"{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        out = {b: open_memmap(self._band(key, b, tmp), mode="w+", dtype=np.float32, shape=shape) for b in bands}
+        done = False
+        try:
+            for i, (tile, arr) in enumerate(iter_tiles(src, grid, bands)):
+                core = arr[tile.core]
+                for k, b in enumerate(bands):
+                    out[b][tile.dst] = core[..., k]
+                # committed before the last tile is handed out: a consumer
+                # zipping two scenes never asks past it
+                if i == len(grid) - 1:
+                    self._commit(key, out, tmp)
+                    done = True
+                yield tile, arr
+        finally:
+            out.clear()
+            if not done:
+                for b in bands:
+                    self._band(key, b, tmp).unlink(missing_ok=True)
+
+    def _commit(self, key: str, out: Dict[int, np.memmap], tmp: str) -> None:
+        """Swaps a writer's bands in; bands another writer committed first are kept as they are."""
+        for b, mm in out.items():
+            mm.flush()
+            final = self._band(key, b)
+            if final.exists():
+                self._band(key, b, tmp).unlink(missing_ok=True)
+            else:
+                os.replace(self._band(key, b, tmp), final)
+        (self.root / key / USED_MARKER).touch()
+        self.evict(keep=key)
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        """(last used, bytes, dir) per entry; stale temp files are dropped on the way."""
+        now = time.time()
+        out = []
+        for entry in self.root.iterdir() if self.root.exists() else ():
+            size, used = 0, 0.0
+            try:
+                for f in entry.iterdir():
+                    st = f.stat()
+                    if f.name == USED_MARKER:
+                        used = st.st_mtime
+                    elif f.name.startswith(".b") and now - st.st_mtime > STALE_TMP_S:
+                        f.unlink(missing_ok=True)
+                        continue
+                    size += st.st_size
+            except FileNotFoundError:
+                continue  # evicted by another process meanwhile
+            out.append((used, size, entry))
+        return out
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """
+        Deletes least recently used stacks until the cache fits max_bytes.
+        Processes that still map a deleted stack keep reading it until they
+        let go. Returns the number of entries removed.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,101 @@
+"""
+On-disk state of a time-series run.
+
+A series compares every new acquisition with the one before it. Instead of
+re-reading and re-normalizing that scene, its normalized RGB and grayscale
+are kept as .npy memmaps, next to a running per-pixel baseline of the
+grayscale (Welford mean / M2 over every scene so far). A step reads the
+previous scene tile by tile from the memmaps, writes the new scene into
+fresh ones and swaps them in on commit(), so a failed step leaves the
+state of the last good one.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+Slices = Tuple[slice, slice]
+
+ARRAYS = {"rgb": 3, "gray": 1, "mean": 1, "m2": 1}  # name -> channels
+
+
+class SeriesState:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        meta = self.root / "state.json"
+        self.meta: Dict = json.loads(meta.read_text()) if meta.exists() else {"count": 0, "shape": None}
+        self._next: Dict[str, np.memmap] = {}
+        self._prev: Dict[str, np.memmap] = {}
+
+    @property
+    def count(self) -> int:
+        """Scenes folded into the state so far."""
+        return int(self.meta["count"])
+
+    def _path(self, name: str, tmp: bool = False) -> Path:
+        return self.root / (f".{name}.next.npy" if tmp else f"{name}.npy")
+
+    def previous(self, name: str) -> Optional[np.memmap]:
+        """Last committed `rgb` / `gray` / `mean` / `m2` (read-only), None before the first scene."""
+        return open_memmap(self._path(name), mode="r") if self.count else None
+
+    def begin(self, shape: Tuple[int, int]) -> None:
+        if self.count and tuple(self.meta["shape"]) != tuple(shape):
+            raise ValueError(f"scene is {shape[0]}x{shape[1]}, series is {self.meta['shape'][0]}x{self.meta['shape'][1]}")
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self.count:
+            self._prev = {name: self.previous(name) for name in ("mean", "m2")}
+        for name, c in ARRAYS.items():
+            full = shape if c == 1 else (*shape, c)
+            self._next[name] = open_memmap(self._path(name, tmp=True), mode="w+", dtype=np.float32, shape=full)
+        self.meta["shape"] = list(shape)
+
+    def update(self, dst: Slices, rgb: np.ndarray, gray: np.ndarray) -> np.ndarray:
+        """
+        Stores the new scene's pixels for `dst` and folds them into the
+        baseline. Returns |gray - mean| / std of the baseline before this
+        scene (0 until two scenes are in).
+        """
+        n = self.count
+        self._next["rgb"][dst] = rgb
+        self._next["gray"][dst] = gray
+        if n == 0:
+            self._next["mean"][dst] = gray
+            self._next["m2"][dst] = 0.0
+            return np.zeros(gray.shape, dtype=np.float32)
+
+        mean = np.array(self._prev["mean"][dst])
+        m2 = np.array(self._prev["m2"][dst])
+        delta = gray - mean
+        if n >= 2:
+            z = np.abs(delta) / np.sqrt(m2 / (n - 1) + 1e-6)
+        else:
+            z = np.zeros(gray.shape, dtype=np.float32)
+        mean += delta / (n + 1)
+        m2 += delta * (gray - mean)
+        self._next["mean"][dst] = mean
+        self._next["m2"][dst] = m2
+        return z.astype(np.float32, copy=False)
+
+    def commit(self) -> None:
+        for arr in self._next.values():
+            arr.flush()
+        self._next.clear()
+        self._prev.clear()
+        for name in ARRAYS:
+            os.replace(self._path(name, tmp=True), self._path(name))
+        self.meta["count"] = self.count + 1
+        tmp = self.root / ".state.json.tmp"
+        tmp.write_text(json.dumps(self.meta))
+        os.replace(tmp, self.root / "state.json")
+
+    def abort(self) -> None:
+        self._next.clear()
+        self._prev.clear()
+        for name in ARRAYS:
+            self._path(name, tmp=True).unlink(missing_ok=True)
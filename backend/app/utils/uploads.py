@@ -0,0 +1,266 @@
+"""
+Streaming multipart receiver for scene uploads.
+
+File fields are written to disk chunk by chunk as the request body arrives,
+hashed incrementally and checked against a size limit on the fly. The first
+bytes of each file are sniffed for a raster signature, so a wrong or oversized
+upload is rejected without buffering (or even receiving) the whole body.
+"""
+from __future__ import annotations
+
+import hashlib
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Magic numbers of the rasters detect can open. GeoTIFF (classic and BigTIFF)
+# is the real input; PNG / JPEG2000 are accepted for the demo pairs.
+SIGNATURES: Tuple[Tuple[bytes, str], ...] = (
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"II+\x00", "bigtiff"),
+    (b"MM\x00+", "bigtiff"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\x00\x00\x00\x0cjP  \r\n\x87\n", "jp2"),
+)
+SNIFF_BYTES = 16
+MAX_VALUE_BYTES = 1 << 20   # plain (non-file) form fields, e.g. a JSON manifest
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def sniff_raster(head: bytes) -> Optional[str]:
+    """Raster kind from the first bytes of a file, or None."""
+    for magic, kind in SIGNATURES:
+        if head.startswith(magic):
+            if kind == "tiff" and int.from_bytes(head[4:8], "little" if head[:2] == b"II" else "big") < 8:
+                return None  # first IFD offset can't point into the header
+            return kind
+    return None
+
+
+@dataclass
+class ReceivedFile:
+    field: str
+    filename: str
+    path: Path
+    size: int = 0
+    kind: Optional[str] = None
+    _sha: "hashlib._Hash" = field(default_factory=hashlib.sha256, repr=False)
+    _head: bytes = field(default=b"", repr=False)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+
+class StreamingUpload:
+    """
+    Feeds request chunks to a multipart parser and spools the expected file
+    fields into `tmp_dir` (any file field when `fields` is None, up to
+    `max_files`). Plain fields named in `values` are kept in memory; anything
+    else is ignored.
+    """
+
+    def __init__(
+        self,
+        boundary: bytes,
+        tmp_dir: Path,
+        fields: Optional[Sequence[str]],
+        max_bytes: int,
+        values: Sequence[str] = (),
+        max_files: int = 2,
+    ):
+        self.tmp_dir = Path(tmp_dir)
+        self.fields = None if fields is None else set(fields)
+        self.max_bytes = max_bytes
+        self.max_files = max_files if fields is None else len(self.fields)
+        self.value_fields = set(values)
+        self.files: Dict[str, ReceivedFile] = {}
+        self.values: Dict[str, str] = {}
+
+        self._current: Optional[ReceivedFile] = None
+        self._value: Optional[bytearray] = None
+        self._value_name = ""
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._pending: List[Tuple[ReceivedFile, bytes]] = []
+        self._handles: Dict[str, object] = {}
+        self._parser = MultipartParser(
+            boundary,
+            {
+                "on_part_begin": self._on_part_begin,
+                "on_header_field": self._on_header_field,
+                "on_header_value": self._on_header_value,
+                "on_header_end": self._on_header_end,
+                "on_headers_finished": self._on_headers_finished,
+                "on_part_data": self._on_part_data,
+                "on_part_end": self._on_part_end,
+            },
+        )
+
+    # -- parser callbacks (sync, no I/O) --
+    def _on_part_begin(self) -> None:
+        self._current = None
+        self._value = None
+        self._disposition = b""
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        if filename is None:
+            if name in self.value_fields:
+                self._value = bytearray()
+                self._value_name = name
+            return
+        if self.fields is not None and name not in self.fields:
+            return
+        if name in self.files:
+            raise UploadRejected(400, f"duplicate field {name!r}")
+        if len(self.files) >= self.max_files:
+            raise UploadRejected(413, f"more than {self.max_files} files")
+        # never trust client paths: keep the basename only
+        safe = Path(filename.decode("utf-8", "replace").replace("\\", "/")).name or "upload"
+        path = self.tmp_dir / f".upload-{uuid.uuid4().hex}"
+        self._current = self.files[name] = ReceivedFile(field=name, filename=safe, path=path)
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._value is not None:
+            self._value += data[start:end]
+            if len(self._value) > MAX_VALUE_BYTES:
+                raise UploadRejected(413, f"{self._value_name} exceeds {MAX_VALUE_BYTES} bytes")
+            return
+        f = self._current
+        if f is None:
+            return
+        chunk = data[start:end]
+        f.size += len(chunk)
+        if f.size > self.max_bytes:
+            raise UploadRejected(413, f"{f.field} exceeds {self.max_bytes} bytes")
+        f._sha.update(chunk)
+        if f.kind is None:
+            f._head += chunk[: SNIFF_BYTES - len(f._head)]
+            if len(f._head) >= SNIFF_BYTES:
+                self._check_head(f)
+        self._pending.append((f, chunk))
+
+    def _on_part_end(self) -> None:
+        if self._value is not None:
+            self.values[self._value_name] = self._value.decode("utf-8", "replace")
+            self._value = None
+        f = self._current
+        if f is not None and f.kind is None:
+            self._check_head(f)
+        self._current = None
+
+    @staticmethod
+    def _check_head(f: ReceivedFile) -> None:
+        f.kind = sniff_raster(f._head)
+        if f.kind is None:
+            raise UploadRejected(415, f"{f.field} ({f.filename}) is not a GeoTIFF")
+
+    # -- I/O, off the event loop --
+    def _flush(self) -> None:
+        for f, chunk in self._pending:
+            fh = self._handles.get(f.field)
+            if fh is None:
+                self.tmp_dir.mkdir(parents=True, exist_ok=True)
+                fh = self._handles[f.field] = open(f.path, "wb")
+            fh.write(chunk)
+        self._pending.clear()
+
+    def _close(self) -> None:
+        for fh in self._handles.values():
+            fh.close()
+        self._handles.clear()
+
+    def cleanup(self) -> None:
+        self._close()
+        for f in self.files.values():
+            f.path.unlink(missing_ok=True)
+
+    async def receive(self, request: Request) -> Dict[str, ReceivedFile]:
+        try:
+            async for chunk in request.stream():
+                self._parser.write(chunk)
+                if self._pending:
+                    await run_in_threadpool(self._flush)
+            self._parser.finalize()
+            await run_in_threadpool(self._flush)
+            self._close()
+        except BaseException:
+            await run_in_threadpool(self.cleanup)
+            raise
+
+        missing = (self.fields or set()) - set(self.files)
+        missing |= self.value_fields - set(self.values)
+        if missing:
+            await run_in_threadpool(self.cleanup)
+            raise UploadRejected(400, f"missing field(s): {', '.join(sorted(missing))}")
+        return self.files
+
+
+async def receive_files(
+    request: Request, tmp_dir: Path, fields: Sequence[str], max_bytes: int
+) -> Dict[str, ReceivedFile]:
+    """
+    Streams the multipart body of `request` to temp files under tmp_dir.
+    Raises UploadRejected (with an HTTP status) on bad or oversized input.
+    """
+    files, _ = await receive_form(request, tmp_dir, fields, max_bytes)
+    return files
+
+
+async def receive_form(
+    request: Request,
+    tmp_dir: Path,
+    fields: Optional[Sequence[str]],
+    max_bytes: int,
+    values: Sequence[str] = (),
+    max_files: int = 2,
+) -> Tuple[Dict[str, ReceivedFile], Dict[str, str]]:
+    """
+    receive_files for forms that also carry plain fields (`values`, required)
+    or an open set of file fields (`fields=None`, at most `max_files`).
+    Returns (files, values).
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type"))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "expected multipart/form-data")
+
+    upload = StreamingUpload(params[b"boundary"], tmp_dir, fields, max_bytes, values, max_files)
+    length = request.headers.get("content-length")
+    budget = upload.max_files * max_bytes + len(values) * MAX_VALUE_BYTES + (1 << 20)
+    if length is not None and length.isdigit() and int(length) > budget:
+        raise UploadRejected(413, "request body too large")
+
+    files = await upload.receive(request)
+    return files, upload.values
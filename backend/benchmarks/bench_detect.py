@@ -0,0 +1,380 @@
+"""
+Benchmark harness for the detect pipeline.
+
+Generates synthetic Sentinel-2-like multi-band GeoTIFF pairs (deterministic,
+uint16, with injected changes), then times each stage of backend/app/main.py
+(tile reads, anomaly score, uint8 RGB and landcover summed over a tiled pass
+as _detect_tiles makes it; threshold, _metrics and the _save_* encoders on
+the stitched outputs) and the end-to-end _run_detect, recording peak RSS.
+Every (size, bands) case runs in a fresh interpreter so peak RSS is per case.
+
+    python backend/benchmarks/bench_detect.py run --sizes 512,1024,2048 --bands 4,13
+    python backend/benchmarks/bench_detect.py run --sizes 10000 --repeat 1
+    python backend/benchmarks/bench_detect.py compare base.json new.json
+
+`run` writes one JSON file (default: backend/benchmarks/results/<commit>.json)
+with environment metadata and min/median seconds per stage. `compare` prints
+new/base ratios and exits 1 when a stage slowed down beyond --tolerance.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+HERE = Path(__file__).resolve().parent
+APP_DIR = HERE.parent / "app"
+RESULTS_DIR = HERE / "results"
+
+DEFAULT_SIZES = "512,1024,2048,4096"
+DEFAULT_BANDS = "13"
+WRITE_ROWS = 512
+
+
+# -----------------------------
+# Synthetic scenes
+# -----------------------------
+def _scene_rows(size: int, bands: int, r0: int, r1: int, changed: bool, seed: int) -> np.ndarray:
+    """Rows [r0, r1) of a bands x size x size uint16 scene; smooth fields + noise."""
+    y = np.arange(r0, r1, dtype=np.float32)[:, None] / size
+    x = np.arange(size, dtype=np.float32)[None, :] / size
+    rng = np.random.default_rng((seed, r0, int(changed)))
+    out = np.empty((bands, r1 - r0, size), dtype=np.uint16)
+    for b in range(bands):
+        fx, fy = 3 + b % 5, 2 + b % 7
+        field = 0.5 + 0.25 * np.sin(2 * np.pi * fx * x + b) * np.cos(2 * np.pi * fy * y)
+        field = field + rng.normal(0, 0.02, field.shape).astype(np.float32)
+        if changed:
+            # a few square "new buildings / clearings" whose position scales with the scene
+            for cx, cy in ((0.3, 0.3), (0.7, 0.55), (0.45, 0.8)):
+                inside = (np.abs(x - cx) < 0.05) & (np.abs(y - cy) < 0.05)
+                field = np.where(inside, 1.0 - field, field)
+        out[b] = np.clip(field * 4000 + 500, 0, 65535).astype(np.uint16)
+    return out
+
+
+def make_scene(path: Path, size: int, bands: int, changed: bool, seed: int = 0) -> None:
+    profile = {
+        "driver": "GTiff", "width": size, "height": size, "count": bands, "dtype": "uint16",
+        "crs": "EPSG:32631", "transform": from_origin(500000, 5000000, 10, 10),
+        "tiled": True, "blockxsize": 512, "blockysize": 512,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        for r0 in range(0, size, WRITE_ROWS):
+            r1 = min(size, r0 + WRITE_ROWS)
+            window = rasterio.windows.Window(0, r0, size, r1 - r0)
+            dst.write(_scene_rows(size, bands, r0, r1, changed, seed), window=window)
+
+
+def scene_pair(cache_dir: Path, size: int, bands: int) -> Dict[str, Path]:
+    """t0/t1 GeoTIFFs for a case, generated once per cache_dir."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    pair = {}
+    for key, changed in (("t0", False), ("t1", True)):
+        path = cache_dir / f"{key}_{size}_{bands}b.tif"
+        if not path.exists():
+            make_scene(path, size, bands, changed)
+        pair[key] = path
+    return pair
+
+
+# -----------------------------
+# One case (runs in a child process)
+# -----------------------------
+def _peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / 1024
+
+
+def _time(fn: Callable, repeat: int, setup: Callable = lambda: None) -> Dict:
+    runs = []
+    for _ in range(repeat):
+        setup()
+        t = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t)
+    return _summary(runs)
+
+
+def _summary(runs: List[float]) -> Dict:
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def _tiled_pass(m, t0: Path, t1: Path) -> Tuple[Dict[str, float], Dict[str, np.ndarray]]:
+    """
+    One pass over the scene tiles the way _detect_tiles makes it (same grid,
+    bands and per-tile functions, single-threaded so each stage's seconds
+    add up): seconds per stage and the stitched scene-sized outputs. Only
+    one tile's float band stack is alive at a time.
+    """
+    from utils.raster import iter_tiles, open_scene, tile_grid
+
+    secs = dict.fromkeys(("read", "anomaly", "rgb_u8", "landcover"), 0.0)
+    with open_scene(t1) as src1, open_scene(t0, like=src1) as src0:
+        h, w = src1.height, src1.width
+        grid = tile_grid(h, w, m.TILE_SIZE, m.TILE_OVERLAP, min_window=m.SSIM_WIN)
+        plan0 = m._band_plan(src0.count, ("rgb",))
+        plan1 = m._band_plan(src1.count, ("rgb", "landcover"))
+        rgb_idx0, rgb_idx1 = m._rgb_bands(src0.count), m._rgb_bands(src1.count)
+        lc_idx = m._landcover_bands(src1.count)
+        out = {
+            "anom": np.empty((h, w), dtype=np.float32),
+            "t1_u8": np.empty((h, w, 3), dtype=np.uint8),
+            "lc": np.zeros((h, w), dtype=np.uint8),
+        }
+        tiles = zip(iter_tiles(src0, grid, plan0.bands), iter_tiles(src1, grid, plan1.bands))
+        lo, hi = np.inf, -np.inf
+        while True:
+            t = time.perf_counter()
+            try:
+                (tile, a0), (_, a1) = next(tiles)
+            except StopIteration:
+                break
+            t_read = time.perf_counter()
+            rgb0, rgb1 = plan0.take(a0, rgb_idx0), plan1.take(a1, rgb_idx1)
+            score = m.anomaly_score(rgb0, rgb1)[tile.core]
+            out["anom"][tile.dst] = score
+            lo, hi = min(lo, float(score.min())), max(hi, float(score.max()))
+            t_anom = time.perf_counter()
+            m._to_u8(rgb1[tile.core], out=out["t1_u8"][tile.dst])
+            t_rgb = time.perf_counter()
+            if lc_idx:
+                core1 = a1[tile.core]
+                out["lc"][tile.dst] = m._landcover_from_bands(*(core1[..., plan1.index[b]] for b in lc_idx))
+            t_lc = time.perf_counter()
+            secs["read"] += t_read - t
+            secs["anomaly"] += t_anom - t_read
+            secs["rgb_u8"] += t_rgb - t_anom
+            secs["landcover"] += t_lc - t_rgb
+        t = time.perf_counter()
+        m.normalize_(out["anom"], lo, hi)
+        secs["anomaly"] += time.perf_counter() - t
+    return secs, out
+
+
+def run_stages(t0: Path, t1: Path, repeat: int) -> Dict:
+    """
+    Times the pipeline stages: the per-tile stages summed over a tiled pass
+    (cold stretch cache each time), then thresholding, metrics and the
+    encoders on the stitched outputs, as detect runs them.
+    """
+    import main as m
+    from utils.normalize import STRETCH_CACHE
+
+    out_dir = Path(tempfile.mkdtemp(prefix="stages-", dir="."))
+    per_tile: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        STRETCH_CACHE.clear()
+        secs, out = _tiled_pass(m, t0, t1)
+        for stage, s in secs.items():
+            per_tile.setdefault(stage, []).append(s)
+    stages = {stage: _summary(runs) for stage, runs in per_tile.items()}
+
+    anom, lc, t1_u8 = out["anom"], out["lc"], out["t1_u8"]
+    stages["threshold"] = _time(lambda: m._suggest_threshold(anom), repeat)
+    thr = m._suggest_threshold(anom)
+    anom_u8 = m._to_u8(anom)
+    stages["metrics"] = _time(lambda: m._metrics(anom, lc, thr, anom_u8), repeat)
+
+    ext = m.ENCODER.ext
+    saves = {
+        "save_t1": lambda: m._save_rgb(t1_u8, out_dir / f"t1.{ext}"),
+        "save_heatmap": lambda: m._save_heatmap(anom_u8, out_dir / f"heatmap.{ext}"),
+        "save_overlay": lambda: m._save_overlay(t1_u8, anom, thr, out_dir / f"overlay.{ext}"),
+        "save_anomaly_u8": lambda: m._save_anomaly_u8(anom_u8, out_dir / f"anomaly_u8.{ext}"),
+        "save_landcover": lambda: m._save_landcover(lc, out_dir / f"landcover.{ext}"),
+    }
+    for name, fn in saves.items():
+        stages[name] = _time(fn, repeat)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return stages
+
+
+def run_detect(t0: Path, t1: Path, repeat: int) -> Dict:
+    """
+    Times the end-to-end _run_detect (in-process, no job pool) on a fresh run:
+    "detect" cold (nothing cached), "detect_cached" with the scenes already in
+    the decoded-scene cache (when it is enabled).
+    """
+    import main as m
+    from utils.normalize import STRETCH_CACHE
+
+    run_id = "bench"
+    run_dir = m.RUNS_DIR / run_id
+
+    def fresh_run():
+        shutil.rmtree(run_dir, ignore_errors=True)
+        run_dir.mkdir(parents=True)
+        inputs = {}
+        for key, src in (("t0", t0), ("t1", t1)):
+            os.link(src, run_dir / f"{key}_{src.name}")
+            # synthetic scenes are identified by name; skip hashing GBs of input
+            inputs[key] = {"filename": src.name, "sha256": src.stem, "size": src.stat().st_size, "kind": "tiff"}
+        (run_dir / "inputs.json").write_text(json.dumps(inputs))
+        shutil.rmtree(m.RESULT_CACHE.root, ignore_errors=True)
+
+    def cold():
+        fresh_run()
+        STRETCH_CACHE.clear()
+        if m.SCENES is not None:
+            shutil.rmtree(m.SCENES.root, ignore_errors=True)
+
+    stages = {"detect": _time(lambda: m._run_detect(run_id), repeat, setup=cold)}
+    if m.SCENES is not None:
+        # the last cold run wrote both scenes through into the cache
+        stages["detect_cached"] = _time(lambda: m._run_detect(run_id), repeat, setup=fresh_run)
+    return stages
+
+
+def case_main(args) -> None:
+    # main.py resolves static/ and data/ relative to the cwd
+    os.chdir(args.workdir)
+    sys.path.insert(0, str(APP_DIR))
+    t0, t1 = Path(args.t0), Path(args.t1)
+    fn = run_detect if args.mode == "detect" else run_stages
+    stages = fn(t0, t1, args.repeat)
+    json.dump({"stages": stages, "peak_rss_mb": _peak_rss_mb()}, sys.stdout)
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--", str(APP_DIR)], cwd=HERE, capture_output=True, text=True)
+        return out.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+    except OSError:
+        return "unknown"
+
+
+def _meta(args) -> Dict:
+    import cv2
+    import PIL
+    import skimage
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__, "opencv": cv2.__version__, "rasterio": rasterio.__version__,
+        "scikit-image": skimage.__version__, "pillow": PIL.__version__,
+        "sizes": args.sizes, "bands": args.bands, "repeat": args.repeat,
+        "env": {k: v for k, v in os.environ.items() if k.startswith(("ASSET_", "DETECT_", "LAZY_"))},
+    }
+
+
+def _run_child(mode: str, pair: Dict[str, Path], workdir: Path, repeat: int) -> Dict:
+    cmd = [
+        sys.executable, str(Path(__file__).resolve()), "case", mode,
+        "--t0", str(pair["t0"]), "--t1", str(pair["t1"]),
+        "--workdir", str(workdir), "--repeat", str(repeat),
+    ]
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{mode} case failed:\n{proc.stderr}")
+    return json.loads(proc.stdout)
+
+
+def run_main(args) -> None:
+    sizes = [int(s) for s in args.sizes.split(",")]
+    bands = [int(b) for b in args.bands.split(",")]
+    scratch = Path(args.scratch or tempfile.mkdtemp(prefix="bench-detect-"))
+    cases: List[Dict] = []
+
+    for size in sizes:
+        for nb in bands:
+            pair = scene_pair(scratch / "scenes", size, nb)
+            workdir = scratch / f"work-{size}-{nb}"
+            workdir.mkdir(parents=True, exist_ok=True)
+            case = {"size": size, "bands": nb, "stages": {}, "peak_rss_mb": {}}
+            for mode in ("stages", "detect"):
+                res = _run_child(mode, pair, workdir, args.repeat)
+                case["stages"].update(res["stages"])
+                case["peak_rss_mb"][mode] = res["peak_rss_mb"]
+            cases.append(case)
+            cols = ", ".join(f"{k}={v['median']:.3f}s" for k, v in case["stages"].items())
+            print(f"{size}x{size} {nb}b: {cols}, peak_rss={case['peak_rss_mb']}", file=sys.stderr)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"meta": _meta(args), "cases": cases}
+    out = Path(args.out) if args.out else RESULTS_DIR / f"{report['meta']['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(out)
+    if not args.scratch:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def compare_main(args) -> None:
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    base_cases = {(c["size"], c["bands"]): c for c in base["cases"]}
+    regressions = 0
+    print(f"{'case':<16}{'stage':<18}{'base':>10}{'new':>10}{'ratio':>8}")
+    for c in new["cases"]:
+        b = base_cases.get((c["size"], c["bands"]))
+        if b is None:
+            continue
+        for stage, t in c["stages"].items():
+            if stage not in b["stages"]:
+                continue
+            bt, nt = b["stages"][stage]["min"], t["min"]
+            ratio = nt / bt if bt else float("inf")
+            flag = ""
+            if ratio > args.tolerance:
+                regressions += 1
+                flag = "  <-- slower"
+            case = f"{c['size']}x{c['size']}/{c['bands']}b"
+            print(f"{case:<16}{stage:<18}{bt:>10.3f}{nt:>10.3f}{ratio:>8.2f}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    run = sub.add_parser("run", help="benchmark the pipeline")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated square scene sizes")
+    run.add_argument("--bands", default=DEFAULT_BANDS, help="comma-separated band counts")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--out", help="result JSON path")
+    run.add_argument("--scratch", help="keep generated scenes here (reused across runs)")
+    run.set_defaults(fn=run_main)
+
+    cmp_ = sub.add_parser("compare", help="compare two result files")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--tolerance", type=float, default=1.10, help="max allowed new/base ratio")
+    cmp_.set_defaults(fn=compare_main)
+
+    case = sub.add_parser("case")  # internal: one measurement in a fresh process
+    case.add_argument("mode", choices=("stages", "detect"))
+    case.add_argument("--t0", required=True)
+    case.add_argument("--t1", required=True)
+    case.add_argument("--workdir", required=True)
+    case.add_argument("--repeat", type=int, default=3)
+    case.set_defaults(fn=case_main)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
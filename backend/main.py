@@ -1,9 +1,12 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, Response
 import uuid
 import os
-from typing import Dict, Any
+import hashlib
+import zlib
+from functools import lru_cache
+from typing import Dict, Any, Tuple
 from PIL import Image, ImageDraw
 import numpy as np
 import io
@@ -110,209 +113,137 @@ async def get_run(run_id: str):
     
     return runs[run_id]
 
+MOCK_SIZE = 512
+MOCK_SEED = 0
+MOCK_CACHE_SIZE = 32
+MOCK_CACHE_CONTROL = "public, max-age=3600"
+MOCK_ASSETS = ("t0_rgb", "t1_rgb", "heatmap", "overlay")
+
+def _mock_grid():
+    y, x = np.mgrid[0:MOCK_SIZE, 0:MOCK_SIZE].astype(np.float64)
+    return x, y
+
+def _mock_rng(asset_type: str) -> np.random.Generator:
+    # seeded per asset type, so every request gets identical bytes
+    return np.random.default_rng([MOCK_SEED, zlib.crc32(asset_type.encode())])
+
+def _mock_change_regions(x, y):
+    """The three change rectangles shared by t1, heatmap and overlay."""
+    return (
+        (x > 150) & (x < 350) & (y > 100) & (y < 400),
+        (x > 200) & (x < 450) & (y > 50) & (y < 200),
+        (x > 100) & (x < 250) & (y > 250) & (y < 450),
+    )
+
+def _mock_terrain(x, y, rng: np.random.Generator):
+    """Base landscape (terrain, water bodies, vegetation) as int r, g, b arrays."""
+    noise1 = np.sin(x / 100) * np.cos(y / 100) * 50
+    noise2 = np.sin(x / 50) * np.sin(y / 75) * 30
+    noise3 = rng.random(x.shape) * 20
+
+    r = 80 + np.trunc(noise1 + noise2 + noise3)
+    g = 120 + np.trunc(noise1 * 0.8 + noise2 + noise3)
+    b = 60 + np.trunc(noise1 * 0.5 + noise3)
+
+    water = np.sin(x / 80) * np.cos(y / 60) > 0.3
+    r = np.where(water, 40 + np.trunc(noise3), r)
+    g = np.where(water, 80 + np.trunc(noise3), g)
+    b = np.where(water, 140 + np.trunc(noise1), b)
+
+    veg = np.sin(x / 40) * np.sin(y / 40) > 0.2
+    land_veg = veg & ~water
+    r = np.where(land_veg, np.maximum(30, r - 30), r)
+    g = np.where(land_veg, np.minimum(180, g + 40), g)
+    b = np.where(land_veg, np.maximum(20, b - 20), b)
+    return r, g, b, veg
+
+def _to_rgb(r, g, b) -> np.ndarray:
+    return np.clip(np.stack([r, g, b], axis=-1), 0, 255).astype(np.uint8)
+
 def create_mock_image(asset_type: str) -> bytes:
     """Create realistic mock satellite images for demonstration purposes"""
-    width, height = 512, 512
-    img = Image.new('RGB', (width, height))
-    pixels = img.load()
-    
+    x, y = _mock_grid()
+    rng = _mock_rng(asset_type)
+
     if asset_type == "t0_rgb":
-        # Create realistic satellite image (before) - landscape with terrain
-        import random
-        
-        # Create base terrain with natural patterns
-        for y in range(height):
-            for x in range(width):
-                # Simulate natural terrain with multiple layers
-                noise1 = np.sin(x/100) * np.cos(y/100) * 50
-                noise2 = np.sin(x/50) * np.sin(y/75) * 30
-                noise3 = random.random() * 20
-                
-                # Base terrain color (green/brown landscape)
-                base_r = 80 + int(noise1 + noise2 + noise3)
-                base_g = 120 + int(noise1 * 0.8 + noise2 + noise3)
-                base_b = 60 + int(noise1 * 0.5 + noise3)
-                
-                # Add water bodies (blue areas)
-                water_mask = np.sin(x/80) * np.cos(y/60) > 0.3
-                if water_mask:
-                    base_r = 40 + int(noise3)
-                    base_g = 80 + int(noise3)
-                    base_b = 140 + int(noise1)
-                
-                # Add vegetation (darker green patches)
-                veg_mask = np.sin(x/40) * np.sin(y/40) > 0.2
-                if veg_mask and not water_mask:
-                    base_r = max(30, base_r - 30)
-                    base_g = min(180, base_g + 40)
-                    base_b = max(20, base_b - 20)
-                
-                pixels[x, y] = (
-                    max(0, min(255, base_r)),
-                    max(0, min(255, base_g)),
-                    max(0, min(255, base_b))
-                )
-    
+        # Realistic satellite image (before) - landscape with terrain
+        r, g, b, _ = _mock_terrain(x, y, rng)
+        rgb = _to_rgb(r, g, b)
+
     elif asset_type == "t1_rgb":
-        # Create realistic satellite image (after) with visible changes
-        import random
-        
-        for y in range(height):
-            for x in range(width):
-                # Similar base terrain as before
-                noise1 = np.sin(x/100) * np.cos(y/100) * 50
-                noise2 = np.sin(x/50) * np.sin(y/75) * 30
-                noise3 = random.random() * 20
-                
-                base_r = 80 + int(noise1 + noise2 + noise3)
-                base_g = 120 + int(noise1 * 0.8 + noise2 + noise3)
-                base_b = 60 + int(noise1 * 0.5 + noise3)
-                
-                water_mask = np.sin(x/80) * np.cos(y/60) > 0.3
-                if water_mask:
-                    base_r = 40 + int(noise3)
-                    base_g = 80 + int(noise3)
-                    base_b = 140 + int(noise1)
-                
-                veg_mask = np.sin(x/40) * np.sin(y/40) > 0.2
-                if veg_mask and not water_mask:
-                    base_r = max(30, base_r - 30)
-                    base_g = min(180, base_g + 40)
-                    base_b = max(20, base_b - 20)
-                
-                # Add visible changes (urbanization, deforestation, etc.)
-                change_mask = (x > 150 and x < 350 and y > 100 and y < 400) or \
-                             (x > 200 and x < 450 and y > 50 and y < 200)
-                
-                if change_mask:
-                    # Simulate urban development (gray/brown)
-                    base_r = min(200, base_r + 60)
-                    base_g = min(200, base_g + 40)
-                    base_b = min(200, base_b + 50)
-                
-                # Simulate deforestation (lighter brown)
-                forest_change = (x > 100 and x < 250 and y > 250 and y < 450)
-                if forest_change and veg_mask:
-                    base_r = min(180, base_r + 50)
-                    base_g = max(80, base_g - 40)
-                    base_b = max(40, base_b - 20)
-                
-                pixels[x, y] = (
-                    max(0, min(255, base_r)),
-                    max(0, min(255, base_g)),
-                    max(0, min(255, base_b))
-                )
-    
+        # Same landscape (after) with visible changes
+        r, g, b, veg = _mock_terrain(x, y, rng)
+        urban_a, urban_b, forest = _mock_change_regions(x, y)
+
+        # urban development (gray/brown)
+        change = urban_a | urban_b
+        r = np.where(change, np.minimum(200, r + 60), r)
+        g = np.where(change, np.minimum(200, g + 40), g)
+        b = np.where(change, np.minimum(200, b + 50), b)
+
+        # deforestation (lighter brown)
+        cleared = forest & veg
+        r = np.where(cleared, np.minimum(180, r + 50), r)
+        g = np.where(cleared, np.maximum(80, g - 40), g)
+        b = np.where(cleared, np.maximum(40, b - 20), b)
+        rgb = _to_rgb(r, g, b)
+
     elif asset_type == "heatmap":
-        # Create realistic anomaly heatmap
-        for y in range(height):
-            for x in range(width):
-                # Create realistic heat patterns based on change areas
-                heat_value = 0
-                
-                # Hot spots in areas of change
-                if (x > 150 and x < 350 and y > 100 and y < 400):
-                    heat_value = max(heat_value, 0.8 * np.exp(-((x-250)**2 + (y-250)**2)/10000))
-                if (x > 200 and x < 450 and y > 50 and y < 200):
-                    heat_value = max(heat_value, 0.9 * np.exp(-((x-325)**2 + (y-125)**2)/8000))
-                if (x > 100 and x < 250 and y > 250 and y < 450):
-                    heat_value = max(heat_value, 0.7 * np.exp(-((x-175)**2 + (y-350)**2)/12000))
-                
-                # Add some noise for realism
-                heat_value += np.random.random() * 0.1
-                heat_value = min(1.0, heat_value)
-                
-                # Convert to color (blue -> green -> yellow -> red)
-                if heat_value < 0.25:
-                    # Blue to cyan
-                    r = 0
-                    g = int(heat_value * 4 * 100)
-                    b = 255
-                elif heat_value < 0.5:
-                    # Cyan to green
-                    r = 0
-                    g = 255
-                    b = int((0.5 - heat_value) * 4 * 255)
-                elif heat_value < 0.75:
-                    # Green to yellow
-                    r = int((heat_value - 0.5) * 4 * 255)
-                    g = 255
-                    b = 0
-                else:
-                    # Yellow to red
-                    r = 255
-                    g = int((1.0 - heat_value) * 4 * 255)
-                    b = 0
-                
-                pixels[x, y] = (r, g, b)
-    
+        # Hot spots around the change areas plus some noise
+        urban_a, urban_b, forest = _mock_change_regions(x, y)
+        heat = np.zeros_like(x)
+        heat = np.where(urban_a, np.maximum(heat, 0.8 * np.exp(-((x - 250) ** 2 + (y - 250) ** 2) / 10000)), heat)
+        heat = np.where(urban_b, np.maximum(heat, 0.9 * np.exp(-((x - 325) ** 2 + (y - 125) ** 2) / 8000)), heat)
+        heat = np.where(forest, np.maximum(heat, 0.7 * np.exp(-((x - 175) ** 2 + (y - 350) ** 2) / 12000)), heat)
+        heat = np.minimum(1.0, heat + rng.random(x.shape) * 0.1)
+
+        # blue -> cyan -> green -> yellow -> red
+        bands = [heat < 0.25, heat < 0.5, heat < 0.75]
+        r = np.select(bands, [0, 0, np.trunc((heat - 0.5) * 4 * 255)], 255)
+        g = np.select(bands, [np.trunc(heat * 4 * 100), 255, 255], np.trunc((1.0 - heat) * 4 * 255))
+        b = np.select(bands, [255, np.trunc((0.5 - heat) * 4 * 255), 0], 0)
+        rgb = _to_rgb(r, g, b)
+
     elif asset_type == "overlay":
-        # Create base satellite image first
-        import random
-        
-        for y in range(height):
-            for x in range(width):
-                noise1 = np.sin(x/100) * np.cos(y/100) * 50
-                noise2 = np.sin(x/50) * np.sin(y/75) * 30
-                noise3 = random.random() * 20
-                
-                base_r = 80 + int(noise1 + noise2 + noise3)
-                base_g = 120 + int(noise1 * 0.8 + noise2 + noise3)
-                base_b = 60 + int(noise1 * 0.5 + noise3)
-                
-                water_mask = np.sin(x/80) * np.cos(y/60) > 0.3
-                if water_mask:
-                    base_r = 40 + int(noise3)
-                    base_g = 80 + int(noise3)
-                    base_b = 140 + int(noise1)
-                
-                veg_mask = np.sin(x/40) * np.sin(y/40) > 0.2
-                if veg_mask and not water_mask:
-                    base_r = max(30, base_r - 30)
-                    base_g = min(180, base_g + 40)
-                    base_b = max(20, base_b - 20)
-                
-                # Add red overlay for anomalies
-                overlay_intensity = 0
-                if (x > 150 and x < 350 and y > 100 and y < 400):
-                    overlay_intensity = max(overlay_intensity, 0.6)
-                if (x > 200 and x < 450 and y > 50 and y < 200):
-                    overlay_intensity = max(overlay_intensity, 0.8)
-                if (x > 100 and x < 250 and y > 250 and y < 450):
-                    overlay_intensity = max(overlay_intensity, 0.5)
-                
-                # Blend red overlay with base image
-                pixels[x, y] = (
-                    min(255, base_r + int(overlay_intensity * 150)),
-                    max(0, base_g - int(overlay_intensity * 50)),
-                    max(0, base_b - int(overlay_intensity * 50))
-                )
-    
+        # Base landscape with a red tint over the anomalies
+        r, g, b, _ = _mock_terrain(x, y, rng)
+        urban_a, urban_b, forest = _mock_change_regions(x, y)
+        intensity = np.maximum.reduce([urban_a * 0.6, urban_b * 0.8, forest * 0.5])
+        r = np.minimum(255, r + np.trunc(intensity * 150))
+        g = np.maximum(0, g - np.trunc(intensity * 50))
+        b = np.maximum(0, b - np.trunc(intensity * 50))
+        rgb = _to_rgb(r, g, b)
+
     else:
         # Default: realistic gradient
-        for y in range(height):
-            for x in range(width):
-                intensity = int(128 + 127 * np.sin(x/100) * np.cos(y/100))
-                pixels[x, y] = (intensity, intensity, intensity)
-    
-    # Convert to bytes
+        gray = np.trunc(128 + 127 * np.sin(x / 100) * np.cos(y / 100))
+        rgb = _to_rgb(gray, gray, gray)
+
     img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG')
+    Image.fromarray(rgb).save(img_bytes, format='PNG')
     return img_bytes.getvalue()
 
+@lru_cache(maxsize=MOCK_CACHE_SIZE)
+def _mock_asset(asset_type: str) -> Tuple[bytes, str]:
+    """Encoded PNG and its ETag; images don't depend on the run, only the asset type."""
+    data = create_mock_image(asset_type)
+    return data, '"' + hashlib.sha1(data).hexdigest() + '"'
+
 @app.get("/api/assets/{run_id}/{asset_type}")
-async def get_asset(run_id: str, asset_type: str):
-    """Generate and return mock images for different asset types"""
+async def get_asset(run_id: str, asset_type: str, request: Request):
+    """Return mock images for different asset types (generated once, then served from memory)"""
+    # every unknown type renders the same gradient: share one cache entry
+    key = asset_type if asset_type in MOCK_ASSETS else "default"
     try:
-        image_bytes = create_mock_image(asset_type)
-        return Response(
-            content=image_bytes,
-            media_type="image/png",
-            headers={"Cache-Control": "no-cache"}
-        )
+        image_bytes, etag = _mock_asset(key)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate image: {str(e)}")
 
+    headers = {"ETag": etag, "Cache-Control": MOCK_CACHE_CONTROL}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(content=image_bytes, media_type="image/png", headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
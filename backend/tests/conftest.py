@@ -0,0 +1,99 @@
+"""
+Shared fixtures: small synthetic Sentinel-2-like GeoTIFFs, and the API app
+running in a throwaway working directory (static/ and data/ are relative to
+the cwd, as under uvicorn).
+"""
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+APP_DIR = Path(__file__).resolve().parents[1] / "app"
+sys.path.insert(0, str(APP_DIR))
+
+CRS = "EPSG:32633"
+TRANSFORM = from_origin(500000, 4000000, 10, 10)
+
+
+def synthetic_scene(height: int, width: int, bands: int = 13, changed: bool = False, seed: int = 0) -> np.ndarray:
+    """bands x H x W uint16: smooth per-band fields plus noise; `changed` flips a square."""
+    y = np.arange(height, dtype=np.float32)[:, None] / height
+    x = np.arange(width, dtype=np.float32)[None, :] / width
+    rng = np.random.default_rng((seed, int(changed)))
+    out = np.empty((bands, height, width), dtype=np.uint16)
+    for b in range(bands):
+        field = 0.5 + 0.25 * np.sin(2 * np.pi * (2 + b % 5) * x + b) * np.cos(2 * np.pi * (1 + b % 3) * y)
+        field = field + rng.normal(0, 0.02, field.shape).astype(np.float32)
+        if changed:
+            inside = (np.abs(x - 0.4) < 0.1) & (np.abs(y - 0.6) < 0.1)
+            field = np.where(inside, 1.0 - field, field)
+        out[b] = np.clip(field * 4000 + 500, 0, 65535).astype(np.uint16)
+    return out
+
+
+def write_scene(path: Path, data: np.ndarray, transform=TRANSFORM, crs=CRS, **profile) -> Path:
+    count, height, width = data.shape
+    with rasterio.open(
+        path, "w", driver="GTiff", width=width, height=height, count=count, dtype=data.dtype.name,
+        crs=crs, transform=transform, **profile,
+    ) as dst:
+        dst.write(data)
+    return path
+
+
+@pytest.fixture(scope="session")
+def scene_pair(tmp_path_factory):
+    """(t0, t1) paths of a 13-band 300x260 pair with one changed square."""
+    root = tmp_path_factory.mktemp("scenes")
+    t0 = write_scene(root / "t0.tif", synthetic_scene(300, 260))
+    t1 = write_scene(root / "t1.tif", synthetic_scene(300, 260, changed=True))
+    return t0, t1
+
+
+@pytest.fixture(scope="session")
+def app_main(tmp_path_factory):
+    """The backend's main module, imported with a fresh working directory."""
+    workdir = tmp_path_factory.mktemp("app")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ.setdefault("DETECT_WORKERS", "1")
+    try:
+        import main
+
+        yield main
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(app_main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_main.app) as c:
+        yield c
+
+
+def upload(client, t0: Path, t1: Path) -> str:
+    with open(t0, "rb") as f0, open(t1, "rb") as f1:
+        r = client.post("/api/runs", files={"t0": ("t0.tif", f0), "t1": ("t1.tif", f1)})
+    assert r.status_code == 200, r.text
+    return r.json()["run_id"]
+
+
+def wait_done(client, run_id: str, timeout_s: float = 120.0) -> dict:
+    """Polls GET /api/runs/{id} until its job is done or failed."""
+    import time
+
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        run = client.get(f"/api/runs/{run_id}").json()
+        if run.get("job", {}).get("status") in ("done", "failed"):
+            return run
+        time.sleep(0.1)
+    raise TimeoutError(run_id)
@@ -0,0 +1,273 @@
+"""API flows against the app running its real job pool."""
+import hashlib
+import itertools
+import json
+import time
+
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+
+from conftest import CRS, TRANSFORM, synthetic_scene, upload, wait_done, write_scene
+
+_seeds = itertools.count(100)
+
+
+@pytest.fixture
+def new_pair(tmp_path):
+    """A scene pair no other test has detected (so not in the result cache)."""
+    seed = next(_seeds)
+    t0 = write_scene(tmp_path / "t0.tif", synthetic_scene(300, 260, seed=seed))
+    t1 = write_scene(tmp_path / "t1.tif", synthetic_scene(300, 260, changed=True, seed=seed))
+    return t0, t1
+
+
+@pytest.fixture(scope="module")
+def done_run(client, scene_pair):
+    """A finished run (detected here or answered from the result cache)."""
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    run = wait_done(client, run_id)
+    assert run["job"]["status"] == "done"
+    return run
+
+
+def test_detect_is_queued_then_polled(client, new_pair):
+    run_id = upload(client, *new_pair)
+    r = client.post(f"/api/runs/{run_id}/detect")
+    assert r.status_code == 202
+    assert r.json()["run_id"] == run_id
+    assert r.json()["job"]["status"] in ("queued", "running")
+
+    run = wait_done(client, run_id)
+    assert run["job"]["status"] == "done"
+    assert set(run["assets"]) >= {"t0_rgb", "t1_rgb", "heatmap", "overlay", "anomaly_u8"}
+    assert 0.0 < run["metrics"]["global"]["anomaly_pixels_pct"] < 100.0
+    assert client.get(run["assets"]["heatmap"]).status_code == 200
+
+    # same inputs again: answered from the result cache
+    run_id = upload(client, *new_pair)
+    r = client.post(f"/api/runs/{run_id}/detect")
+    assert r.status_code == 200
+    assert r.json()["cached"] and r.json()["run_id"] == run_id
+
+
+def test_uploads_are_stored_once_and_detect_is_cached_by_content(app_main, client, new_pair, tmp_path):
+    first = upload(client, *new_pair)
+    second = upload(client, *new_pair)
+    inputs = [json.loads((app_main.RUNS_DIR / r / "inputs.json").read_text()) for r in (first, second)]
+    for key, path in zip(("t0", "t1"), new_pair):
+        sha = hashlib.sha256(path.read_bytes()).hexdigest()
+        assert inputs[0][key]["sha256"] == inputs[1][key]["sha256"] == sha
+        blob = app_main.BLOBS.path(sha)
+        linked = [app_main.RUNS_DIR / r / f"{key}_{key}.tif" for r in (first, second)]
+        assert all(p.samefile(blob) for p in linked)
+
+    client.post(f"/api/runs/{first}/detect")
+    done = wait_done(client, first)
+    r = client.post(f"/api/runs/{second}/detect")
+    assert r.status_code == 200
+    cached = r.json()
+    assert cached["metrics"] == done["metrics"]
+    assert all(f"/runs/{second}/" in url for url in cached["assets"].values())
+    assert client.get(cached["assets"]["overlay"]).content == client.get(done["assets"]["overlay"]).content
+
+    # another t1: a different key, so a real detect
+    t1 = write_scene(tmp_path / "t1b.tif", synthetic_scene(300, 260, changed=True, seed=next(_seeds)))
+    third = upload(client, new_pair[0], t1)
+    assert client.post(f"/api/runs/{third}/detect").status_code == 202
+    assert wait_done(client, third)["job"]["status"] == "done"
+
+
+def _scrape(client):
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    series = {}
+    for line in r.text.splitlines():
+        if line and not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            series[name] = float(value)
+    return series
+
+
+def test_metrics_record_finished_runs(app_main, client, new_pair):
+    done = 'detect_runs_total{status="done"}'
+    total = 'detect_stage_seconds_count{stage="total",clock="wall"}'
+    before = _scrape(client)
+    run_id = upload(client, *new_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    timings = wait_done(client, run_id)["timings"]
+    deadline = time.monotonic() + 10  # observed by the job's on_finish hook
+    while _scrape(client).get(done, 0) == before.get(done, 0) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    after = _scrape(client)
+
+    assert after[done] == before.get(done, 0) + 1
+    assert after[total] == before.get(total, 0) + 1
+    wall = 'detect_stage_seconds_sum{stage="total",clock="wall"}'
+    assert after[wall] - before.get(wall, 0) == pytest.approx(timings["total"]["wall_s"])
+    for stage in timings["stages"]:
+        buckets = [v for k, v in after.items() if k.startswith(f'detect_stage_seconds_bucket{{stage="{stage}",clock="cpu",')]
+        assert buckets == sorted(buckets)
+        assert buckets[-1] == after[f'detect_stage_seconds_count{{stage="{stage}",clock="cpu"}}']
+    assert after["result_cache_bytes"] > 0
+
+
+def test_unknown_run_is_404(client):
+    assert client.post("/api/runs/doesnotexist/detect").status_code == 404
+    assert client.get("/api/runs/doesnotexist").status_code == 404
+
+
+def _leftover_uploads(app_main):
+    return list(app_main.BLOBS.root.glob(".upload-*"))
+
+
+def test_upload_rejects_unknown_format(app_main, client, scene_pair):
+    with open(scene_pair[1], "rb") as f1:
+        r = client.post("/api/runs", files={"t0": ("t0.jpg", b"\xff\xd8\xff\xe0" + bytes(4096)), "t1": ("t1.tif", f1)})
+    assert r.status_code == 415
+    assert "t0" in r.json()["detail"]
+    assert not _leftover_uploads(app_main)
+
+
+def test_upload_rejects_oversized(app_main, client, scene_pair, monkeypatch):
+    monkeypatch.setattr(app_main, "MAX_UPLOAD_BYTES", 64 * 1024)
+    with open(scene_pair[0], "rb") as f0, open(scene_pair[1], "rb") as f1:
+        r = client.post("/api/runs", files={"t0": ("t0.tif", f0), "t1": ("t1.tif", f1)})
+    assert r.status_code == 413
+    assert not _leftover_uploads(app_main)
+
+
+def test_tiles_carry_etag_and_revalidate(client, done_run):
+    tiles = done_run["tiles"]
+    url = tiles["url"].format(asset="heatmap", z=tiles["max_zoom"], x=0, y=0)
+    r = client.get(url)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == f"image/{tiles['format']}"
+    etag = r.headers["etag"]
+    assert "max-age" in r.headers["cache-control"]
+
+    r = client.get(url, headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["etag"] == etag and not r.content
+    assert client.get(url, headers={"If-None-Match": '"stale"'}).status_code == 200
+
+    assert client.get(tiles["url"].format(asset="heatmap", z=tiles["max_zoom"], x=99, y=99)).status_code == 404
+    assert client.get(tiles["url"].format(asset="anomaly", z=0, x=0, y=0)).status_code == 404
+
+
+def test_rethreshold_matches_metrics_of_persisted_maps(app_main, client, done_run):
+    run_id = done_run["run_id"]
+    r = client.get(f"/api/runs/{run_id}/threshold", params={"thr": 0.4321})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["threshold"] == 0.432
+
+    run_dir = app_main.RUNS_DIR / run_id
+    anom = np.load(run_dir / "anomaly.npy")
+    lc = np.load(run_dir / "landcover.npy")
+    assert body["metrics"] == app_main._metrics(anom, lc, 0.432)
+    assert body["metrics"]["global"]["anomaly_pixels_pct"] == pytest.approx((anom >= np.float32(0.432)).mean() * 100)
+    assert client.get(body["assets"]["overlay"]).status_code == 200
+
+    assert client.get(f"/api/runs/{run_id}/threshold", params={"thr": 1.5}).status_code == 422
+
+
+def test_rethreshold_before_detect_is_409(client, scene_pair):
+    run_id = upload(client, *scene_pair)
+    assert client.get(f"/api/runs/{run_id}/threshold", params={"thr": 0.5}).status_code == 409
+
+
+def test_batch_streams_one_line_per_pair(client, new_pair, tmp_path):
+    t0, t1 = new_pair
+    t2 = write_scene(tmp_path / "t2.tif", synthetic_scene(300, 260, changed=True, seed=7))
+    manifest = {"pairs": [{"name": "a", "t0": "base", "t1": "after"}, {"name": "b", "t0": "base", "t1": "other"}]}
+    with open(t0, "rb") as f0, open(t1, "rb") as f1, open(t2, "rb") as f2:
+        r = client.post("/api/batch", data={"manifest": json.dumps(manifest)}, files={
+            "base": ("t0.tif", f0), "after": ("t1.tif", f1), "other": ("t2.tif", f2),
+        })
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [p["name"] for p in lines[0]["batch"]] == ["a", "b"]
+    assert sorted(line["name"] for line in lines[1:]) == ["a", "b"]
+    for line in lines[1:]:
+        assert line["status"] == "done"
+        assert line["result"]["run_id"] == line["run_id"]
+        assert client.get(f"/api/runs/{line['run_id']}").json()["job"]["status"] == "done"
+
+
+def test_batch_runs_on_after_the_client_disconnects(app_main, client, new_pair, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_main.JOBS, "max_pending", 1)  # the second pair waits for a slot
+    stream = app_main._stream_batch
+
+    async def header_only(runs):
+        # the client reads the run ids and goes away
+        async for line in stream(runs):
+            yield line
+            return
+
+    monkeypatch.setattr(app_main, "_stream_batch", header_only)
+    t0, t1 = new_pair
+    t2 = write_scene(tmp_path / "t2.tif", synthetic_scene(300, 260, changed=True, seed=8))
+    manifest = {"pairs": [{"name": "a", "t0": "base", "t1": "after"}, {"name": "b", "t0": "base", "t1": "other"}]}
+    with open(t0, "rb") as f0, open(t1, "rb") as f1, open(t2, "rb") as f2:
+        r = client.post("/api/batch", data={"manifest": json.dumps(manifest)}, files={
+            "base": ("t0.tif", f0), "after": ("t1.tif", f1), "other": ("t2.tif", f2),
+        })
+    batch = json.loads(r.text)["batch"]
+    for p in batch:
+        assert app_main.RUN_INDEX.get(p["run_id"])["status"] in ("queued", "done")
+    for p in batch:
+        assert wait_done(client, p["run_id"])["job"]["status"] == "done"
+        # the index is updated by the job's on_finish hook, just after job.json
+        deadline = time.monotonic() + 10
+        while app_main.RUN_INDEX.get(p["run_id"])["status"] != "done" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert app_main.RUN_INDEX.get(p["run_id"])["status"] == "done"
+
+
+def test_batch_rejects_manifest_with_missing_files(client, scene_pair):
+    manifest = {"pairs": [{"name": "a", "t0": "base", "t1": "nope"}]}
+    with open(scene_pair[0], "rb") as f0:
+        r = client.post("/api/batch", data={"manifest": json.dumps(manifest)}, files={"base": ("t0.tif", f0)})
+    assert r.status_code == 400
+    assert "nope" in r.json()["detail"]
+
+
+def test_detect_and_quicklook_on_remainder_sizes(client, tmp_path):
+    # 1026 = TILE_SIZE + 2, and 513 px at scale 0.5 = the anomaly engine's 512 + 1
+    t0 = write_scene(tmp_path / "t0.tif", synthetic_scene(200, 1026, bands=4, seed=11))
+    t1 = write_scene(tmp_path / "t1.tif", synthetic_scene(200, 1026, bands=4, changed=True, seed=11))
+    run_id = upload(client, t0, t1)
+    r = client.post(f"/api/runs/{run_id}/detect", params={"preview": True, "scale": 0.5})
+    assert r.status_code == 200
+    assert r.json()["size"] == [513, 100]
+
+    client.post(f"/api/runs/{run_id}/detect")
+    run = wait_done(client, run_id)
+    assert run["job"]["status"] == "done", run["job"].get("error")
+    assert run["size"] == [1026, 200]
+
+
+def test_detect_writes_georeferenced_cogs(app_main, client, new_pair):
+    run_id = upload(client, *new_pair)
+    assert client.post(f"/api/runs/{run_id}/detect", params={"cog": 1}).status_code == 202
+    run = wait_done(client, run_id)
+    assert run["job"]["status"] == "done", run["job"].get("error")
+    run_dir = app_main.RUNS_DIR / run_id
+    anom = np.load(run_dir / "anomaly.npy")
+    expected = {
+        "anomaly": np.asarray(Image.open(run_dir / app_main.ASSET_FILES["anomaly_u8"])),
+        "mask": (anom >= run["threshold_suggestion"]).astype(np.uint8),
+        "landcover": np.load(run_dir / "landcover.npy"),
+    }
+    assert run["cog"]["crs"] == CRS
+    for key, data in expected.items():
+        with rasterio.open(app_main.STATIC_DIR / run["cog"][key].removeprefix("/static/")) as src:
+            assert src.tags(ns="IMAGE_STRUCTURE")["LAYOUT"] == "COG"
+            assert src.crs == CRS and src.transform == TRANSFORM
+            np.testing.assert_array_equal(src.read(1), data, err_msg=key)
+
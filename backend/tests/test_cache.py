@@ -0,0 +1,30 @@
+from utils.cache import ResultCache
+
+
+def _files(tmp_path, name, size):
+    f = tmp_path / "src" / name
+    f.parent.mkdir(exist_ok=True)
+    f.write_bytes(b"x" * size)
+    return [f]
+
+
+def test_stats_track_put_and_evict_without_scanning(tmp_path, monkeypatch):
+    cache = ResultCache(tmp_path / "results", max_bytes=2500)
+    cache.put("a", _files(tmp_path, "a.bin", 1000))
+    cache.put("b", _files(tmp_path, "b.bin", 1000))
+    monkeypatch.setattr(cache, "_scan", lambda: (_ for _ in ()).throw(AssertionError("scanned")))
+    assert cache.stats() == {"entries": 2, "bytes": 2000, "max_bytes": 2500}
+
+    monkeypatch.undo()
+    cache.put("c", _files(tmp_path, "c.bin", 1000))  # over budget: "a" goes
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 2, "bytes": 2000, "max_bytes": 2500}
+
+
+def test_stats_scan_once_without_a_record(tmp_path):
+    cache = ResultCache(tmp_path / "results", max_bytes=1 << 20)
+    assert cache.stats()["bytes"] == 0
+    cache.put("a", _files(tmp_path, "a.bin", 300))
+    (cache.root / ".stats.json").unlink()
+    assert cache.stats()["bytes"] == 300
+    assert (cache.root / ".stats.json").exists()
@@ -0,0 +1,236 @@
+"""
+The optimized paths against the straightforward computation they replaced,
+on small synthetic scenes.
+"""
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+from conftest import TRANSFORM, synthetic_scene, upload, wait_done, write_scene
+from utils import metrics, render
+from utils.anomaly import AnomalyEngine, anomaly_score
+from utils.assets import Encoder
+from utils.normalize import PCT, DNHistogram
+from utils.raster import open_scene, scene_stats, tile_grid
+from utils.regions import label_regions, regions_geojson
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16])
+def test_dn_histogram_matches_np_percentile(dtype):
+    rng = np.random.default_rng(3)
+    info = np.iinfo(dtype)
+    data = rng.integers(info.min, info.max, size=(4, 97, 131), endpoint=True).astype(dtype)
+    hist = DNHistogram(4, dtype)
+    for r in range(0, 97, 40):  # block by block, as scene_stats feeds it
+        hist.add(data[:, r:r + 40])
+    pct = (0.0, 2.0, 37.5, 98.0, 100.0)
+    expected = np.percentile(data.reshape(4, -1), pct, axis=1).T
+    np.testing.assert_allclose(hist.percentiles(pct), expected, rtol=1e-6)
+
+
+def test_scene_stats_match_np_percentile(tmp_path):
+    data = synthetic_scene(150, 170, bands=3)
+    path = write_scene(tmp_path / "s.tif", data)
+    with rasterio.open(path) as src:
+        stretch = scene_stats(src, [1, 2, 3], block=64)
+    expected = np.percentile(data.reshape(3, -1), PCT, axis=1)
+    np.testing.assert_allclose(stretch.lo, expected[0], rtol=1e-6)
+    np.testing.assert_allclose(stretch.hi, expected[1], rtol=1e-6)
+
+
+@pytest.mark.parametrize("size", [7, 64, 65, 66, 67, 130])
+def test_tile_windows_fit_the_ssim_window(size):
+    grid = tile_grid(size, size + 1, 64, overlap=3, min_window=7)
+    covered = np.zeros((size, size + 1), dtype=int)
+    for tile in grid:
+        assert tile.window.height >= 7 and tile.window.width >= 7
+        rows, cols = tile.window.toslices()
+        core = np.zeros((size, size + 1), dtype=bool)[rows, cols][tile.core]
+        assert core.shape == covered[tile.dst].shape
+        covered[tile.dst] += 1
+    assert (covered == 1).all()
+
+
+def _rgb_pair(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    t0 = rng.random((h, w, 3), dtype=np.float32)
+    t1 = t0.copy()
+    t1[h // 3:h // 2, w // 4:w // 2] = rng.random((h // 2 - h // 3, w // 2 - w // 4, 3), dtype=np.float32)
+    return t0, t1
+
+
+# 1-3 px remainders leave edge tiles thinner than the SSIM window unless grown
+@pytest.mark.parametrize("shape", [(203, 317), (65, 194), (131, 67), (7, 515)])
+def test_tiled_ssim_matches_whole_scene(shape):
+    t0, t1 = _rgb_pair(*shape)
+    score, lo, hi = AnomalyEngine(workers=3, tile_size=64).score_map(t0, t1)
+    whole = anomaly_score(t0, t1)
+    np.testing.assert_array_equal(score, whole)
+    assert (lo, hi) == (float(whole.min()), float(whole.max()))
+
+
+def test_bincount_metrics_match_masks(monkeypatch):
+    monkeypatch.setattr(metrics, "BLOCK_PIXELS", 1000)  # several row blocks
+    rng = np.random.default_rng(5)
+    anom = rng.random((120, 90), dtype=np.float32)
+    anom_u8 = render.quantize(anom)
+    lc = rng.integers(0, 4, size=anom.shape).astype(np.uint8)
+    lc[lc == 2] = 1  # a class with no pixels
+    thresholds = [0.7, 0.2, 0.5]
+
+    stats = metrics.anomaly_stats(anom, anom_u8, lc, 4, thresholds)
+    assert stats.thresholds.tolist() == pytest.approx(sorted(thresholds))
+    for k in range(4):
+        assert stats.pixels[k] == (lc == k).sum()
+        for j, thr in enumerate(sorted(thresholds)):
+            assert stats.anomalies[k, j] == ((lc == k) & (anom >= np.float32(thr))).sum()
+    assert stats.score_sum == pytest.approx(float(anom.sum(dtype=np.float64)))
+    assert stats.percentile(95.0) == pytest.approx(min(1.0, (np.percentile(anom_u8, 95.0) + 0.5) / 255.0))
+
+
+def test_tiled_resampling_matches_cv2_resize(tmp_path):
+    h, w = 192, 180
+    scene_dir = tmp_path / "bands"
+    scene_dir.mkdir()
+    full = synthetic_scene(h, w, bands=1, seed=1)
+    bands = {"B02.tif": (full, 10), "B05.tif": (synthetic_scene(h // 2, w // 2, bands=1, seed=2), 20),
+             "B09.tif": (synthetic_scene(h // 6, w // 6, bands=1, seed=3), 60)}
+    for name, (data, res) in bands.items():
+        write_scene(scene_dir / name, data, transform=from_origin(500000, 4000000, res, res))
+
+    with open_scene(scene_dir) as scene:
+        assert (scene.height, scene.width, scene.count) == (h, w, 3)
+        for tile in tile_grid(h, w, 64, overlap=0):
+            got = scene.read([1, 2, 3], tile.window)
+            rows, cols = tile.window.toslices()
+            for k, (data, _) in enumerate(bands.values()):
+                expected = cv2.resize(data[0].astype(np.float32), (w, h), interpolation=cv2.INTER_LINEAR)
+                np.testing.assert_array_equal(got[k], expected[rows, cols])
+
+
+@pytest.mark.parametrize("decoded_cache", [True, False])
+@pytest.mark.parametrize("window", [(37, 50, 144, 163), (0, 0, 2, 2), (258, 297, 2, 3)])
+def test_roi_equals_crop_of_full_run(app_main, client, scene_pair, monkeypatch, decoded_cache, window):
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    full = wait_done(client, run_id)
+    if not decoded_cache:
+        monkeypatch.setattr(app_main, "SCENES", None)  # windowed reads of the GeoTIFFs
+    col, row, w, h = window
+    resp = client.post(f"/api/runs/{run_id}/detect", params={"bbox": f"{col},{row},{col + w},{row + h}"})
+    assert resp.status_code == 200
+    roi = resp.json()
+    assert roi["normalization"] == "scene"
+    assert roi["roi"]["window"] == list(window)
+    assert roi["threshold_suggestion"] == full["threshold_suggestion"]
+
+    def asset(url):
+        return np.asarray(Image.open(app_main.STATIC_DIR / url.removeprefix("/static/")))
+
+    for key in ("anomaly_u8", "landcover", "t0_rgb", "t1_rgb"):
+        np.testing.assert_array_equal(asset(roi["assets"][key]), asset(full["assets"][key])[row:row + h, col:col + w], err_msg=key)
+
+
+def test_inline_roi_leaves_allocation_tracing_off(app_main, client, scene_pair, monkeypatch):
+    monkeypatch.setattr(app_main, "PROFILE_ALLOC", True)
+    run_id = upload(client, *scene_pair)
+    r = client.post(f"/api/runs/{run_id}/detect", params={"bbox": "10,10,60,60"})
+    assert r.status_code == 200
+    assert not tracemalloc.is_tracing()
+
+
+def test_regions_match_their_components():
+    anom = np.zeros((60, 80), dtype=np.float32)
+    anom[5:25, 10:40] = np.linspace(0.6, 1.0, 30, dtype=np.float32)
+    anom[12:16, 20:24] = 0.0  # a hole
+    anom[40:50, 50:56] = 0.7
+    anom[55, 2] = 0.8  # below min_pixels
+    lc = np.zeros(anom.shape, dtype=np.uint8)
+    lc[:, 30:] = 2
+    regions = label_regions(anom, lc, 0.5, 4)
+    geojson = regions_geojson(regions, TRANSFORM, class_names={0: "a", 2: "c"}, min_pixels=4, simplify_px=0)
+
+    assert geojson["properties"]["regions_total"] == 3
+    features = geojson["features"]
+    assert [f["properties"]["landcover"] for f in features] == ["a", "c"]  # largest first
+    for f in features:
+        mask = regions.labels == f["id"]
+        rows, cols = np.nonzero(mask)
+        props = f["properties"]
+        assert props["area_px"] == mask.sum()
+        assert props["score_mean"] == pytest.approx(anom[mask].mean(), abs=1e-4)
+        assert props["bbox_px"] == [cols.min(), rows.min(), np.ptp(cols) + 1, np.ptp(rows) + 1]
+        assert props["landcover_fraction"] == pytest.approx(np.mean(lc[mask] == np.bincount(lc[mask]).argmax()), abs=1e-4)
+        # rings run through boundary pixel centres, in map units
+        exterior = np.array(f["geometry"]["coordinates"][0])
+        x0, y0 = TRANSFORM * (cols.min() + 0.5, rows.min() + 0.5)
+        x1, y1 = TRANSFORM * (cols.max() + 0.5, rows.max() + 0.5)
+        np.testing.assert_allclose(exterior.min(axis=0), [x0, y1])
+        np.testing.assert_allclose(exterior.max(axis=0), [x1, y0])
+    assert [len(f["geometry"]["coordinates"]) for f in features] == [2, 1]
+
+
+class _RecordingEncoder(Encoder):
+    """Keeps the pixels of every file it saves, by file name."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.saved = {}
+
+    def save(self, arr, path, lossless=False):
+        self.saved[Path(path).name] = np.array(arr)
+        super().save(arr, path, lossless=lossless)
+
+
+def test_lazy_assets_match_eager_ones_with_a_lossy_encoder(app_main, client, scene_pair, monkeypatch):
+    enc = _RecordingEncoder("webp", workers=1)
+    files = {k: f"{name}.webp" for k, name in app_main.ASSET_NAMES.items()}
+    monkeypatch.setattr(app_main, "ENCODER", enc)
+    monkeypatch.setattr(app_main, "ASSET_FILES", files)
+    run_id = upload(client, *scene_pair)
+    run_dir = app_main.RUNS_DIR / run_id
+
+    app_main._run_detect(run_id)
+    eager = {k: enc.saved[files[k]] for k in app_main.LAZY_KEYS}
+
+    monkeypatch.setattr(app_main, "LAZY_ASSETS", True)
+    app_main._run_detect(run_id)
+    for key in app_main.LAZY_KEYS:
+        assert not (run_dir / files[key]).exists()
+        assert app_main._render_lazy_asset(f"runs/{run_id}/{files[key]}")
+    lazy = {k: enc.saved[files[k]] for k in app_main.LAZY_KEYS}
+
+    # |q(t1) - q(t0)| vs q(|t1 - t0|); decoding the lossy t0/t1 assets is far off
+    assert np.abs(lazy["diff_rgb"].astype(np.int16) - eager["diff_rgb"]).max() <= 1
+    np.testing.assert_array_equal(lazy["overlay"], eager["overlay"])
+
+
+def test_lut_rendering_is_bit_identical_to_float_rendering():
+    rng = np.random.default_rng(9)
+    anom = rng.random((70, 90), dtype=np.float32) * 1.2 - 0.1  # out-of-range values clip
+    rgb = rng.random((70, 90, 3), dtype=np.float32)
+    anom_u8 = render.quantize(anom)
+    np.testing.assert_array_equal(anom_u8, (np.clip(anom, 0, 1) * 255).astype(np.uint8))
+
+    hot = cv2.cvtColor(cv2.applyColorMap(anom_u8, cv2.COLORMAP_HOT), cv2.COLOR_BGR2RGB)
+    np.testing.assert_array_equal(render.heatmap(anom_u8), hot)
+
+    # the overlay blend as it was computed per pixel before the LUT
+    base = render.quantize(rgb)
+    mask = anom >= 0.6
+    blended = base.copy()
+    blended[mask] = (0.65 * blended[mask] + 0.35 * np.array([255, 0, 0], dtype=np.float32)).astype(np.uint8)
+    np.testing.assert_array_equal(render.overlay(base, mask, render.blend_lut((255, 0, 0), 0.35)), blended)
+
+    colors = {0: (200, 0, 0), 1: (0, 200, 0), 3: (0, 0, 255)}
+    lc = rng.integers(0, 4, size=anom.shape).astype(np.uint8)
+    expected = np.zeros((*lc.shape, 3), dtype=np.uint8)
+    for k, c in colors.items():
+        expected[lc == k] = c
+    np.testing.assert_array_equal(render.apply_lut(lc, render.palette_lut(colors)), expected)
@@ -0,0 +1,27 @@
+import json
+
+from conftest import upload, wait_done
+
+
+def _events(body: str):
+    out = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "data" in fields:
+            out.append((fields.get("event"), json.loads(fields["data"])))
+    return out
+
+
+def test_never_detected_run_closes_with_idle(client, scene_pair):
+    run_id = upload(client, *scene_pair)
+    r = client.get(f"/api/runs/{run_id}/events")
+    assert r.status_code == 200
+    assert _events(r.text) == [("status", {"event": "status", "status": "idle"})]
+
+
+def test_finished_run_stream_ends_with_done(client, scene_pair):
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    wait_done(client, run_id)
+    events = _events(client.get(f"/api/runs/{run_id}/events").text)
+    assert events[-1][0] == "status" and events[-1][1]["status"] == "done"
@@ -0,0 +1,44 @@
+"""The demo server in backend/main.py: seeded mock assets, served with ETags."""
+import importlib.util
+import io
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+# loaded by path: the API under app/ is also a `main` module
+_spec = importlib.util.spec_from_file_location("mock_main", Path(__file__).resolve().parents[1] / "main.py")
+mock_main = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mock_main)
+
+
+@pytest.fixture(scope="module")
+def mock_client():
+    return TestClient(mock_main.app)
+
+
+@pytest.mark.parametrize("asset_type", [*mock_main.MOCK_ASSETS, "landcover"])
+def test_same_seed_renders_the_same_image(asset_type):
+    first = mock_main.create_mock_image(asset_type)
+    assert mock_main.create_mock_image(asset_type) == first
+    rgb = np.asarray(Image.open(io.BytesIO(first)))
+    assert rgb.shape == (mock_main.MOCK_SIZE, mock_main.MOCK_SIZE, 3)
+
+
+def test_assets_are_shared_across_runs_and_revalidate(mock_client):
+    a = mock_client.get("/api/assets/run-a/heatmap")
+    b = mock_client.get("/api/assets/run-b/heatmap")
+    assert a.status_code == b.status_code == 200
+    assert a.content == b.content == mock_main.create_mock_image("heatmap")
+    etag = a.headers["etag"]
+    assert b.headers["etag"] == etag
+    assert mock_client.get("/api/assets/run-a/t0_rgb").headers["etag"] != etag
+
+    r = mock_client.get("/api/assets/run-c/heatmap", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+    r = mock_client.get("/api/assets/run-c/heatmap", headers={"If-None-Match": '"stale"'})
+    assert r.status_code == 200
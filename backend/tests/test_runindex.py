@@ -0,0 +1,65 @@
+import shutil
+import time
+
+from fastapi.testclient import TestClient
+
+from conftest import upload, wait_done
+from utils.cache import tree_size
+from utils.runindex import RunIndex
+
+
+def test_size_counts_derived_outputs(app_main, client, scene_pair):
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    wait_done(client, run_id)
+    run_dir = app_main.RUNS_DIR / run_id
+    detected = app_main.RUN_INDEX.get(run_id)["bytes"]
+
+    r = client.post(f"/api/runs/{run_id}/detect", params={"bbox": "10,20,110,140"})
+    assert r.status_code == 200
+    r = client.post(f"/api/runs/{run_id}/detect", params={"preview": True, "scale": 0.5})
+    assert r.status_code == 200
+    derived = tree_size(run_dir / "roi") + tree_size(run_dir / "quicklook")
+    assert derived > 0
+    assert app_main.RUN_INDEX.get(run_id)["bytes"] == detected + derived
+
+
+def test_unindexed_runs_are_served_right_after_startup(app_main, client, scene_pair, monkeypatch):
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    wait_done(client, run_id)
+    legacy = "legacy" + run_id[:8]
+    shutil.copytree(app_main.RUNS_DIR / run_id, app_main.RUNS_DIR / legacy)
+    assert client.get(f"/api/runs/{legacy}").status_code == 404
+
+    backfill = app_main._backfill_index
+
+    def slow_backfill():
+        time.sleep(0.5)
+        return backfill()
+
+    monkeypatch.setattr(app_main, "_backfill_index", slow_backfill)
+    with TestClient(app_main.app) as restarted:
+        r = restarted.get(f"/api/runs/{legacy}")
+    assert r.status_code == 200
+    assert app_main.RUN_INDEX.get(legacy)["pinned"]
+
+
+def test_retention_skips_leased_runs(app_main, client, scene_pair, monkeypatch, tmp_path):
+    run_id = upload(client, *scene_pair)
+    index = RunIndex(tmp_path / "runs.sqlite")
+    index.add(run_id, {})
+    monkeypatch.setattr(app_main, "RUN_INDEX", index)
+    monkeypatch.setattr(app_main, "RUNS_MAX_BYTES", -1)  # every run is over budget
+
+    # e.g. an ROI job queued by another API worker
+    holder = f"roi-{run_id}-0_0_64_64"
+    assert index.lease(run_id, holder, ttl=60)
+    assert app_main._enforce_retention()["runs_removed"] == 0
+    assert (app_main.RUNS_DIR / run_id).exists()
+
+    index.release(run_id, holder)
+    index.lease(run_id, "crashed-worker", ttl=-1)  # expired leases don't count
+    assert app_main._enforce_retention()["runs_removed"] == 1
+    assert not (app_main.RUNS_DIR / run_id).exists()
+    assert not index.lease(run_id, holder, ttl=60)
@@ -0,0 +1,48 @@
+import numpy as np
+
+from conftest import synthetic_scene, upload, wait_done, write_scene
+
+
+def test_identical_pair_shares_one_decoded_stack(client, app_main, tmp_path):
+    # same upload as t0 and t1: one cache key, decoded once, zero change.
+    # Larger than one detect tile, so both sides would be mid-write at once.
+    t0 = write_scene(tmp_path / "same.tif", synthetic_scene(1100, 1050, bands=4))
+    run_id = upload(client, t0, t0)
+    r = client.post(f"/api/runs/{run_id}/detect")
+    assert r.status_code in (200, 202)
+    run = wait_done(client, run_id)
+    assert run["job"]["status"] == "done", run["job"]
+    anom = np.load(app_main.RUNS_DIR / run_id / "anomaly.npy")
+    assert not anom.any()
+
+
+def test_cache_hit_matches_decode(client, app_main, scene_pair, tmp_path):
+    from utils.raster import iter_tiles, open_scene, tile_grid
+    from utils.scenecache import DecodedSceneCache
+
+    cache = DecodedSceneCache(tmp_path, max_bytes=1 << 30)
+    _, t1 = scene_pair
+    bands = [2, 3, 4, 8]
+    with open_scene(t1) as src:
+        grid = tile_grid(src.height, src.width, 128, 16)
+        direct = [arr for _, arr in iter_tiles(src, grid, bands)]
+        written = [arr for _, arr in cache.tiles("k", src, grid, bands, full=True)]
+        cached = [arr for _, arr in cache.tiles("k", src, grid, bands, full=True)]
+    assert cache.open("k", bands) is not None
+    for a, b, c in zip(direct, written, cached):
+        np.testing.assert_array_equal(a, b)
+        np.testing.assert_array_equal(a, c)
+
+
+def test_two_writers_of_one_entry(scene_pair, tmp_path):
+    # interleaved write-through of the same key: both commit, neither fails
+    from utils.raster import open_scene, tile_grid
+    from utils.scenecache import DecodedSceneCache
+
+    cache = DecodedSceneCache(tmp_path, max_bytes=1 << 30)
+    t0, _ = scene_pair
+    with open_scene(t0) as a, open_scene(t0) as b:
+        grid = tile_grid(a.height, a.width, 128, 16)
+        for _ in zip(cache.tiles("k", a, grid, [2, 3], full=True), cache.tiles("k", b, grid, [2, 3], full=True)):
+            pass
+    assert sorted(p.name for p in (tmp_path / "k").iterdir()) == [".used", "b02.npy", "b03.npy"]
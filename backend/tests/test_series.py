@@ -0,0 +1,56 @@
+"""Time-series runs: scenes appended one by one, each compared with the previous."""
+import time
+
+from conftest import synthetic_scene, write_scene
+
+
+def _append(client, series_id, path):
+    with open(path, "rb") as f:
+        r = client.post(f"/api/series/{series_id}/scenes", files={"scene": (path.name, f)})
+    assert r.status_code == 202, r.text
+    return r.json()["index"]
+
+
+def _wait_series(client, series_id, count, timeout_s=120.0):
+    """Polls the series until `count` scenes have a result."""
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        series = client.get(f"/api/series/{series_id}").json()
+        assert (series["job"] or {}).get("status") != "failed", series["job"]["error"]
+        if sum(s["result"] is not None for s in series["scenes"]) >= count:
+            return series
+        time.sleep(0.1)
+    raise TimeoutError(series_id)
+
+
+def test_series_on_remainder_sizes(client, tmp_path):
+    # 1026 = TILE_SIZE + 2: the last tile column is narrower than the SSIM window
+    series_id = client.post("/api/series").json()["series_id"]
+    for k in range(2):
+        path = write_scene(tmp_path / f"s{k}.tif", synthetic_scene(200, 1026, bands=4, changed=bool(k), seed=21))
+        assert _append(client, series_id, path) == k
+    steps = [s["result"] for s in _wait_series(client, series_id, 2)["scenes"]]
+    for step in steps:
+        assert "error" not in step, step.get("error")
+        assert step["size"] == [1026, 200]
+    assert steps[1]["compared_to"] == 0
+    assert 0.0 < steps[1]["metrics"]["global"]["anomaly_pixels_pct"] < 100.0
+
+
+def test_series_skips_misaligned_scenes_and_builds_a_baseline(client, tmp_path):
+    series_id = client.post("/api/series").json()["series_id"]
+    scenes = [
+        synthetic_scene(120, 140, bands=4, seed=22),
+        synthetic_scene(120, 140, bands=4, changed=True, seed=22),
+        synthetic_scene(100, 140, bands=4, seed=22),  # another footprint
+        synthetic_scene(120, 140, bands=4, changed=True, seed=23),
+    ]
+    for k, data in enumerate(scenes):
+        _append(client, series_id, write_scene(tmp_path / f"s{k}.tif", data))
+    steps = [s["result"] for s in _wait_series(client, series_id, len(scenes))["scenes"]]
+
+    assert "metrics" not in steps[0] and steps[1]["compared_to"] == 0
+    assert "line up" in steps[2]["error"]
+    assert steps[3]["compared_to"] == 1
+    assert steps[3]["baseline"]["scenes"] == 2
+    assert client.get(steps[3]["assets"]["deviation"]).status_code == 200
@@ -0,0 +1,19 @@
+import time
+
+from conftest import upload, wait_done
+from utils.normalize import STRETCH_CACHE
+
+
+def test_reupload_reuses_persisted_stretch(app_main, client, scene_pair, monkeypatch):
+    run_id = upload(client, *scene_pair)
+    client.post(f"/api/runs/{run_id}/detect")
+    wait_done(client, run_id)
+    stored = sorted(STRETCH_CACHE.root.glob("*.json"))
+    assert stored
+
+    monkeypatch.setattr(app_main, "SCENES", None)  # read the scenes, not their decoded stacks
+    time.sleep(0.01)  # the blob store touches the blob on re-upload
+    run_id = upload(client, *scene_pair)
+    r = client.post(f"/api/runs/{run_id}/detect", params={"bbox": "0,0,64,64"})
+    assert r.status_code == 200
+    assert sorted(STRETCH_CACHE.root.glob("*.json")) == stored
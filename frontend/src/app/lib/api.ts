@@ -0,0 +1,138 @@
+// Client for the FastAPI backend (backend/app/main.py).
+//
+// Detect runs as a background job: POST /api/runs/{id}/detect answers 202
+// with the job status (or 200 with the result when it is cached), and
+// GET /api/runs/{id} returns {run_id, job} until the job has finished;
+// GET /api/runs/{id}/events streams the job's progress as Server-Sent Events.
+
+export const API_BASE = process.env.NEXT_PUBLIC_API_BASE ?? "http://localhost:8000";
+
+export type JobStatus = {
+  status: "queued" | "running" | "done" | "failed";
+  stage: string;
+  progress: number;
+  error: string | null;
+};
+
+export type Metrics = {
+  global: { anomaly_pixels_pct: number; score_mean: number; score_p95: number };
+  by_category: Record<string, { anomaly_pixels_pct: number; pixels: number }>;
+};
+
+export type DetectResult = {
+  run_id: string;
+  size: [number, number];
+  assets: Record<"t0_rgb" | "t1_rgb" | "diff_rgb" | "heatmap" | "overlay" | "anomaly_u8" | "landcover", string>;
+  metrics: Metrics;
+  threshold_suggestion: number;
+  landcover_labels: Record<string, number>;
+  job?: JobStatus;
+};
+
+export type RunResponse = DetectResult | { run_id: string; job: JobStatus };
+
+export function absUrl(path: string): string {
+  return path.startsWith("http") ? path : `${API_BASE}${path}`;
+}
+
+function isResult(r: RunResponse): r is DetectResult {
+  return "assets" in r;
+}
+
+async function errorOf(res: Response): Promise<Error> {
+  const body = await res.json().catch(() => null);
+  return new Error(body?.detail ?? `${res.status} ${res.statusText}`);
+}
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export async function createRun(t0: File, t1: File): Promise<string> {
+  const form = new FormData();
+  form.append("t0", t0);
+  form.append("t1", t1);
+  const res = await fetch(`${API_BASE}/api/runs`, { method: "POST", body: form });
+  if (!res.ok) throw await errorOf(res);
+  return (await res.json()).run_id;
+}
+
+/** Starts detect; a full queue (429) is retried after its Retry-After. */
+export async function detectRun(runId: string): Promise<RunResponse> {
+  for (;;) {
+    const res = await fetch(`${API_BASE}/api/runs/${runId}/detect`, { method: "POST" });
+    if (res.status === 429) {
+      await sleep(Number(res.headers.get("Retry-After") ?? 5) * 1000);
+      continue;
+    }
+    if (!res.ok) throw await errorOf(res);
+    return res.json();
+  }
+}
+
+export async function getRun(runId: string, signal?: AbortSignal): Promise<RunResponse> {
+  const res = await fetch(`${API_BASE}/api/runs/${runId}`, { cache: "no-store", signal });
+  if (!res.ok) throw await errorOf(res);
+  return res.json();
+}
+
+/**
+ * Polls the run until its detect job is done (returns the result) or failed
+ * (throws). Aborting `signal` stops the polling.
+ */
+export async function waitForRun(
+  runId: string,
+  onProgress?: (job: JobStatus) => void,
+  signal?: AbortSignal,
+  intervalMs = 1000,
+): Promise<DetectResult> {
+  for (;;) {
+    signal?.throwIfAborted();
+    const run = await getRun(runId, signal);
+    if (isResult(run)) return run;
+    if (run.job.status === "failed") throw new Error(run.job.error ?? "Detection failed");
+    onProgress?.(run.job);
+    await sleep(intervalMs);
+  }
+}
+
+/**
+ * Follows the run's event stream until its detect job is done (returns the
+ * result) or failed (throws). Falls back to polling with waitForRun where
+ * EventSource is unavailable or the stream drops. Aborting `signal` stops it.
+ */
+export async function watchRun(
+  runId: string,
+  onProgress?: (job: JobStatus) => void,
+  signal?: AbortSignal,
+): Promise<DetectResult> {
+  if (typeof EventSource !== "undefined") {
+    await new Promise<void>((resolve, reject) => {
+      const source = new EventSource(`${API_BASE}/api/runs/${runId}/events`);
+      let job: JobStatus = { status: "queued", stage: "queued", progress: 0, error: null };
+      const close = (settle: () => void) => {
+        source.close();
+        signal?.removeEventListener("abort", onAbort);
+        settle();
+      };
+      const onAbort = () => close(() => reject(signal?.reason));
+      if (signal?.aborted) return onAbort();
+      signal?.addEventListener("abort", onAbort);
+
+      source.addEventListener("progress", (e) => {
+        const { stage, progress } = JSON.parse((e as MessageEvent).data);
+        job = { ...job, status: "running", stage, progress };
+        onProgress?.(job);
+      });
+      source.addEventListener("status", (e) => {
+        const { status, error } = JSON.parse((e as MessageEvent).data);
+        if (status === "failed") return close(() => reject(new Error(error ?? "Detection failed")));
+        // done: the result is one GET away; idle: no job yet, so poll for it
+        if (status === "done" || status === "idle") return close(resolve);
+        job = { ...job, status };
+        onProgress?.(job);
+      });
+      // the stream ends once the job finishes; an error before that means polling
+      source.onerror = () => close(resolve);
+    });
+  }
+  return waitForRun(runId, onProgress, signal);
+}
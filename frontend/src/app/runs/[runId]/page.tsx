@@ -2,7 +2,7 @@
 
 import { useState, useEffect } from "react";
 import { useRouter } from "next/navigation";
-import { getRun, absUrl, type DetectResult } from "../../lib/api";
+import { watchRun, absUrl, type DetectResult, type JobStatus } from "../../lib/api";
 import ImageCompareSlider from "../../../components/ImageCompareSlider";
 
 export default function RunPage({ params }: { params: Promise<{ runId: string }> }) {
@@ -10,6 +10,7 @@ export default function RunPage({ params }: { params: Promise<{ runId: string }>
   const [run, setRun] = useState<DetectResult | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [job, setJob] = useState<JobStatus | null>(null);
   const [runId, setRunId] = useState<string>("");
 
   useEffect(() => {
@@ -23,17 +24,20 @@ export default function RunPage({ params }: { params: Promise<{ runId: string }>
   useEffect(() => {
     if (!runId) return;
     
+    // detect runs in the background: follow its events (or poll) until the job is done or failed
+    const abort = new AbortController();
     async function loadRun() {
       try {
-        const data = await getRun(runId);
+        const data = await watchRun(runId, setJob, abort.signal);
         setRun(data);
       } catch (e: any) {
+        if (abort.signal.aborted) return;
         setError(e.message);
-      } finally {
-        setLoading(false);
       }
+      setLoading(false);
     }
     loadRun();
+    return () => abort.abort();
   }, [runId]);
 
   if (loading) {
@@ -41,7 +45,11 @@ export default function RunPage({ params }: { params: Promise<{ runId: string }>
       <div className="min-h-screen bg-gray-50 flex items-center justify-center">
         <div className="text-center">
           <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-600"></div>
-          <p className="mt-4 text-gray-600">Loading detection results...</p>
+          <p className="mt-4 text-gray-600">
+            {job
+              ? `Detecting (${job.stage ?? job.status}) ${Math.round((job.progress ?? 0) * 100)}%`
+              : "Loading detection results..."}
+          </p>
         </div>
       </div>
     );